@@ -15,6 +15,11 @@ if __name__ == "__main__":
     # Comment this after first run if corpus is stable
     ingest_pdfs(pdfs)
 
+    # optional: refill the answer cache from logged traffic while serving
+    if os.getenv("CACHE_WARM") == "1":
+        from warm import warm_in_background
+        warm_in_background()
+
     # 2) Queries
     print("Q1:", run_agent("What is section 3.1 about? Provide a brief answer and cite the source path."))
     print("Q2:", run_agent("Compute (17*24)+5 and show the final number."))
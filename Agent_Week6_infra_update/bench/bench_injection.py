@@ -0,0 +1,51 @@
+# bench/bench_injection.py
+# Legacy backtracking regex vs safety.scanner on adversarial inputs (1KB .. 1MB).
+# Run from the Week-6 folder:  python -m bench.bench_injection [--legacy-max 100000]
+
+import re, sys, time, argparse
+from safety.scanner import scan
+
+_LEGACY = re.compile("|".join([
+    r"\bignore (all|previous|earlier) (instructions|prompts)\b",
+    r"\boverride\b.*\bsystem\b",
+    r"\bdisregard\b.*\brules\b",
+    r"\bprint\b.*\bsystem prompt\b",
+    r"\bshow\b.*\bconfidential\b",
+    r"\breturn\b.*\btool schema\b",
+]), re.IGNORECASE)
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+def _fill(unit: str, n: int) -> str:
+    return (unit * (n // len(unit) + 1))[:n]
+
+# each input is one long line, so every trigger word makes `.*` run to the end of the line
+INPUTS = {
+    "trigger_words": lambda n: _fill("override disregard print show return ", n),
+    "near_miss_phrase": lambda n: _fill("print the system prompts ", n),
+    "benign_prose": lambda n: _fill("The committee reviewed the quarterly report and approved the budget. ", n),
+}
+
+def _time(fn, text, min_s=0.2):
+    runs, t0 = 0, time.perf_counter()
+    while True:
+        fn(text); runs += 1
+        dt = time.perf_counter() - t0
+        if dt >= min_s or runs >= 1000:
+            return dt / runs
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--legacy-max", type=int, default=100_000, help="skip the legacy regex above this size")
+    a = ap.parse_args(argv)
+    print(f"{'input':<18}{'size':>10}{'legacy_ms':>12}{'scanner_ms':>12}{'scanner_MB/s':>14}")
+    for name, make in INPUTS.items():
+        for n in SIZES:
+            text = make(n)
+            legacy = _time(lambda t: _LEGACY.search(t), text) * 1e3 if n <= a.legacy_max else None
+            new = _time(scan, text)
+            print(f"{name:<18}{n:>10}{(f'{legacy:.2f}' if legacy is not None else 'skipped'):>12}"
+                  f"{new*1e3:>12.2f}{n/new/1e6:>14.1f}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
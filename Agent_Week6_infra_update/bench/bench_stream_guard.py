@@ -0,0 +1,43 @@
+# bench/bench_stream_guard.py
+# Per-token overhead of safety.stream_guard.OutputGuard on a long streamed answer.
+# Run from the Week-6 folder:  python -m bench.bench_stream_guard [--tokens 20000]
+
+import sys, time, argparse
+from safety.stream_guard import OutputGuard
+
+_TEXT = ("According to docs/The_Intelligent_Investor.pdf, section 3.1 explains that a margin of safety "
+         "protects the investor against errors of judgment. The author returns to this idea often. ")
+
+def _tokens(n):
+    words = _TEXT.split(" ")
+    return [(words[i % len(words)] + " ") for i in range(n)]     # ~word-sized tokens, like the API
+
+def _fake_moderate_many(texts):
+    return [{"flagged": False} for _ in texts]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tokens", type=int, default=20_000)
+    a = ap.parse_args(argv)
+    toks = _tokens(a.tokens)
+
+    t0 = time.perf_counter()
+    buf = []
+    for t in toks:
+        buf.append(t)                   # what the agent does without a guard
+    base = time.perf_counter() - t0
+
+    for label, mod in (("scan only", None), ("scan + moderation", _fake_moderate_many)):
+        g = OutputGuard(moderate_many=mod)
+        t0 = time.perf_counter()
+        for t in toks:
+            g.feed(t)
+        g.close()
+        dt = time.perf_counter() - t0
+        per_tok = (dt - base) / len(toks) * 1e6
+        print(f"{label:<18} tokens={len(toks)} total_ms={dt*1e3:.1f} overhead_us/token={per_tok:.2f} "
+              f"tripped={bool(g.tripped)}")
+    print("for scale: a streamed token typically arrives every 10-40 ms (10,000-40,000 us)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
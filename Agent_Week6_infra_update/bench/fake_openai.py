@@ -0,0 +1,241 @@
+# bench/fake_openai.py
+# Local OpenAI-compatible stub for load tests: /v1/chat/completions (plain + streamed),
+# /v1/embeddings, /v1/moderations. No real model behind it — each chat request is answered
+# from a tool-call script picked by regex on the last user message.
+#   python -m bench.fake_openai --port 8399 --latency-ms 400 --jitter-ms 150
+#   export OPENAI_BASE_URL=http://127.0.0.1:8399/v1
+#
+# Script file (--scripts): [{"match": "<regex>", "steps": [{"tool": "calculator", "args": {...}}, ..., {"answer": "..."}]}]
+# Step i is played on round i of the conversation (rounds = assistant tool-call turns since the user
+# message). Strings in args/answer may use {0}, {1}... (regex groups), {q} (user message),
+# {system} (the system message), {last} (content of the last tool message) and {result} (its "result" field).
+# A tool step whose tool is not in the request's `tools` list is skipped.
+import re, json, time, zlib, random, threading, argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+DEFAULT_SCRIPTS: List[Dict[str, Any]] = [
+    {"match": r"(?i)compute\s+(.+?)\s+and return", "steps": [
+        {"tool": "calculator", "args": {"expression": "{0}"}},
+        {"answer": "{result}"}]},
+    {"match": r"(?i)summar|section|PDF", "steps": [
+        {"tool": "retrieve_docs", "args": {"query": "{q}", "k": 3}},
+        {"answer": "Section summary based on the retrieved chunks (docs/report.pdf)."}]},
+    {"match": r"(?i)citation style", "steps": [
+        {"tool": "read_profile", "args": {}},
+        {"answer": "You prefer path-only citations."}]},
+    {"match": r"(?i)sentiment:\s*\"(.+)\"", "steps": [
+        {"tool": "sentiment", "args": {"text": "{0}"}},
+        {"answer": "positive"}]},
+    {"match": r"(?i)with URLs|search the web", "steps": [
+        {"tool": "web_search", "args": {"query": "{q}", "k": 3}},
+        {"answer": "Sourcegraph (https://sourcegraph.com), Phind (https://phind.com)."}]},
+    {"match": r"(?i)name=(\w+), city=(\w+)", "steps": [
+        {"answer": "{{\"name\": \"{0}\", \"city\": \"{1}\"}}"}]},
+    {"match": r"(?i)a=(\d+) and b=(\d+)", "steps": [
+        {"answer": "{{\"a\": {0}, \"b\": {1}}}"}]},
+    {"match": r"", "steps": [{"answer": "OK."}]},
+]
+
+
+class Config:
+    def __init__(self, latency_ms=300.0, jitter_ms=100.0, token_ms=0.0, error_rate=0.0,
+                 scripts: Optional[List[Dict[str, Any]]] = None):
+        self.latency_ms, self.jitter_ms, self.token_ms = latency_ms, jitter_ms, token_ms
+        self.error_rate = error_rate
+        self.scripts = [(re.compile(s["match"]), s["steps"]) for s in (scripts or DEFAULT_SCRIPTS)]
+        self.lock = threading.Lock()
+        self.stats = {"chat": 0, "stream": 0, "embeddings": 0, "moderations": 0, "errors": 0}
+
+    def count(self, k: str):
+        with self.lock:
+            self.stats[k] += 1
+
+
+def _ntok(s: str) -> int:
+    return max(1, len(s) // 4)
+
+def _fill(v: Any, ctx: Dict[str, Any]) -> Any:
+    if isinstance(v, str):
+        return v.format(*ctx["groups"], **ctx["named"])
+    if isinstance(v, dict):
+        return {k: _fill(x, ctx) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_fill(x, ctx) for x in v]
+    return v
+
+def plan(cfg: Config, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Next assistant message for a chat request: {"content": str} or {"tool_calls": [...]}."""
+    msgs = body.get("messages", [])
+    last_user = max((i for i, m in enumerate(msgs) if m.get("role") == "user"), default=-1)
+    q = msgs[last_user].get("content", "") if last_user >= 0 else ""
+    system = next((m.get("content") or "" for m in msgs if m.get("role") == "system"), "")
+    rnd = sum(1 for m in msgs[last_user + 1:] if m.get("role") == "assistant" and m.get("tool_calls"))
+    tool_msgs = [m for m in msgs[last_user + 1:] if m.get("role") == "tool"]
+    last = tool_msgs[-1].get("content", "") if tool_msgs else ""
+    try:
+        last_value = json.loads(last).get("result", last)
+    except Exception:
+        last_value = last
+    tools = {t.get("function", {}).get("name") for t in body.get("tools") or []}
+    for rx, steps in cfg.scripts:
+        m = rx.search(q)
+        if not m:
+            continue
+        ctx = {"groups": m.groups(), "named": {"q": q, "system": system, "last": last[:500], "result": last_value}}
+        playable = [s for s in steps if "tool" not in s or s["tool"] in tools]
+        # tool_choice="none": skip straight to the answer
+        if body.get("tool_choice") == "none":
+            playable = [s for s in playable if "answer" in s]
+        step = playable[min(rnd, len(playable) - 1)] if playable else {"answer": "OK."}
+        if "answer" in step:
+            return {"content": _fill(step["answer"], ctx)}
+        args = json.dumps(_fill(step.get("args", {}), ctx))
+        return {"tool_calls": [{"id": f"call_{random.getrandbits(48):012x}", "type": "function",
+                                "function": {"name": step["tool"], "arguments": args}}]}
+    return {"content": "OK."}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cfg: Config = None
+
+    def log_message(self, *a):
+        pass
+
+    def _json(self, code: int, obj: Dict[str, Any]):
+        data = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sleep(self, extra_tokens: int = 0):
+        c = self.cfg
+        ms = max(0.0, c.latency_ms + random.uniform(-c.jitter_ms, c.jitter_ms)) + extra_tokens * c.token_ms
+        time.sleep(ms / 1000)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        if self.cfg.error_rate and random.random() < self.cfg.error_rate:
+            self.cfg.count("errors")
+            return self._json(503, {"error": {"message": "injected failure", "type": "server_error"}})
+        if path.endswith("/chat/completions"):
+            return self._chat(body)
+        if path.endswith("/embeddings"):
+            return self._embeddings(body)
+        if path.endswith("/moderations"):
+            return self._moderations(body)
+        self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _chat(self, body: Dict[str, Any]):
+        out = plan(self.cfg, body)
+        prompt = sum(_ntok(json.dumps(m.get("content") or "")) for m in body.get("messages", []))
+        completion = _ntok(out.get("content") or json.dumps(out.get("tool_calls")))
+        usage = {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+                 "prompt_tokens_details": {"cached_tokens": 0}}
+        base = {"id": f"chatcmpl-{random.getrandbits(48):012x}", "created": int(time.time()),
+                "model": body.get("model", "fake")}
+        msg = {"role": "assistant", "content": out.get("content"), "tool_calls": out.get("tool_calls")}
+        finish = "tool_calls" if out.get("tool_calls") else "stop"
+        if not body.get("stream"):
+            self.cfg.count("chat")
+            self._sleep(completion)
+            return self._json(200, {**base, "object": "chat.completion", "usage": usage,
+                                    "choices": [{"index": 0, "message": msg, "finish_reason": finish}]})
+
+        self.cfg.count("stream")
+        self._sleep()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(delta, finish_reason=None, u=None):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [] if u else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if u:
+                chunk["usage"] = u
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        send({"role": "assistant", "content": ""})
+        if out.get("tool_calls"):
+            send({"tool_calls": [{"index": i, **tc} for i, tc in enumerate(out["tool_calls"])]})
+        else:
+            for piece in re.findall(r"\S+\s*|\s+", out["content"]):
+                if self.cfg.token_ms:
+                    time.sleep(self.cfg.token_ms / 1000)
+                send({"content": piece})
+        send({}, finish)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(None, u=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body: Dict[str, Any]):
+        self.cfg.count("embeddings")
+        inp = body.get("input", "")
+        texts = [inp] if isinstance(inp, str) else inp
+        dim = int(body.get("dimensions") or 256)
+        data = []
+        for i, t in enumerate(texts):
+            rnd = random.Random(zlib.crc32(str(t).encode()))
+            v = [rnd.gauss(0, 1) for _ in range(dim)]
+            n = sum(x * x for x in v) ** 0.5 or 1.0
+            data.append({"object": "embedding", "index": i, "embedding": [x / n for x in v]})
+        self._sleep()
+        self._json(200, {"object": "list", "model": body.get("model", "fake"), "data": data,
+                         "usage": {"prompt_tokens": sum(_ntok(str(t)) for t in texts),
+                                   "total_tokens": sum(_ntok(str(t)) for t in texts)}})
+
+    def _moderations(self, body: Dict[str, Any]):
+        self.cfg.count("moderations")
+        inp = body.get("input", "")
+        texts = [inp] if isinstance(inp, str) else inp
+        self._sleep()
+        self._json(200, {"id": f"modr-{random.getrandbits(48):012x}", "model": body.get("model", "fake"),
+                         "results": [{"flagged": False, "categories": {}, "category_scores": {}} for _ in texts]})
+
+
+def serve(host: str = "127.0.0.1", port: int = 0, cfg: Optional[Config] = None) -> ThreadingHTTPServer:
+    """Start the stub on a daemon thread; port=0 picks a free port. Base URL: http://host:port/v1"""
+    handler = type("FakeHandler", (Handler,), {"cfg": cfg or Config()})
+    ThreadingHTTPServer.request_queue_size = 1024     # default backlog of 5 refuses connections under load
+    srv = ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="fake-openai", daemon=True).start()
+    return srv
+
+def base_url(srv: ThreadingHTTPServer) -> str:
+    host, port = srv.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8399)
+    ap.add_argument("--latency-ms", type=float, default=300.0, help="per-request latency (time to first token)")
+    ap.add_argument("--jitter-ms", type=float, default=100.0)
+    ap.add_argument("--token-ms", type=float, default=0.0, help="extra latency per completion token")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    ap.add_argument("--scripts", default="", help="JSON file with tool-call scripts")
+    a = ap.parse_args(argv)
+    scripts = None
+    if a.scripts:
+        with open(a.scripts, encoding="utf-8") as f:
+            scripts = json.load(f)
+    srv = serve(a.host, a.port, Config(a.latency_ms, a.jitter_ms, a.token_ms, a.error_rate, scripts))
+    print(f"fake OpenAI listening on {base_url(srv)}  (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+if __name__ == "__main__":
+    main()
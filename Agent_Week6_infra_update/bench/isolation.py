@@ -0,0 +1,152 @@
+# bench/isolation.py
+# Cross-user isolation check: many users run the agent concurrently in one process
+# (run_agent(goal, user_id=...)), each storing its own secret facts and name, then asking what the
+# agent knows about them and the same document and arithmetic questions as everyone else. The stub
+# answers with the system prompt (and the read_profile result), so an answer shows what the model saw.
+# Fails if any answer, profile, usage row or trace event carries another user's data. Same-named users
+# share a profile, so memory answers must be cached per user; document and arithmetic answers are
+# shared across users and must carry no user data at all. Goals about the user that also ask for
+# another class of answer ("return my name as json") must still see, and only see, their own data.
+#   python -m bench.isolation                      # 16 users x 3 rounds against the local stub
+#   python -m bench.isolation --users 64 --rounds 5
+import os, sys, json, tempfile, argparse, threading
+from typing import Any, Dict, List
+
+_TMP = tempfile.mkdtemp(prefix="agent-isolation-")
+# before any project module is imported (they read env at import)
+os.environ.update({"MEMORY_DB": os.path.join(_TMP, "memory.db"), "CACHE_DB": os.path.join(_TMP, "cache.db"),
+                   "CHROMA_DIR": os.path.join(_TMP, "chroma"), "EMBED_BACKEND": "fake",
+                   "OPENAI_API_KEY": "isolation"})
+
+SCRIPTS = [
+    {"match": r"(?i)remember that (.+)", "steps": [
+        {"tool": "remember_fact", "args": {"fact": "{0}"}},
+        {"answer": "Noted."}]},
+    {"match": r"(?i)call me (\w+)", "steps": [
+        {"tool": "save_preference", "args": {"key": "name", "value": "{0}"}},
+        {"answer": "OK, {0}."}]},
+    {"match": r"(?i)what do you know about me", "steps": [{"answer": "{system}"}]},
+    {"match": r"(?i)citation style applies to section", "steps": [
+        {"tool": "read_profile", "args": {}},
+        {"answer": "{system} read_profile: {last}"}]},
+    {"match": r"(?i)^compute", "steps": [{"answer": "{system}"}]},
+    {"match": r"(?i)my name as json|sentiment of my", "steps": [
+        {"tool": "read_profile", "args": {}},
+        {"answer": "{system} read_profile: {last}"}]},
+    {"match": r"", "steps": [{"answer": "OK."}]},
+]
+NAMES = ["Ada", "Grace"]
+
+
+class _Events:
+    def __init__(self):
+        self.recs: List[Dict[str, Any]] = []
+
+    def write(self, lines: List[str]):
+        self.recs += [json.loads(x) for x in lines]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=16)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    a = ap.parse_args(argv)
+
+    from bench import fake_openai
+    srv = fake_openai.serve(cfg=fake_openai.Config(a.latency_ms, a.latency_ms / 2, scripts=SCRIPTS))
+    os.environ["OPENAI_BASE_URL"] = fake_openai.base_url(srv)
+    import agent
+    from infra import context, tracing
+    from memory.memory import get_usage_today
+    events = _Events()
+    tracing.set_sink(events)
+
+    users = [f"iso-{os.getpid()}-{u}" for u in range(a.users)]
+    secret = lambda uid, r: f"{uid}-secret-{r}"
+    name = lambda u: NAMES[u % len(NAMES)]
+    answers: Dict[str, List[str]] = {uid: [] for uid in users}
+    shared: Dict[str, List[str]] = {uid: [] for uid in users}
+    profiles: Dict[str, Any] = {}
+    errors: List[str] = []
+    barrier = threading.Barrier(a.users)
+    mixed: Dict[str, List[str]] = {uid: [] for uid in users}
+    n_requests = 1 + 6 * a.rounds
+
+    def user(u: int):
+        uid = users[u]
+        try:
+            barrier.wait()
+            agent.run_agent(f"Call me {name(u)}", user_id=uid)
+            for r in range(a.rounds):
+                agent.run_agent(f"Remember that my code word is {secret(uid, r)}", user_id=uid)
+                # identical goal for every user in this round: a shared cache entry would leak
+                answers[uid].append(agent.run_agent(f"What do you know about me? (round {r})", user_id=uid))
+                # shared classes (rag, math): cached across users, so the prompt must hold no user data
+                shared[uid].append(agent.run_agent(f"Which citation style applies to section {r}.1? "
+                                                   "Cite the source path.", user_id=uid))
+                shared[uid].append(agent.run_agent(f"Compute {r}+{r}*7 and return the result", user_id=uid))
+                # about the user, phrased like a json / sentiment request: per user, with the profile
+                mixed[uid].append(agent.run_agent(f"Return my name as JSON (round {r})", user_id=uid))
+                mixed[uid].append(agent.run_agent(f"What is the sentiment of my last message? (round {r})",
+                                                  user_id=uid))
+            with context.use(user_id=uid):
+                profiles[uid] = agent.run_local_tool("read_profile", "{}")["profile"]
+        except Exception as e:
+            errors.append(f"{uid}: {type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=user, args=(u,)) for u in range(a.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    tracing.flush()
+
+    for u, uid in enumerate(users):
+        others = [x for x in users if x != uid]
+        for r, ans in enumerate(answers[uid]):
+            if secret(uid, r) not in ans:
+                errors.append(f"{uid} round {r}: own fact missing from the prompt")
+            leaked = [x for x in others if f"{x}-secret-" in ans]
+            if leaked:
+                errors.append(f"{uid} round {r}: saw facts of {leaked[:3]}")
+            if f"'name': '{name(u)}'" not in ans:
+                errors.append(f"{uid} round {r}: wrong profile in the prompt")
+        for ans in mixed[uid]:
+            if f"'name': '{name(u)}'" not in ans:
+                errors.append(f"{uid}: own profile missing from a goal about the user: {ans[:80]!r}")
+            leaked = [x for x in others if f"{x}-secret-" in ans]
+            if leaked:
+                errors.append(f"{uid}: saw facts of {leaked[:3]} in a goal about the user")
+        for ans in shared[uid]:
+            if "User profile:" not in ans:
+                errors.append(f"{uid}: unexpected shared answer {ans[:80]!r}")
+            elif "-secret-" in ans or "'name'" in ans:
+                errors.append(f"{uid}: user data in a shared answer: ...{ans[-160:]!r}")
+        if profiles.get(uid) != {"name": name(u)}:
+            errors.append(f"{uid}: read_profile returned {profiles.get(uid)}")
+        # shared answers may come from the cache (nothing recorded) or be computed by this user
+        n = get_usage_today(uid)["requests"]
+        if not 1 + 4 * a.rounds <= n <= n_requests:
+            errors.append(f"{uid}: {n} requests recorded, expected {1 + 4 * a.rounds}..{n_requests}")
+
+    by_request: Dict[str, set] = {}
+    for rec in events.recs:
+        if rec.get("request_id"):
+            by_request.setdefault(rec["request_id"], set()).add(rec.get("user_id"))
+    mixed = {rid: u for rid, u in by_request.items() if len(u) != 1 or None in u}
+    if mixed:
+        errors.append(f"{len(mixed)} request(s) with trace events for no or several users, e.g. {next(iter(mixed.items()))}")
+    if len(by_request) != a.users * n_requests:
+        errors.append(f"{len(by_request)} traced requests, expected {a.users * n_requests}")
+
+    srv.shutdown()
+    print(f"{a.users} users x {n_requests} requests, {len(events.recs)} trace events, "
+          f"stub served {srv.RequestHandlerClass.cfg.stats['chat']} chat calls")
+    for e in errors[:20]:
+        print("  " + e)
+    print("FAIL" if errors else "PASS: no cross-user leakage")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,177 @@
+# bench/key_hitrate.py
+# Replays logged traffic through the old and the canonical answer-cache keys and compares hit rates.
+#   python -m bench.key_hitrate                               # traces/trace.jsonl (+ rotated .1 .2 ...)
+#   python -m bench.key_hitrate --traces a.jsonl b.jsonl --memory-db memory.db
+#   python -m bench.key_hitrate --synthetic 2000              # no logs yet: perturbed eval cases
+#   python -m bench.key_hitrate --check                       # key correctness only (exit 1 on a collision)
+# Requests come from agent.run.start and cache.hit events (both carry user_goal). Traces don't carry
+# the profile, so each request gets one of the profiles in --memory-db (by its user_id when logged,
+# else by request_id hash); with no profiles in the db everyone has the empty profile.
+# The simulated cache is unbounded and never expires: this measures key quality, not capacity.
+# A higher hit rate also rewards keys that merge different questions, so every run first checks the
+# MUST_DIFFER pairs (different answers, must not share a key) and MUST_MATCH pairs (same answer).
+import os, sys, glob, json, random, sqlite3, argparse, zlib
+from typing import Any, Dict, List, Tuple
+
+from infra.canon import key_parts, answer_class, user_scoped
+
+
+# (goal, profile) pairs; the profile is {} unless given
+MUST_DIFFER: List[Tuple[Any, Any]] = [
+    ("what is 2+2 and 3+3", "what is 2+2"),
+    ("Compute 10/4 and 7*3", "Compute 10/4"),
+    ("What is 2 + 2, and the result of 9-1?", "What is 2 + 2?"),
+    ("what is 3-1 of 10", "what is 3-1"),
+    ("what is 2+2 of 5", "what is 2+2"),
+    ("Compute 2+2 and explain it", "Compute 2+2"),
+    ("Compute (17*24)+5 and return only the number.", "Compute (17*24)+5"),
+    ("what is 17*24", "what is 17+24"),
+    ("what is 1.5*2", "what is 15*2"),
+    ("what is (2+3)*4", "what is 2+3*4"),
+    ('Return JSON with name=Ada, city=Oslo', 'Return JSON with name=ada, city=oslo'),
+    (("Summarize section 3.1 and cite the source path", {"citation_style": "path-only"}),
+     ("Summarize section 3.1 and cite the source path", {"citation_style": "path+page"})),
+    (("What is my name?", {"name": "Ada"}), ("What is my name?", {"name": "Grace"})),
+    ("Summarize section 3.1", "Summarize section 3.2"),
+    # about the user, whatever else they ask for: keyed on the user's whole profile
+    (("Return my name as JSON", {"name": "Ada"}), ("Return my name as JSON", {"name": "Grace"})),
+    (("What is the sentiment of my last message?", {"name": "Ada"}),
+     ("What is the sentiment of my last message?", {"name": "Grace"})),
+    (("Compute my total: 17*24", {"name": "Ada"}), ("Compute my total: 17*24", {"name": "Grace"})),
+    (("Summarize section 3.1 for me", {"name": "Ada"}), ("Summarize section 3.1 for me", {"name": "Grace"})),
+]
+MUST_MATCH: List[Tuple[Any, Any]] = [
+    ("What is 17 × 24?", "compute 17*24"),
+    ("Compute (17*24)+5 and return only the number.", "calculate (17 * 24) + 5, just the number"),
+    ("Compute 2+2 and return the result", "what is 2+2?"),
+    ("Summarize  section 3.1.", "summarize section 3.1"),
+    (("What is 17*24?", {"name": "Ada"}), ("What is 17*24?", {"name": "Grace"})),
+]
+
+def check() -> List[str]:
+    """Key collisions among MUST_DIFFER and splits among MUST_MATCH; empty when the keys are right."""
+    def key(x):
+        goal, profile = x if isinstance(x, tuple) else (x, {})
+        return json.dumps(key_parts(goal, profile), sort_keys=True)
+    bad = [f"same key: {a!r} / {b!r}" for a, b in MUST_DIFFER if key(a) == key(b)]
+    return bad + [f"different keys: {a!r} / {b!r}" for a, b in MUST_MATCH if key(a) != key(b)]
+
+
+def read_traces(paths: List[str]) -> List[Dict[str, Any]]:
+    out = []
+    for p in paths:
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue
+                if e.get("event") in ("agent.run.start", "cache.hit") and e.get("user_goal"):
+                    out.append(e)
+    out.sort(key=lambda e: e.get("ts", 0))
+    return out
+
+def read_profiles(db: str) -> Dict[str, Dict[str, str]]:
+    if not os.path.exists(db):
+        return {}
+    with sqlite3.connect(db) as c:
+        rows = c.execute("SELECT user_id, k, v FROM profiles").fetchall()
+    out: Dict[str, Dict[str, str]] = {}
+    for uid, k, v in rows:
+        out.setdefault(uid, {})[k] = v
+    return out
+
+def synthetic(n: int, seed: int = 0) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, str]]]:
+    """Eval cases with the noise real users add: case, spacing, trailing punctuation, ×/x for *,
+    spread over users whose profiles differ in name (irrelevant to most answers) and citation_style."""
+    from eval.cases import CASES
+    rnd = random.Random(seed)
+    def perturb(q: str) -> str:
+        if rnd.random() < 0.3:
+            q = q.lower()
+        if rnd.random() < 0.3:
+            q = "  " + q.replace(" ", "  ", 2)
+        if rnd.random() < 0.3:
+            q = q.rstrip(".?!") + rnd.choice(["", "?", " .", "!"])
+        if rnd.random() < 0.2:
+            q = q.replace("*", " × ").replace("+", " + ")
+        return q
+    profiles = {f"u{i}": {"name": f"user{i}", "citation_style": rnd.choice(["path-only", "path+page"])}
+                for i in range(50)}
+    events = [{"user_goal": perturb(rnd.choice(CASES)["q"]), "user_id": f"u{rnd.randrange(50)}",
+               "request_id": str(i)} for i in range(n)]
+    return events, profiles
+
+
+def simulate(events: List[Dict[str, Any]], profiles: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+    uids = sorted(profiles)
+    seen_raw, seen_canon = set(), set()
+    per_class: Dict[str, List[int]] = {}
+    hits_raw = hits_canon = 0
+    for e in events:
+        uid = e.get("user_id")
+        if uid not in profiles:
+            uid = uids[zlib.crc32(str(e.get("request_id", "")).encode()) % len(uids)] if uids else None
+        profile = profiles.get(uid, {})
+        goal = e["user_goal"]
+        raw = json.dumps([goal, profile], sort_keys=True)
+        cls, g, p = key_parts(goal, profile)
+        canon = json.dumps([cls, g, p, uid if user_scoped(cls) else None], sort_keys=True)   # as agent.answer_cache_key
+        hr, hc = raw in seen_raw, canon in seen_canon
+        seen_raw.add(raw)
+        seen_canon.add(canon)
+        hits_raw += hr
+        hits_canon += hc
+        c = per_class.setdefault(answer_class(goal), [0, 0, 0])
+        c[0] += 1
+        c[1] += hr
+        c[2] += hc
+    n = len(events) or 1
+    return {"requests": len(events), "hit_rate_raw": round(hits_raw / n, 4), "hit_rate_canonical": round(hits_canon / n, 4),
+            "distinct_raw": len(seen_raw), "distinct_canonical": len(seen_canon),
+            "per_class": {k: {"requests": v[0], "hit_rate_raw": round(v[1] / v[0], 4),
+                              "hit_rate_canonical": round(v[2] / v[0], 4)} for k, v in sorted(per_class.items())}}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--traces", nargs="*", default=None, help="trace JSONL files (default: TRACE_FILE and rotations)")
+    ap.add_argument("--memory-db", default=os.getenv("MEMORY_DB", "memory.db"))
+    ap.add_argument("--synthetic", type=int, default=0, help="ignore logs; generate this many perturbed requests")
+    ap.add_argument("--json", action="store_true")
+    ap.add_argument("--check", action="store_true", help="only check key correctness")
+    a = ap.parse_args(argv)
+
+    bad = check()
+    if a.check or bad:
+        for x in bad:
+            print(x)
+        print(f"key check: {len(MUST_DIFFER)} must-differ, {len(MUST_MATCH)} must-match pairs, "
+              + (f"{len(bad)} wrong" if bad else "ok"))
+        return 1 if bad else 0
+
+    if a.synthetic:
+        events, profiles = synthetic(a.synthetic)
+        source = f"synthetic ({a.synthetic} perturbed eval cases, 50 users)"
+    else:
+        trace_file = os.getenv("TRACE_FILE", "traces/trace.jsonl")
+        paths = a.traces if a.traces is not None else sorted(glob.glob(trace_file + "*"))
+        events, profiles = read_traces(paths), read_profiles(a.memory_db)
+        source = f"{len(paths)} trace file(s), {len(profiles)} profile(s) from {a.memory_db}"
+        if not events:
+            print(f"no agent.run.start / cache.hit events in {paths or trace_file}; try --synthetic N")
+            return 1
+    r = simulate(events, profiles)
+    if a.json:
+        print(json.dumps({"source": source, **r}, indent=2))
+        return 0
+    print(f"source: {source}")
+    print(f"requests {r['requests']}   distinct keys raw {r['distinct_raw']} -> canonical {r['distinct_canonical']}")
+    print(f"hit rate raw {r['hit_rate_raw']:.1%} -> canonical {r['hit_rate_canonical']:.1%}")
+    print(f"{'class':<11}{'requests':>9}{'raw':>9}{'canonical':>11}")
+    for k, v in r["per_class"].items():
+        print(f"{k:<11}{v['requests']:>9}{v['hit_rate_raw']:>9.1%}{v['hit_rate_canonical']:>11.1%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
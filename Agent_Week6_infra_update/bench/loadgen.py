@@ -0,0 +1,206 @@
+# bench/loadgen.py
+# Closed-loop load test: N simulated users call run_agent (or run_agent_safe) back to back
+# against the local fake OpenAI server, while N ramps up. Reports throughput, p50/p95/p99
+# and error rate per level, and the highest level that still meets the SLO.
+#   python -m bench.loadgen                                   # levels 1,2,4,8,16,32, 10s each
+#   python -m bench.loadgen --levels 1,4,16,64 --duration 20 --latency-ms 800 --safe
+#   python -m bench.loadgen --url http://127.0.0.1:8399/v1    # use an already running stub
+# The workload mix is drawn from eval/cases.py; weights per class with --mix.
+# Answers are not cached by default (each goal gets a unique suffix); --repeat keeps the goals as-is.
+import os, sys, json, time, random, tempfile, argparse, threading
+from typing import Any, Dict, List
+
+_TMP = tempfile.mkdtemp(prefix="agent-load-")
+# before any project module is imported (they read env at import)
+os.environ.update({
+    "CACHE_DB": os.path.join(_TMP, "cache.db"),
+    "MEMORY_DB": os.path.join(_TMP, "memory.db"),
+    "CHROMA_DIR": os.path.join(_TMP, "chroma"),
+    "EMBED_BACKEND": "fake",
+    "CASSETTE_MODE": "off",
+    "OPENAI_API_KEY": "loadgen",
+})
+os.environ.setdefault("TRACE_SINK", "none")
+
+DEFAULT_MIX = "rag=3,math=2,json=2,memory=2,sentiment=1,web=0"
+
+
+def classify(case: Dict[str, Any]) -> str:
+    q = case["q"].lower()
+    if "sentiment" in q:
+        return "sentiment"
+    if "citation style" in q:
+        return "memory"
+    if case.get("require_json"):
+        return "json"
+    if case.get("expect_src") == "http":
+        return "web"
+    if case.get("expect_src"):
+        return "rag"
+    return "math"
+
+def workload(mix: str) -> List[Dict[str, Any]]:
+    """[(class, goal)] weighted by --mix; a class with no cases is ignored."""
+    from eval.cases import CASES
+    weights = {k: float(v) for k, v in (p.split("=") for p in mix.split(",") if p)}
+    by_class: Dict[str, List[str]] = {}
+    for c in CASES:
+        by_class.setdefault(classify(c), []).append(c["q"])
+    out = []
+    for cls, goals in by_class.items():
+        w = weights.get(cls, 0)
+        out += [{"cls": cls, "goal": g, "w": w / len(goals)} for g in goals if w > 0]
+    return out
+
+
+def _pct(xs: List[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    return xs[min(len(xs) - 1, int(p / 100 * len(xs)))]
+
+def _seed():
+    """Corpus for retrieve_docs and the profile the memory cases read."""
+    from tools.retriever import add_documents
+    from memory.memory import set_profile_kv
+    words = "budget approval section review committee results method scope risk timeline".split()
+    rnd = random.Random(0)
+    add_documents([{"id": f"seed-{i}", "source": f"docs/report{i % 5}.pdf",
+                    "text": f"Section {i % 4 + 1}.{i % 3 + 1} " + " ".join(rnd.choices(words, k=150))}
+                   for i in range(200)])
+    set_profile_kv(os.getenv("USER_ID", "default"), "citation_style", "path-only")
+
+
+def run_level(fn, items: List[Dict[str, Any]], users: int, duration: float, repeat: bool,
+              think_s: float = 0.0) -> Dict[str, Any]:
+    lat: List[float] = []
+    errors: Dict[str, int] = {}
+    per_cls: Dict[str, int] = {}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    seq = [0]
+
+    def user(uid: int):
+        rnd = random.Random(uid * 7919 + users)
+        weights = [it["w"] for it in items]
+        while time.perf_counter() < stop_at:
+            it = rnd.choices(items, weights)[0]
+            with lock:
+                seq[0] += 1
+                n = seq[0]
+            goal = it["goal"] if repeat else f"{it['goal']} (load #{users}-{n})"
+            t0 = time.perf_counter()
+            err = None
+            try:
+                ans = fn(goal)
+                if ans.startswith("Stopped"):
+                    err = "no_answer"
+            except Exception as e:
+                err = type(e).__name__
+            dt = time.perf_counter() - t0
+            with lock:
+                lat.append(dt)
+                per_cls[it["cls"]] = per_cls.get(it["cls"], 0) + 1
+                if err:
+                    errors[err] = errors.get(err, 0) + 1
+            if think_s:
+                time.sleep(rnd.expovariate(1 / think_s))
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(u,), daemon=True) for u in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    lat.sort()
+    n = len(lat)
+    n_err = sum(errors.values())
+    return {"users": users, "requests": n, "wall_s": round(wall, 2), "rps": round(n / wall, 2) if wall else 0.0,
+            "p50_ms": round(_pct(lat, 50) * 1000, 1), "p95_ms": round(_pct(lat, 95) * 1000, 1),
+            "p99_ms": round(_pct(lat, 99) * 1000, 1), "error_rate": round(n_err / n, 4) if n else 0.0,
+            "errors": errors, "mix": per_cls}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--levels", default="1,2,4,8,16,32", help="concurrent users per step")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="class weights: rag, math, json, memory, sentiment, web")
+    ap.add_argument("--safe", action="store_true", help="drive run_agent_safe (adds the moderation call)")
+    ap.add_argument("--repeat", action="store_true", help="reuse goals verbatim (answer cache hits)")
+    ap.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's requests")
+    ap.add_argument("--url", default="", help="existing OpenAI-compatible base URL; default starts the stub")
+    ap.add_argument("--latency-ms", type=float, default=300.0)
+    ap.add_argument("--jitter-ms", type=float, default=100.0)
+    ap.add_argument("--token-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--scripts", default="", help="tool-call scripts for the stub (see bench/fake_openai.py)")
+    ap.add_argument("--slo-p95-ms", type=float, default=5000.0)
+    ap.add_argument("--max-error-rate", type=float, default=0.01)
+    ap.add_argument("--stop-on-breach", action="store_true", help="end the ramp at the first level over the SLO")
+    ap.add_argument("--cache", default="", help="answer-cache backend: memory | sqlite | redis (in-process stand-in)")
+    ap.add_argument("--json", default="", help="write the per-level results here")
+    a = ap.parse_args(argv)
+
+    srv = None
+    url = a.url
+    if not url:
+        from bench import fake_openai
+        scripts = None
+        if a.scripts:
+            with open(a.scripts, encoding="utf-8") as f:
+                scripts = json.load(f)
+        srv = fake_openai.serve(cfg=fake_openai.Config(a.latency_ms, a.jitter_ms, a.token_ms, a.error_rate, scripts))
+        url = fake_openai.base_url(srv)
+    os.environ["OPENAI_BASE_URL"] = url          # every client built from here on (moderation, harness...)
+    if a.cache:
+        from infra import cache
+        if a.cache == "redis" and not os.getenv("CACHE_REDIS_URL"):
+            from bench import resp_server
+            cache.CACHE_REDIS_URL = resp_server.url(resp_server.serve())
+        cache.init(a.cache)
+
+    import httpx
+    from openai import OpenAI
+    import agent
+    levels = [int(x) for x in a.levels.split(",") if x]
+    # sized for the top level; retries stay with infra.retry so failures are counted once
+    agent.client = OpenAI(base_url=url, api_key="loadgen", max_retries=0,
+                          http_client=httpx.Client(limits=httpx.Limits(max_connections=max(levels) * 2,
+                                                                        max_keepalive_connections=max(levels))))
+    _seed()
+    fn = agent.run_agent_safe if a.safe else agent.run_agent
+    items = workload(a.mix)
+    if not items:
+        print("empty workload: check --mix")
+        return 2
+
+    print(f"target {url}  entry={'run_agent_safe' if a.safe else 'run_agent'}  mix={a.mix}  "
+          f"{a.duration:g}s per level")
+    print(f"{'users':>6}{'reqs':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    results, knee = [], None
+    for users in levels:
+        r = run_level(fn, items, users, a.duration, a.repeat, a.think_ms / 1000)
+        results.append(r)
+        ok = r["p95_ms"] <= a.slo_p95_ms and r["error_rate"] <= a.max_error_rate
+        print(f"{users:>6}{r['requests']:>8}{r['rps']:>9.2f}{r['p50_ms']:>10.0f}{r['p95_ms']:>10.0f}"
+              f"{r['p99_ms']:>10.0f}{r['error_rate']:>9.1%}" + ("" if ok else "  over SLO"))
+        if r["errors"]:
+            print(f"{'':>6}errors: {r['errors']}")
+        if ok:
+            knee = users
+        elif a.stop_on_breach:
+            break
+    print(f"highest level within SLO (p95 <= {a.slo_p95_ms:g} ms, errors <= {a.max_error_rate:.1%}): "
+          f"{knee if knee is not None else 'none'}")
+    if srv:
+        print(f"stub served: {srv.RequestHandlerClass.cfg.stats}")
+        srv.shutdown()
+    if a.json:
+        with open(a.json, "w") as f:
+            json.dump({"url": url, "safe": a.safe, "mix": a.mix, "duration_s": a.duration,
+                       "slo_p95_ms": a.slo_p95_ms, "knee_users": knee, "levels": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
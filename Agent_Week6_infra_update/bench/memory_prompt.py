@@ -0,0 +1,51 @@
+# bench/memory_prompt.py
+# Prompt tokens spent on memory as a user's history grows: with rolling summaries the
+# summary + deltas + recalled facts stay bounded, while the history itself keeps growing.
+#   python -m bench.memory_prompt                        # 10..5000 facts, local summarizer
+#   MEMORY_SUMMARIZER=llm python -m bench.memory_prompt --sizes 50,500
+import os, sys, time, random, tempfile, argparse
+
+_TMP = tempfile.mkdtemp(prefix="agent-memprompt-")
+# before any project module is imported (they read env at import)
+os.environ.update({"MEMORY_DB": os.path.join(_TMP, "memory.db"), "CHROMA_DIR": os.path.join(_TMP, "chroma"),
+                   "MEMORY_MAX_FACTS": "0", "TRACE_SINK": "none"})
+os.environ.setdefault("EMBED_BACKEND", "fake")
+
+_SUBJECTS = ["my dog", "my sister", "my team", "my manager", "my flat", "my car", "my project", "my bike"]
+_PREDS = ["is called {w}", "likes {w}", "moved to {w}", "prefers {w}", "works on {w}", "needs {w}"]
+_WORDS = "budget oslo tea python rust hiking jazz review climbing tokyo chess sourdough".split()
+
+def fact(rnd: random.Random) -> str:
+    return f"{rnd.choice(_SUBJECTS)} {rnd.choice(_PREDS).format(w=rnd.choice(_WORDS))}"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10,100,1000,5000")
+    a = ap.parse_args(argv)
+    from memory import memory
+    from memory.recall import count_tokens
+    from memory.summary import compact, memory_context
+    memory.init_db()
+    rnd = random.Random(0)
+    have, uid = 0, "long-history"
+    print(f"{'facts':>7}{'history tok':>13}{'summary tok':>13}{'facts tok':>11}{'memory tok':>12}{'compact ms':>12}")
+    for size in sorted(int(x) for x in a.sizes.split(",")):
+        while have < size:
+            f = f"{fact(rnd)} (#{have})"
+            memory.add_fact(uid, f)
+            have += 1
+        memory.settle()
+        t0 = time.perf_counter()
+        while compact(uid):
+            pass
+        memory.settle()
+        dt = (time.perf_counter() - t0) * 1000
+        history = [f for f, _ in memory.get_facts_since(uid, "")]
+        summary, facts = memory_context(uid, "what is my dog called?")
+        s_tok, f_tok = count_tokens(summary), sum(count_tokens(f) for f in facts)
+        print(f"{size:>7}{sum(count_tokens(f) for f in history):>13}{s_tok:>13}{f_tok:>11}{s_tok + f_tok:>12}{dt:>12.1f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
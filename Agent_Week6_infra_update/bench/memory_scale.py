@@ -0,0 +1,52 @@
+# bench/memory_scale.py
+# Recent-fact reads and fact inserts against memory.db at growing sizes: with the (user_id, ts)
+# covering index both should stay flat as the table grows.
+#   python -m bench.memory_scale                              # 100k, 1M, 3M rows, 10k users
+#   python -m bench.memory_scale --rows 1000000,5000000 --users 50000
+import os, sys, time, random, sqlite3, tempfile, argparse
+
+_TMP = tempfile.mkdtemp(prefix="agent-memscale-")
+os.environ["MEMORY_DB"] = os.path.join(_TMP, "memory.db")     # before memory.memory is imported
+
+from memory import memory
+
+
+def fill(upto: int, have: int, users: int):
+    """Append facts have..upto-1, spread round-robin over users, newest last."""
+    with sqlite3.connect(memory.DB_PATH) as c:
+        c.executemany("INSERT INTO facts(user_id,fact,h,ts) VALUES(?,?,?,datetime('now', ?))",
+                      ((f"u{i % users}", f"fact number {i}", memory.fact_hash(f"fact number {i}"),
+                        f"-{upto - i} seconds") for i in range(have, upto)))
+
+def timed(fn, n: int) -> float:
+    """Median of n calls, in µs."""
+    xs = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        fn(i)
+        xs.append(time.perf_counter() - t0)
+    xs.sort()
+    return xs[len(xs) // 2] * 1e6
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="100000,1000000,3000000")
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--reads", type=int, default=5000)
+    a = ap.parse_args(argv)
+    memory.init_db()
+    rnd = random.Random(0)
+    have = 0
+    print(f"{'rows':>10}{'fill s':>9}{'get_recent_facts µs':>22}{'add_fact µs':>13}{'facts/user':>12}")
+    for rows in sorted(int(x) for x in a.rows.split(",")):
+        t0 = time.perf_counter()
+        fill(rows, have, a.users)
+        have, fill_s = rows, time.perf_counter() - t0
+        read = timed(lambda i: memory.get_recent_facts(f"u{rnd.randrange(a.users)}", n=5), a.reads)
+        add = timed(lambda i: memory.add_fact(f"u{rnd.randrange(a.users)}", f"new fact {rows}-{i}"), 1000)
+        print(f"{rows:>10}{fill_s:>9.1f}{read:>22.1f}{add:>13.1f}{rows // a.users:>12}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+# bench/memory_writes.py
+# Tool-call write latency and commit throughput for save_preference / remember_fact under
+# concurrent users: synchronous writes vs the write-behind queue (MEMORY_WRITE_BEHIND).
+#   python -m bench.memory_writes                            # 1, 8, 32 users, 3s per run
+#   python -m bench.memory_writes --users 16,64 --synchronous FULL
+# Latency is what the tool loop waits for; throughput counts writes until they are committed.
+import os, sys, time, tempfile, argparse, threading
+from typing import Any, Dict, List
+
+_TMP = tempfile.mkdtemp(prefix="agent-memwrites-")
+
+
+def _pct(xs: List[float], p: float) -> float:
+    return xs[min(len(xs) - 1, int(p / 100 * len(xs)))] if xs else 0.0
+
+def run(memory, users: int, duration: float, behind: bool) -> Dict[str, Any]:
+    memory.MEMORY_WRITE_BEHIND = behind
+    lat: List[float] = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def user(u: int):
+        uid, i, mine = f"{'wb' if behind else 'sync'}-{users}-{u}", 0, []
+        while time.perf_counter() < stop_at:
+            i += 1
+            t0 = time.perf_counter()
+            if i % 2:
+                memory.set_profile_kv(uid, "citation_style", "path-only" if i % 4 == 1 else "path+page")
+            else:
+                memory.add_fact(uid, f"the user mentioned item {i}")
+            mine.append(time.perf_counter() - t0)
+        with lock:
+            lat.extend(mine)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(u,)) for u in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    memory.settle()                     # throughput counts committed writes only
+    wall = time.perf_counter() - t0
+    lat.sort()
+    return {"users": users, "mode": "write-behind" if behind else "sync", "calls": len(lat),
+            "p50_us": _pct(lat, 50) * 1e6, "p99_us": _pct(lat, 99) * 1e6, "calls_per_s": len(lat) / wall}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", default="1,8,32")
+    ap.add_argument("--duration", type=float, default=3.0)
+    ap.add_argument("--synchronous", default="", help="SQLITE_SYNCHRONOUS for the run (NORMAL, FULL)")
+    a = ap.parse_args(argv)
+    os.environ["MEMORY_DB"] = os.path.join(_TMP, "memory.db")     # before memory.memory is imported
+    if a.synchronous:
+        os.environ["SQLITE_SYNCHRONOUS"] = a.synchronous
+    from memory import memory
+    memory.init_db()
+    print(f"synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}  {a.duration:g}s per run")
+    print(f"{'users':>6}{'mode':>14}{'calls':>9}{'p50 µs':>10}{'p99 µs':>10}{'calls/s':>11}")
+    for users in (int(x) for x in a.users.split(",")):
+        for behind in (False, True):
+            r = run(memory, users, a.duration, behind)
+            print(f"{users:>6}{r['mode']:>14}{r['calls']:>9}{r['p50_us']:>10.1f}{r['p99_us']:>10.1f}"
+                  f"{r['calls_per_s']:>11,.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
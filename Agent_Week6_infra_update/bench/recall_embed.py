@@ -0,0 +1,82 @@
+# bench/recall_embed.py
+# Does semantic recall engage on goals never seen before? Runs the memory part of run_agent for new
+# goals (prefetch, profile read, answer-cache lookup, memory_context) and reports how often the goal's
+# embedding missed the wait (memory_recall_total{result="embed_timeout"}: the prompt got the newest
+# facts instead of the related ones) and how long recall held the request.
+#   python -m bench.recall_embed                          # remote-like embedder: 150ms median, lognormal
+#   python -m bench.recall_embed --latency-ms 300
+#   python -m bench.recall_embed --openai                 # the real EMBED_BACKEND=openai (OPENAI_API_KEY)
+# Rows: the old setup (fixed 50ms wait, no prefetch) and the default (auto wait + prefetch).
+import os, sys, time, random, tempfile, argparse
+
+_TMP = tempfile.mkdtemp(prefix="agent-recall-embed-")
+# before any project module is imported (they read env at import)
+os.environ.update({"MEMORY_DB": os.path.join(_TMP, "memory.db"), "CACHE_DB": os.path.join(_TMP, "cache.db"),
+                   "CHROMA_DIR": os.path.join(_TMP, "chroma"), "TRACE_SINK": "none", "CASSETTE_MODE": "off"})
+
+_WORDS = "budget oslo tea python rust hiking jazz review climbing tokyo chess sourdough sister flat".split()
+
+def _goal(rnd: random.Random, i: int) -> str:
+    return f"what did I say about {' and '.join(rnd.sample(_WORDS, 3))}? (#{i})"
+
+def _pct(xs, q):
+    return round(sorted(xs)[min(int(len(xs) * q), len(xs) - 1)] * 1e3, 1) if xs else None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=60, help="new goals per row")
+    ap.add_argument("--facts", type=int, default=200)
+    ap.add_argument("--latency-ms", type=float, default=150.0, help="simulated embedder median")
+    ap.add_argument("--openai", action="store_true", help="use the real openai embedder instead")
+    a = ap.parse_args(argv)
+    os.environ["EMBED_BACKEND"] = "openai" if a.openai else "fake"
+
+    from infra import metrics
+    from infra.cache import get as cache_get
+    from memory import memory, recall
+    from memory.summary import memory_context
+    from rag.config import EMBED_MODEL
+    memory.init_db()
+    rnd = random.Random(0)
+
+    if not a.openai:
+        inner = recall._embed
+        def remote_like(texts):
+            time.sleep(a.latency_ms / 1000 * rnd.lognormvariate(0, 0.35))
+            return inner(texts)
+        recall._embed = remote_like
+
+    uid = "recall-embed-user"
+    for j in range(a.facts):
+        recall.remember(uid, f"my {rnd.choice(_WORDS)} note {j}: {' '.join(rnd.sample(_WORDS, 4))}")
+    recall.recall_facts(uid, "warm up")                  # starts the backfill of anything not embedded yet
+    recall._embedder.submit(lambda: None).result()
+
+    timeouts = lambda: metrics.counter("memory_recall_total", result="embed_timeout").value
+    embedder = f"openai {EMBED_MODEL}" if a.openai else f"simulated, {a.latency_ms:.0f}ms median"
+    print(f"embedder: {embedder}; {a.requests} new goals per row")
+    print(f"{'setup':<28}{'embed_timeout':>14}{'recall p50':>12}{'recall p95':>12}{'wait':>10}")
+    for label, wait_ms, prefetch in (("fixed 50ms, no prefetch", 50.0, False), ("auto + prefetch", None, True)):
+        recall.MEMORY_RECALL_EMBED_MS = wait_ms
+        recall._latency.clear()
+        before, held = timeouts(), []
+        for i in range(a.requests):
+            goal = _goal(rnd, i)
+            if prefetch:
+                recall.prefetch(goal)
+            memory.get_profile_dict(uid)
+            cache_get(f"answer:{goal}")
+            t0 = time.perf_counter()
+            memory_context(uid, goal)
+            held.append(time.perf_counter() - t0)
+        while recall._inflight:                         # don't let this row's embeddings slow the next
+            time.sleep(0.01)
+        wait = recall.embed_wait_s()
+        rate = (timeouts() - before) / a.requests
+        print(f"{label:<28}{rate:>13.0%}{_pct(held, 0.5):>10}ms{_pct(held, 0.95):>10}ms"
+              f"{(f'{wait * 1e3:.0f}ms' if wait else 'none'):>10}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
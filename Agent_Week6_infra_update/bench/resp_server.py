@@ -0,0 +1,148 @@
+# bench/resp_server.py
+# In-process stand-in for a Redis server (RESP2 over TCP) so CACHE_BACKEND=redis can be exercised
+# and benchmarked without installing Redis. Supports what infra.cache needs plus a few basics:
+# PING, GET, SET [EX s|PX ms], MGET, MSET, DEL, INCR, EXISTS, TTL, DBSIZE, FLUSHDB, SELECT, AUTH.
+#   python -m bench.resp_server --port 6399
+#   CACHE_BACKEND=redis CACHE_REDIS_URL=redis://127.0.0.1:6399/0 python agent.py ...
+import time, socket, argparse, threading, socketserver
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Store:
+    def __init__(self):
+        self.d: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.lock = threading.Lock()
+
+    def _live(self, k: bytes) -> Optional[bytes]:
+        e = self.d.get(k)
+        if e is None:
+            return None
+        if e[1] is not None and e[1] <= time.monotonic():
+            del self.d[k]
+            return None
+        return e[0]
+
+
+class Handler(socketserver.StreamRequestHandler):
+    store: Store = None
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _read_cmd(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):                    # inline command (telnet / redis-cli -x)
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            n = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(n + 2)[:-2])
+        return args
+
+    @staticmethod
+    def _enc(v: Any) -> bytes:
+        if v is None:
+            return b"$-1\r\n"
+        if isinstance(v, Exception):
+            return b"-ERR %s\r\n" % str(v).encode()
+        if isinstance(v, bool):
+            return b":%d\r\n" % int(v)
+        if isinstance(v, int):
+            return b":%d\r\n" % v
+        if isinstance(v, str):
+            return b"+%s\r\n" % v.encode()
+        if isinstance(v, list):
+            return b"*%d\r\n" % len(v) + b"".join(Handler._enc(x) for x in v)
+        return b"$%d\r\n%s\r\n" % (len(v), v)
+
+    def handle(self):
+        while True:
+            cmd = self._read_cmd()
+            if cmd is None:
+                break
+            try:
+                reply = self._enc(self.run(cmd))
+            except Exception as e:
+                reply = self._enc(e)
+            self.wfile.write(reply)
+
+    def run(self, cmd: List[bytes]) -> Any:
+        op, a = cmd[0].upper(), cmd[1:]
+        s = self.store
+        with s.lock:
+            if op == b"PING":
+                return a[0] if a else "PONG"
+            if op in (b"SELECT", b"AUTH"):
+                return "OK"
+            if op == b"GET":
+                return s._live(a[0])
+            if op == b"MGET":
+                return [s._live(k) for k in a]
+            if op == b"SET":
+                exp = None
+                opts = [x.upper() for x in a[2:]]
+                if b"EX" in opts:
+                    exp = time.monotonic() + int(a[2 + opts.index(b"EX") + 1])
+                elif b"PX" in opts:
+                    exp = time.monotonic() + int(a[2 + opts.index(b"PX") + 1]) / 1000
+                s.d[a[0]] = (a[1], exp)
+                return "OK"
+            if op == b"MSET":
+                for k, v in zip(a[::2], a[1::2]):
+                    s.d[k] = (v, None)
+                return "OK"
+            if op == b"DEL":
+                return sum(s.d.pop(k, None) is not None for k in a)
+            if op == b"EXISTS":
+                return sum(s._live(k) is not None for k in a)
+            if op == b"INCR":
+                n = int(s._live(a[0]) or 0) + 1
+                exp = s.d.get(a[0], (None, None))[1]
+                s.d[a[0]] = (str(n).encode(), exp)
+                return n
+            if op == b"TTL":
+                if s._live(a[0]) is None:
+                    return -2
+                exp = s.d[a[0]][1]
+                return -1 if exp is None else max(0, int(exp - time.monotonic()))
+            if op == b"DBSIZE":
+                return len(s.d)
+            if op == b"FLUSHDB":
+                s.d.clear()
+                return "OK"
+        raise ValueError(f"unknown command '{op.decode(errors='replace')}'")
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+def serve(host: str = "127.0.0.1", port: int = 0) -> Server:
+    """Start on a daemon thread; port=0 picks a free port. URL: redis://host:port/0"""
+    handler = type("StoreHandler", (Handler,), {"store": Store()})
+    srv = Server((host, port), handler)
+    threading.Thread(target=srv.serve_forever, name="resp-server", daemon=True).start()
+    return srv
+
+def url(srv: Server) -> str:
+    host, port = srv.server_address[:2]
+    return f"redis://{host}:{port}/0"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=6399)
+    a = ap.parse_args()
+    srv = serve(a.host, a.port)
+    print(f"RESP stand-in listening on {url(srv)}  (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -0,0 +1,397 @@
+# bench/run.py
+# Micro-benchmarks for the hot paths, fully offline (temp SQLite/Chroma, fake embeddings).
+# Run from the Week-6 folder:
+#   python -m bench.run                    # run all, compare against bench/baselines.json
+#   python -m bench.run --only cache       # substring filter
+#   python -m bench.run --update           # write current numbers as the new baselines
+# A benchmark whose dependencies are not installed (torch, chromadb...) or whose model files are not
+# in the local Hugging Face cache is reported as skipped; the suite never downloads anything.
+import os, sys, json, time, random, string, tempfile, argparse, platform
+
+_TMP = tempfile.mkdtemp(prefix="agent-bench-")
+# must be set before any project module is imported (they read env at import)
+os.environ.update({
+    "CACHE_DB": os.path.join(_TMP, "cache.db"),
+    "MEMORY_DB": os.path.join(_TMP, "memory.db"),
+    "CHROMA_DIR": os.path.join(_TMP, "chroma"),
+    "EMBED_BACKEND": "fake",
+    "TRACE_SINK": "none",
+    "CASSETTE_MODE": "off",
+})
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")         # uncached models raise OSError instead of downloading
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+REGRESSION = 1.25          # flag when >25% slower than baseline
+
+_BENCHES = []
+
+def bench(name, unit="op"):
+    def deco(fn):
+        _BENCHES.append((name, unit, fn))
+        return fn
+    return deco
+
+def measure(fn, min_s=0.3, max_runs=100_000):
+    """Seconds per call of fn() (after one warm-up call)."""
+    fn()
+    runs, t0 = 0, time.perf_counter()
+    while True:
+        fn(); runs += 1
+        dt = time.perf_counter() - t0
+        if dt >= min_s or runs >= max_runs:
+            return dt / runs
+
+def _words(n, seed=0):
+    rnd = random.Random(seed)
+    return " ".join("".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 9))) for _ in range(n))
+
+
+# --- rag / retriever ---
+@bench("rag.chunk_text.5MB", "doc")
+def _chunk():
+    from rag.chunking import chunk_text
+    text = _words(900_000)[:5_000_000]
+    return measure(lambda: chunk_text(text, max_chars=1200, overlap=200), min_s=1.0)
+
+@bench("retriever._clean.1MB", "doc")
+def _clean_big():
+    from tools.retriever import _clean
+    text = (_words(1000) + " <|endoftext|> \x07 ") * 150
+    text = text[:1_000_000]
+    return measure(lambda: _clean(text))
+
+@bench("retriever.add_documents.500x1200", "batch")
+def _add_docs():
+    from tools.retriever import add_documents, reset_collection
+    text = _words(200)[:1200]
+    n = [0]
+    def run():
+        n[0] += 1
+        add_documents([{"id": f"b{n[0]}-{i}", "text": text, "source": "bench.pdf"} for i in range(500)])
+    t = measure(run, min_s=1.0, max_runs=20)
+    reset_collection()
+    return t
+
+@bench("retriever.query_topk.k3@5k", "query")
+def _query():
+    from tools.retriever import add_documents, query_topk, reset_collection
+    reset_collection()
+    add_documents([{"id": f"q{i}", "text": _words(150, seed=i), "source": f"d{i % 7}.pdf"} for i in range(5000)])
+    qs = [_words(8, seed=10_000 + i) for i in range(50)]
+    i = [0]
+    def run():
+        i[0] += 1
+        query_topk(qs[i[0] % len(qs)], k=3)
+    t = measure(run)
+    reset_collection()
+    return t
+
+
+# --- infra.cache: the same benchmarks for every backend ---
+_VOCAB = _words(3000, seed=42).split()
+
+def _prose(n, seed=0):
+    # Zipf-distributed words: compresses like English text, unlike _words
+    rnd = random.Random(seed)
+    return " ".join(rnd.choices(_VOCAB, weights=[1 / (r + 1) for r in range(len(_VOCAB))], k=n))
+
+def _tool_result(n):
+    # a cached retrieve_docs-style payload: five PDF chunks with paths and scores (~9KB JSON)
+    return {"answer": _prose(120, seed=n), "results": [
+        {"text": _prose(180, seed=n * 10 + j), "source": f"docs/report{j}.pdf", "score": 0.1 * j} for j in range(5)]}
+
+def _threaded(op, threads=8, per_thread=300):
+    """Seconds per op with `threads` threads each calling op(t, i) per_thread times."""
+    import threading
+    def worker(t):
+        for i in range(per_thread):
+            op(t, i)
+    ts = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return (time.perf_counter() - t0) / (threads * per_thread)
+
+_resp = []
+
+def _cache(kind):
+    from infra import cache
+    if kind == "redis" and not _resp:
+        # in-process RESP stand-in: measures our client + protocol, not a real Redis
+        from bench import resp_server
+        _resp.append(resp_server.serve())
+        cache.CACHE_REDIS_URL = resp_server.url(_resp[0])
+    cache.init(kind)
+    return cache
+
+def _cache_benches(kind):
+    @bench(f"cache.{kind}.set", "op")
+    def _set():
+        cache = _cache(kind)
+        i = [0]
+        def run():
+            i[0] += 1
+            cache.set_(f"k{i[0]}", {"answer": "x" * 400})
+        return measure(run)
+
+    @bench(f"cache.{kind}.get.hit", "op")
+    def _get():
+        cache = _cache(kind)
+        for i in range(1000):
+            cache.set_(f"g{i}", {"answer": "x" * 400})
+        i = [0]
+        def run():
+            i[0] += 1
+            cache.get(f"g{i[0] % 1000}")
+        return measure(run)
+
+    @bench(f"cache.{kind}.mget.50", "batch")
+    def _mget():
+        cache = _cache(kind)
+        cache.mset({f"mg{i}": {"answer": "x" * 400} for i in range(1000)})
+        batches = [[f"mg{(j * 50 + i) % 1000}" for i in range(50)] for j in range(20)]
+        j = [0]
+        def run():
+            j[0] += 1
+            cache.mget(batches[j[0] % 20])
+        return measure(run)
+
+    @bench(f"cache.{kind}.mset.50", "batch")
+    def _mset():
+        cache = _cache(kind)
+        j = [0]
+        def run():
+            j[0] += 1
+            cache.mset({f"ms{j[0]}-{i}": {"answer": "x" * 400} for i in range(50)})
+        return measure(run)
+
+    @bench(f"cache.{kind}.set.tool_result", "op")
+    def _set_big():
+        cache = _cache(kind)
+        vals = [_tool_result(n) for n in range(50)]
+        i = [0]
+        def run():
+            i[0] += 1
+            cache.set_(f"big{i[0]}", vals[i[0] % 50])
+        return measure(run)
+
+    @bench(f"cache.{kind}.get.tool_result", "op")
+    def _get_big():
+        cache = _cache(kind)
+        for n in range(50):
+            cache.set_(f"bg{n}", _tool_result(n))
+        i = [0]
+        def run():
+            i[0] += 1
+            cache.get(f"bg{i[0] % 50}")
+        return measure(run)
+
+    @bench(f"cache.{kind}.set+get.8threads", "op")
+    def _mixed():
+        cache = _cache(kind)
+        n = [0]
+        def op(t, i):
+            if i % 4 == 0:
+                cache.set_(f"m{t}-{i}-{n[0]}", {"answer": "x" * 400})
+            else:
+                cache.get(f"m{t}-{i - i % 4}-{n[0]}")
+        best = None
+        for _ in range(3):
+            n[0] += 1
+            s = _threaded(op)
+            best = s if best is None else min(best, s)
+        return best
+
+for _kind in ("memory", "sqlite", "redis"):
+    _cache_benches(_kind)
+
+
+# --- memory.memory at scale ---
+MEMORY_ROWS = int(os.getenv("BENCH_MEMORY_ROWS", "1000000"))
+_mem_ready = []
+
+def _memory_fill():
+    if _mem_ready:
+        return
+    import sqlite3
+    from memory import memory
+    memory.init_db()
+    users = 10_000
+    with sqlite3.connect(memory.DB_PATH) as c:
+        c.executemany("INSERT INTO facts(user_id,fact,h,ts) VALUES(?,?,?,datetime('now', ?))",
+                      ((f"u{i % users}", f"fact number {i}", memory.fact_hash(f"fact number {i}"), f"-{i} seconds")
+                       for i in range(MEMORY_ROWS)))
+        c.executemany("INSERT OR REPLACE INTO profiles(user_id,k,v) VALUES(?,?,?)",
+                      ((f"u{i}", "citation_style", "path-only") for i in range(users)))
+    _mem_ready.append(users)
+
+@bench(f"memory.get_recent_facts@{MEMORY_ROWS // 1000}k", "op")
+def _mem_recent():
+    from memory import memory
+    _memory_fill()
+    i = [0]
+    def run():
+        i[0] += 1
+        memory.get_recent_facts(f"u{i[0] % _mem_ready[0]}", n=5)
+    return measure(run, max_runs=2000)
+
+@bench(f"memory.get_profile_dict@{MEMORY_ROWS // 1000}k", "op")
+def _mem_profile():
+    from memory import memory
+    _memory_fill()
+    i = [0]
+    def run():
+        i[0] += 1
+        memory.get_profile_dict(f"u{i[0] % _mem_ready[0]}")
+    return measure(run)
+
+@bench("memory.hot_user_reads", "request")
+def _mem_hot():
+    # what the hot path does before the answer-cache check for a returning user: served from
+    # the in-process read cache (the per-op benches above cycle through 10k users: cold reads)
+    from memory import memory
+    _memory_fill()
+    i = [0]
+    def run():
+        i[0] += 1
+        uid = f"u{i[0] % 16}"
+        memory.get_profile_dict(uid)
+        memory.get_recent_facts(uid, n=5)
+    return measure(run)
+
+@bench(f"memory.add_fact@{MEMORY_ROWS // 1000}k", "op")
+def _mem_add():
+    from memory import memory
+    _memory_fill()
+    i = [0]
+    def run():
+        i[0] += 1
+        memory.add_fact(f"u{i[0] % 100}", f"new fact {i[0]}")
+    return measure(run)
+
+@bench("memory.recall_facts.1000facts", "op")
+def _mem_recall():
+    # warm per-user index (what every request after the first pays); query embeddings are memoized
+    from memory import memory, recall
+    from memory.recall import recall_facts, remember
+    memory.init_db()
+    for j in range(1000):
+        memory.add_fact("recall-user", f"the user mentioned {_prose(12, seed=j)}")
+    remember("recall-user", "the user prefers path-only citations")
+    goals = [_prose(10, seed=-j) for j in range(50)]
+    for g in goals:                                 # starts the goal embeddings and the fact backfill
+        recall_facts("recall-user", g)
+    recall._embedder.submit(lambda: None).result()
+    while recall._inflight:
+        time.sleep(0.01)
+    i = [0]
+    def run():
+        i[0] += 1
+        recall_facts("recall-user", goals[i[0] % 50])
+    return measure(run)
+
+@bench("memory.recall_facts.cold_goal_slow_embed", "op")
+def _mem_recall_cold():
+    # worst case on a request: a goal never seen before, a 200ms (remote-like) embedder and facts
+    # stored before embeddings existed; bounded by MEMORY_RECALL_EMBED_MS=50, the rest runs in background
+    # (the auto wait trades this bound for recall on new goals: python -m bench.recall_embed)
+    from memory import memory, recall
+    memory.init_db()
+    for j in range(1000):
+        memory.add_fact("cold-user", f"the user mentioned {_prose(12, seed=j)}")     # stored without an embedding
+    inner = recall._embed
+    def slow(texts):
+        time.sleep(0.2)
+        return inner(texts)
+    recall._embed = slow
+    recall.MEMORY_RECALL_EMBED_MS, wait = 50.0, recall.MEMORY_RECALL_EMBED_MS
+    i = [0]
+    def run():
+        i[0] += 1
+        recall.recall_facts("cold-user", f"{_prose(10, seed=10_000 + i[0])} #{i[0]}")
+    try:
+        return measure(run, min_s=0.5)
+    finally:
+        recall._embed, recall.MEMORY_RECALL_EMBED_MS = inner, wait
+
+@bench("memory.request_path.8threads", "request")
+def _mem_request():
+    # what one run_agent does against memory: profile + facts + usage reads, one usage write
+    from memory import memory
+    _memory_fill()
+    def op(t, i):
+        uid = f"u{(t * 1000 + i) % _mem_ready[0]}"
+        memory.get_profile_dict(uid)
+        memory.get_recent_facts(uid, n=5)
+        memory.get_usage_today(uid)
+        memory.record_usage(uid, prompt_tokens=100, cached_tokens=0, completion_tokens=20, cost_usd=0.001)
+    return _threaded(op, per_thread=20)
+
+
+# --- tools / safety ---
+@bench("sentiment.batch1", "text")
+def _sentiment():
+    from tools.sentiment import sentiment
+    return measure(lambda: sentiment("This movie was fantastic and moving."), min_s=1.0)
+
+@bench("safety.detect_injection.10KB", "doc")
+def _inj_benign():
+    from safety.scanner import scan
+    text = ("The committee reviewed the quarterly report and approved the budget. " * 150)[:10_000]
+    return measure(lambda: scan(text))
+
+@bench("safety.detect_injection.adversarial100KB", "doc")
+def _inj_adv():
+    from safety.scanner import scan
+    text = ("override disregard print show return " * 3000)[:100_000]
+    return measure(lambda: scan(text))
+
+
+def _fmt(s):
+    return f"{s*1e6:,.1f} us" if s < 1e-3 else f"{s*1e3:,.2f} ms" if s < 1 else f"{s:,.2f} s"
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--only", default="", help="substring filter on benchmark names")
+    ap.add_argument("--update", action="store_true", help="write results to bench/baselines.json")
+    a = ap.parse_args(argv)
+
+    base = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            base = json.load(f)
+    results = dict(base.get("results", {}))
+    print(f"{'benchmark':<42}{'per op':>14}{'ops/s':>12}{'baseline':>14}{'change':>10}")
+    regressions = 0
+    for name, unit, fn in _BENCHES:
+        if a.only not in name:
+            continue
+        try:
+            s = fn()
+        except (ImportError, OSError) as e:
+            print(f"{name:<42}{'skipped: ' + (str(e).splitlines() or [''])[0]:>50}")
+            continue
+        b = base.get("results", {}).get(name, {}).get("s_per_op")
+        change = ""
+        if b:
+            ratio = s / b
+            change = f"{(ratio - 1) * 100:+.0f}%" + (" !" if ratio > REGRESSION else "")
+            regressions += ratio > REGRESSION
+        print(f"{name:<42}{_fmt(s):>14}{1/s:>12,.0f}{(_fmt(b) if b else '-'):>14}{change:>10}")
+        results[name] = {"s_per_op": round(s, 9), "unit": unit}
+
+    if a.update:
+        with open(BASELINES, "w") as f:
+            json.dump({"machine": f"{platform.machine()} {platform.python_implementation()} {platform.python_version()}",
+                       "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baselines written to {BASELINES}")
+    if regressions:
+        print(f"{regressions} benchmark(s) more than {int((REGRESSION - 1) * 100)}% slower than baseline")
+    return 1 if regressions and not a.update else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
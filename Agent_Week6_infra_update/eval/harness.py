@@ -1,14 +1,23 @@
 import os, time, math, json
 from typing import List, Dict
 from openai import OpenAI
+from openai.types.chat import ChatCompletion
 from tools.retriever import query_topk
 from agent import run_agent
+from infra.metrics import snapshot as metrics_snapshot
+from infra import cassette
+
+try:
+    from safety.filter import guard_many, moderation_stats
+except Exception:
+    guard_many = None
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 EMBED = os.getenv("EMBED_MODEL","text-embedding-3-small")
 
 def embed(txt: str):
-    return client.embeddings.create(model=EMBED, input=txt or "").data[0].embedding
+    return cassette.call("embedding", {"model": EMBED, "input": [txt or ""]},
+                         lambda: [client.embeddings.create(model=EMBED, input=txt or "").data[0].embedding])[0]
 
 def cos(a,b):
     s = sum(x*y for x,y in zip(a,b))
@@ -19,14 +28,17 @@ def llm_judge(question: str, context: str, answer: str) -> bool:
     prompt = (f"Given the context, judge if the answer is supported by it.\n"
               f"Question: {question}\nContext:\n{context}\nAnswer:\n{answer}\n"
               "Respond with ONLY 'SUPPORTED' or 'UNSUPPORTED'.")
-    m = client.chat.completions.create(model=os.getenv("MODEL","gpt-4.1-mini"),
-                                       messages=[{"role":"user","content":prompt}])
+    req = {"model": os.getenv("MODEL","gpt-4.1-mini"), "messages": [{"role":"user","content":prompt}]}
+    m = cassette.call("chat", req, lambda: client.chat.completions.create(**req),
+                      decode=ChatCompletion.model_validate)
     out = (m.choices[0].message.content or "").strip().upper()
     return out.startswith("SUPPORTED")
 
-def run_suite(cases: List[Dict], k_for_eval=3, sim_threshold=0.75) -> Dict:
+def run_suite(cases: List[Dict], k_for_eval=3, sim_threshold=0.75, guard=False) -> Dict:
     rows = []
-    for c in cases:
+    # guard=True screens every case up front with one batched moderation pass
+    guards = guard_many([c["q"] for c in cases]) if guard and guard_many else [{} for _ in cases]
+    for c, g in zip(cases, guards):
         q = c["q"]
         expect_src = c.get("expect_src")
         expect_ans = c.get("expect_ans")
@@ -34,7 +46,7 @@ def run_suite(cases: List[Dict], k_for_eval=3, sim_threshold=0.75) -> Dict:
         judge_grounded = c.get("judge_grounded", False)
 
         t0 = time.time()
-        ans = run_agent(q)
+        ans = f"Refused: {g.get('reason','blocked')}." if g.get("blocked") else run_agent(q)
         dt = time.time()-t0
 
         citation_ok = (expect_src is None) or (expect_src in ans)
@@ -63,4 +75,10 @@ def run_suite(cases: List[Dict], k_for_eval=3, sim_threshold=0.75) -> Dict:
 
     n = len(rows)
     passed = sum(1 for r in rows if r["citation_ok"] and r["json_ok"] and r["grounded"] and r["sim_ok"])
-    return {"summary":{"n":n,"pass_rate":round(passed/max(n,1),3)}, "rows": rows}
+    summary = {"n":n,"pass_rate":round(passed/max(n,1),3)}
+    summary["latency"] = metrics_snapshot("span_duration")    # p50/p95/p99 per span + labels
+    if metrics_snapshot("llm_round_cache"):
+        summary["round_cache"] = metrics_snapshot("llm_round_cache")    # hits/misses per agent round
+    if guard and guard_many:
+        summary["moderation"] = moderation_stats()
+    return {"summary":summary, "rows": rows}
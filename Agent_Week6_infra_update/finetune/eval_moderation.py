@@ -0,0 +1,76 @@
+# finetune/eval_moderation.py
+# Accuracy + per-request latency: remote-only vs local-only vs tiered (local, escalate uncertain).
+# Uses the held-out split of MOD_DATA from train_moderation.py.
+# Run from the Week-6 folder:  python -m finetune.eval_moderation [--limit 200] [--json out.json]
+#   --no-remote: local-only, plus how much of the set the tiered path would decide locally (no API key)
+import os, sys, json, time, argparse
+import numpy as np
+from sklearn.metrics import accuracy_score, f1_score
+
+from finetune.train_moderation import load_split
+from safety.local_mod import classify_many
+
+def _pct(xs, q):
+    return round(float(np.percentile(xs, q)) * 1e3, 1) if xs else None
+
+def _row(name, y, preds, lat, extra=None):
+    r = {"path": name, "acc": round(accuracy_score(y, preds), 4), "f1": round(f1_score(y, preds), 4),
+         "p50_ms": _pct(lat, 50), "p95_ms": _pct(lat, 95)}
+    r.update(extra or {})
+    return r
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--limit", type=int, default=200, help="remote calls are rate limited; cap the test set")
+    ap.add_argument("--no-remote", action="store_true", help="skip the omni-moderation calls")
+    ap.add_argument("--json", default="", help="also write the rows here")
+    a = ap.parse_args(argv)
+    if a.no_remote:                                     # safety.filter builds its client at import; never called here
+        os.environ.setdefault("OPENAI_API_KEY", "unused")
+    from safety.filter import _moderate_batch, LOCAL_MOD_LOW, LOCAL_MOD_HIGH
+    test = load_split()["test"]
+    texts = test["text"][:a.limit]
+    y = test["label"][:a.limit]
+
+    remote, remote_lat = [], []
+    for t in ([] if a.no_remote else texts):            # one call per request, like guard_query
+        t0 = time.perf_counter()
+        v = _moderate_batch([t])[0]
+        if "error" in v:                                # fail-open verdicts would score as "allowed"
+            print(f"remote moderation failed: {v['error']} (use --no-remote)")
+            return 1
+        remote.append(int(v["flagged"]))
+        remote_lat.append(time.perf_counter() - t0)
+
+    local_p, local_lat = [], []
+    for t in texts:
+        t0 = time.perf_counter()
+        local_p.append(classify_many([t])[0])
+        local_lat.append(time.perf_counter() - t0)
+    local = [int(p >= 0.5) for p in local_p]
+
+    band = {"band": [LOCAL_MOD_LOW, LOCAL_MOD_HIGH]}
+    sure = [i for i, p in enumerate(local_p) if not LOCAL_MOD_LOW <= p <= LOCAL_MOD_HIGH]
+    escalation = {"escalation_rate": round(1 - len(sure) / max(len(texts), 1), 3), **band}
+    rows = [_row("local-only", y, local, local_lat)]
+    if sure:
+        # what the tiered path decides without a remote call, scored on those inputs only
+        rows.append(_row("tiered:local-part", [y[i] for i in sure], [int(local_p[i] > LOCAL_MOD_HIGH) for i in sure],
+                         [local_lat[i] for i in sure], escalation))
+    if remote:
+        tiered, tiered_lat = [], []
+        for p, r, ll, rl in zip(local_p, remote, local_lat, remote_lat):
+            if LOCAL_MOD_LOW <= p <= LOCAL_MOD_HIGH:
+                tiered.append(r); tiered_lat.append(ll + rl)
+            else:
+                tiered.append(int(p > LOCAL_MOD_HIGH)); tiered_lat.append(ll)
+        rows = [_row("remote-only", y, remote, remote_lat)] + rows + [_row("tiered", y, tiered, tiered_lat, escalation)]
+    for r in rows:
+        print(r)
+    if a.json:
+        with open(a.json, "w") as f:
+            json.dump({"n": len(texts), "rows": rows}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,76 @@
+# finetune/train_moderation.py
+# LoRA-on-DistilBERT moderation classifier, same recipe as train_sentiment.py but trained
+# from a local labeled file instead of IMDB.
+#
+# Data: MOD_DATA (JSONL), one object per line: {"text": "...", "label": 0|1}   (1 = should be flagged)
+# Run from the Week-6 folder:  python -m finetune.train_moderation
+import os
+import numpy as np
+from datasets import load_dataset
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, Trainer
+from peft import LoraConfig, get_peft_model
+from sklearn.metrics import accuracy_score, f1_score
+
+from finetune.train_sentiment import make_training_args
+
+BASE_MODEL = os.getenv("BASE_MODEL", "distilbert-base-uncased")
+MOD_DATA = os.getenv("MOD_DATA", "finetune/data/moderation.jsonl")
+OUT_DIR = os.getenv("OUT_DIR", "finetune/adapters-distilbert-moderation")
+
+def load_split(path=MOD_DATA, test_size=0.2):
+    ds = load_dataset("json", data_files=path)["train"]
+    return ds.shuffle(seed=42).train_test_split(test_size=test_size, seed=42)
+
+def main():
+    # 1) Data
+    ds = load_split()
+
+    # 2) Tokenizer
+    tok = AutoTokenizer.from_pretrained(BASE_MODEL, use_fast=True)
+
+    def enc(ex):
+        return tok(ex["text"], truncation=True, padding="max_length", max_length=256)
+
+    enc_ds = ds.map(enc, batched=True).rename_column("label", "labels")
+    enc_ds.set_format(type="torch", columns=["input_ids", "attention_mask", "labels"])
+
+    # 3) Base model + LoRA (SEQ_CLS so the classifier head is saved with the adapter)
+    base = AutoModelForSequenceClassification.from_pretrained(BASE_MODEL, num_labels=2)
+    lora_cfg = LoraConfig(
+        r=8,
+        lora_alpha=16,
+        target_modules=["q_lin", "v_lin"],  # DistilBERT attention proj layers
+        lora_dropout=0.05,
+        bias="none",
+        task_type="SEQ_CLS",
+    )
+    model = get_peft_model(base, lora_cfg)
+
+    # 4) Metrics
+    def metrics(p):
+        preds = np.argmax(p.predictions, axis=1)
+        return {
+            "acc": accuracy_score(p.label_ids, preds),
+            "f1": f1_score(p.label_ids, preds),
+        }
+
+    # 5) Train
+    args = make_training_args(output_dir="finetune/out-moderation")
+    trainer = Trainer(
+        model=model,
+        args=args,
+        train_dataset=enc_ds["train"],
+        eval_dataset=enc_ds["test"],
+        compute_metrics=metrics,
+    )
+    trainer.train()
+    print(trainer.evaluate())
+
+    # 6) Save adapter + tokenizer
+    os.makedirs(OUT_DIR, exist_ok=True)
+    model.save_pretrained(OUT_DIR)
+    tok.save_pretrained(OUT_DIR)
+    print(f"Saved LoRA adapter to: {OUT_DIR}")
+
+if __name__ == "__main__":
+    main()
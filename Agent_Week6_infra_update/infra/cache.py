@@ -1,24 +1,312 @@
 # infra/cache.py
-import os, sqlite3, json, hashlib, time
+# Answer cache. Keys include the versions of what an answer depends on (corpus generation,
+# embed model, app version, tool set...), so invalidation is O(1): bump a generation counter and
+# every key built afterwards is new. Orphaned entries age out with CACHE_TTL_S / prune().
+#
+# Backends (CACHE_BACKEND):
+#   sqlite (default) -> CACHE_DB via infra.storage; shared by the processes on one node
+#   memory           -> in-process dict (LRU, CACHE_MEM_MAX entries); tests, single worker
+#   redis            -> any Redis-protocol server at CACHE_REDIS_URL; shared across nodes
+# Values are encoded with infra.codec by this module; backends only move bytes.
+import os, json, time, socket, hashlib, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+from infra import storage, codec, metrics
 DB = os.getenv("CACHE_DB","cache.db")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", str(7 * 86400)))       # 0 = never expire
+CACHE_GEN_TTL_S = float(os.getenv("CACHE_GEN_TTL_S", "1.0"))        # how long a generation read is reused
+CACHE_MEM_MAX = int(os.getenv("CACHE_MEM_MAX", "100000"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+CACHE_REDIS_PREFIX = os.getenv("CACHE_REDIS_PREFIX", "agent:")
+CACHE_REDIS_TIMEOUT_S = float(os.getenv("CACHE_REDIS_TIMEOUT_S", "2.0"))
 
-def _conn(): return sqlite3.connect(DB)
 
-def init():
-    with _conn() as c:
-        c.execute("""CREATE TABLE IF NOT EXISTS cache(
-            k TEXT PRIMARY KEY, v TEXT, ts REAL)""")
+class SqliteBackend:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or DB
+        storage.script(self.path, """
+            CREATE TABLE IF NOT EXISTS cache(
+                k TEXT PRIMARY KEY, v TEXT, ts REAL);   -- v: codec BLOB (older rows: JSON TEXT)
+            CREATE TABLE IF NOT EXISTS generations(
+                name TEXT PRIMARY KEY, gen INTEGER NOT NULL);""")
 
-def make_key(model: str, prompt: str, profile: dict) -> str:
-    payload = json.dumps({"m":model, "p":prompt, "profile":profile}, sort_keys=True)
+    def get_many(self, keys: Sequence[str], ttl: float) -> List[Any]:
+        if len(keys) == 1:
+            row = storage.query_one(self.path, "SELECT v, ts FROM cache WHERE k=?", (keys[0],))
+            rows = {keys[0]: row} if row else {}
+        else:
+            rows = {}
+            for i in range(0, len(keys), 500):      # stay under SQLite's host-parameter limit
+                part = keys[i:i + 500]
+                q = f"SELECT k, v, ts FROM cache WHERE k IN ({','.join('?' * len(part))})"
+                rows.update((k, (v, ts)) for k, v, ts in storage.query(self.path, q, part))
+        cutoff = time.time() - ttl if ttl else None
+        return [r[0] if r and (cutoff is None or r[1] is None or r[1] >= cutoff) else None
+                for r in (rows.get(k) for k in keys)]
+
+    def set_many(self, items: Sequence[Tuple[str, bytes]], ttl: float):
+        now = time.time()
+        if len(items) == 1:
+            storage.write(self.path, "INSERT OR REPLACE INTO cache(k,v,ts) VALUES(?,?,?)",
+                          (items[0][0], items[0][1], now))
+        else:
+            storage.write_many(self.path, "INSERT OR REPLACE INTO cache(k,v,ts) VALUES(?,?,?)",
+                               ((k, v, now) for k, v in items))
+
+    def read_gen(self, name: str) -> int:
+        row = storage.query_one(self.path, "SELECT gen FROM generations WHERE name=?", (name,))
+        return row[0] if row else 0
+
+    def incr_gen(self, name: str):
+        storage.write(self.path, """INSERT INTO generations(name,gen) VALUES(?,1)
+            ON CONFLICT(name) DO UPDATE SET gen=gen+1""", (name,))
+
+    def prune(self, age: float) -> int:
+        return storage.write(self.path, "DELETE FROM cache WHERE ts < ?", (time.time() - age,))
+
+
+class MemoryBackend:
+    def __init__(self, max_items: int = CACHE_MEM_MAX):
+        self.max_items = max_items
+        self.d: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.gens: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str], ttl: float) -> List[Any]:
+        cutoff = time.time() - ttl if ttl else None
+        out = []
+        with self.lock:
+            for k in keys:
+                e = self.d.get(k)
+                if e is None or (cutoff is not None and e[1] < cutoff):
+                    out.append(None)
+                else:
+                    self.d.move_to_end(k)
+                    out.append(e[0])
+        return out
+
+    def set_many(self, items: Sequence[Tuple[str, bytes]], ttl: float):
+        now = time.time()
+        with self.lock:
+            for k, v in items:
+                self.d[k] = (v, now)
+                self.d.move_to_end(k)
+            while len(self.d) > self.max_items:
+                self.d.popitem(last=False)
+
+    def read_gen(self, name: str) -> int:
+        return self.gens.get(name, 0)
+
+    def incr_gen(self, name: str):
+        with self.lock:
+            self.gens[name] = self.gens.get(name, 0) + 1
+
+    def prune(self, age: float) -> int:
+        cutoff = time.time() - age
+        with self.lock:
+            old = [k for k, (_, ts) in self.d.items() if ts < cutoff]
+            for k in old:
+                del self.d[k]
+        return len(old)
+
+
+# --- Redis protocol (RESP2) ---
+class RespError(Exception):
+    pass
+
+class RespClient:
+    """Minimal RESP2 client: one socket, commands sent in pipelines."""
+
+    def __init__(self, url: str = CACHE_REDIS_URL, timeout: float = CACHE_REDIS_TIMEOUT_S):
+        u = urlparse(url)
+        self.sock = socket.create_connection((u.hostname or "127.0.0.1", u.port or 6379), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.f = self.sock.makefile("rb")
+        if u.password:
+            self.pipeline([("AUTH", u.password)] if not u.username else [("AUTH", u.username, u.password)])
+        db = (u.path or "/0").lstrip("/") or "0"
+        if db != "0":
+            self.pipeline([("SELECT", db)])
+
+    @staticmethod
+    def _pack(args: Sequence[Any]) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        return b"".join(out)
+
+    def _read(self) -> Any:
+        line = self.f.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        t, rest = line[:1], line[1:-2]
+        if t == b"+":
+            return rest.decode()
+        if t == b"-":
+            return RespError(rest.decode())
+        if t == b":":
+            return int(rest)
+        if t == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self.f.read(n + 2)
+            return data[:-2]
+        if t == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read() for _ in range(n)]
+        raise RespError(f"bad reply {line[:20]!r}")
+
+    def pipeline(self, cmds: Sequence[Sequence[Any]]) -> List[Any]:
+        """Send all commands in one write, then read one reply per command."""
+        self.sock.sendall(b"".join(self._pack(c) for c in cmds))
+        replies = [self._read() for _ in cmds]
+        for r in replies:
+            if isinstance(r, RespError):
+                raise r
+        return replies
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class RedisBackend:
+    def __init__(self, url: Optional[str] = None, prefix: str = CACHE_REDIS_PREFIX):
+        self.url, self.prefix = url or CACHE_REDIS_URL, prefix
+        self._local = threading.local()
+        self._client().pipeline([("PING",)])      # fail fast on a bad URL
+
+    def _client(self) -> RespClient:
+        c = getattr(self._local, "c", None)
+        if c is None:
+            c = self._local.c = RespClient(self.url)
+        return c
+
+    def _call(self, cmds: Sequence[Sequence[Any]]) -> List[Any]:
+        try:
+            return self._client().pipeline(cmds)
+        except (OSError, ConnectionError):
+            # reconnect once (server restart, idle timeout)
+            if getattr(self._local, "c", None) is not None:
+                self._local.c.close()
+            self._local.c = None
+            return self._client().pipeline(cmds)
+
+    def get_many(self, keys: Sequence[str], ttl: float) -> List[Any]:
+        return self._call([("MGET", *[self.prefix + k for k in keys])])[0]
+
+    def set_many(self, items: Sequence[Tuple[str, bytes]], ttl: float):
+        ex = ("EX", int(ttl)) if ttl else ()
+        self._call([("SET", self.prefix + k, v, *ex) for k, v in items])
+
+    def read_gen(self, name: str) -> int:
+        v = self._call([("GET", f"{self.prefix}gen:{name}")])[0]
+        return int(v) if v else 0
+
+    def incr_gen(self, name: str):
+        self._call([("INCR", f"{self.prefix}gen:{name}")])
+
+    def prune(self, age: float) -> int:
+        return 0        # entries carry their own EX ttl
+
+
+_BACKENDS = {"sqlite": SqliteBackend, "memory": MemoryBackend, "redis": RedisBackend}
+_backend = None
+
+def backend():
+    if _backend is None:
+        init()
+    return _backend
+
+def init(kind: Optional[str] = None):
+    """Select the backend (CACHE_BACKEND unless given) and create its storage. Idempotent per kind."""
+    global _backend
+    kind = kind or CACHE_BACKEND
+    if _backend is not None and type(_backend) is _BACKENDS.get(kind):
+        return _backend
+    if kind not in _BACKENDS:
+        raise ValueError(f"unknown CACHE_BACKEND {kind!r} (choose from {', '.join(_BACKENDS)})")
+    _backend = _BACKENDS[kind]()
+    _gens.clear()
+    return _backend
+
+def make_key(model: str, prompt: str, profile: dict, deps: Optional[Dict[str, Any]] = None) -> str:
+    payload = json.dumps({"m":model, "p":prompt, "profile":profile, "deps":deps or {}}, sort_keys=True)
     return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
+
+# --- generations ---
+_gens: Dict[str, tuple] = {}       # name -> (gen, read_at)
+_gen_lock = threading.Lock()
+
+def generation(name: str) -> int:
+    """Current generation of `name` (0 if never bumped). Re-read at most every CACHE_GEN_TTL_S,
+    so bumps from other processes show up within that window."""
+    now = time.monotonic()
+    hit = _gens.get(name)
+    if hit and now - hit[1] < CACHE_GEN_TTL_S:
+        return hit[0]
+    g = backend().read_gen(name)
+    with _gen_lock:
+        _gens[name] = (g, now)
+    return g
+
+def bump(name: str) -> int:
+    """Invalidate every entry whose key was built with generation(name)."""
+    backend().incr_gen(name)
+    with _gen_lock:
+        _gens.pop(name, None)
+    metrics.counter("cache_invalidations_total", tag=name).inc()
+    return generation(name)
+
+
+def _decode(v: Any):
+    if v is None:
+        return None
+    try:
+        return codec.decode(v)
+    except ValueError:
+        metrics.counter("cache_decode_errors_total").inc()
+        return None
+
 def get(k: str):
-    with _conn() as c:
-        row = c.execute("SELECT v FROM cache WHERE k=?", (k,)).fetchone()
-    return json.loads(row[0]) if row else None
+    return _decode(backend().get_many([k], CACHE_TTL_S)[0])
+
+def mget(keys: Sequence[str]) -> List[Any]:
+    """One round trip for many keys; None for misses."""
+    if not keys:
+        return []
+    return [_decode(v) for v in backend().get_many(list(keys), CACHE_TTL_S)]
 
 def set_(k: str, v_obj):
-    with _conn() as c:
-        c.execute("INSERT OR REPLACE INTO cache(k,v,ts) VALUES(?,?,?)",
-                  (k, json.dumps(v_obj, ensure_ascii=False), time.time()))
+    backend().set_many([(k, codec.encode(v_obj))], CACHE_TTL_S)
+
+def mset(items: Dict[str, Any]):
+    """One round trip (one transaction on sqlite) for many entries."""
+    if items:
+        backend().set_many([(k, codec.encode(v)) for k, v in items.items()], CACHE_TTL_S)
+
+def prune(max_age_s: Optional[float] = None) -> int:
+    """Delete entries older than max_age_s (default CACHE_TTL_S), incl. ones orphaned by a bump."""
+    age = CACHE_TTL_S if max_age_s is None else max_age_s
+    if not age:
+        return 0
+    return backend().prune(age)
+
+
+if __name__ == "__main__":
+    # python -m infra.cache bump all|corpus   /   python -m infra.cache prune
+    import sys
+    init()
+    if sys.argv[1:2] == ["bump"] and len(sys.argv) == 3:
+        print(f"{sys.argv[2]} -> generation {bump(sys.argv[2])}")
+    elif sys.argv[1:2] == ["prune"]:
+        print(f"pruned {prune()} entries")
+    else:
+        print("usage: python -m infra.cache bump <name> | prune")
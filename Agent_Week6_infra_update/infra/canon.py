@@ -0,0 +1,105 @@
+# infra/canon.py
+# Cache-key canonicalization: the same question asked slightly differently should hit the same entry.
+#   answer_class(goal)        -> rag | web | math | json | memory | sentiment | general
+#   canonical(goal, cls)      -> NFKC + whitespace folding; case folding except where case is data (json);
+#                                arithmetic rewritten to a stable "math:<expr>" form
+#   relevant_profile(p, cls)  -> only the profile fields that class of answer depends on
+# CACHE_CANONICAL=0 turns all of this off (raw goal + full profile, the old key).
+import os, re, unicodedata
+from typing import Dict, Optional, Tuple
+
+CACHE_CANONICAL = os.getenv("CACHE_CANONICAL", "1") == "1"
+
+# profile fields each answer class reads; "*" = the whole profile.
+# rag/web cite sources (citation_style) and rag retrieves default_k chunks; math/json/sentiment
+# answers don't look at the profile at all; memory questions are about the profile itself.
+PROFILE_DEPS: Dict[str, Tuple[str, ...]] = {
+    "rag": ("citation_style", "default_k"),
+    "web": ("citation_style",),
+    "math": (),
+    "json": (),
+    "sentiment": (),
+    "memory": ("*",),
+    "general": ("*",),
+}
+
+_WS = re.compile(r"\s+")
+_TRAIL = re.compile(r"[\s.?!]+$")
+_OPS = str.maketrans({"×": "*", "÷": "/", "−": "-", "–": "-", "—": "-"})
+# an arithmetic expression: numbers joined by operators, parentheses allowed
+_EXPR = re.compile(r"[(\d][\d\s.()+\-*/x^%]*[\d)]")
+_MATH_VERB = re.compile(r"^(?:please\s+)?(?:compute|calculate|evaluate|what\s+is|what's|solve)\b[:\s]*")
+_ONLY_NUMBER = re.compile(r"\b(?:only|just)\s+(?:the\s+)?(?:number|result|answer)\b")
+# words that may surround an expression without changing the answer; "and"/"of" only before an
+# output instruction ("... and return only the number"), elsewhere they join or apply more arithmetic
+_FILLER = re.compile(r"\band(?=\s+(?:return|give|output|reply)\b)|"
+                     r"\b(?:return|give|me|output|reply|with|the|result|please|exactly|=)\b|[=,:]")
+
+# memory comes first: a goal about the user ("return my name as json", "the sentiment of my last
+# message") needs the user's profile and facts whatever else it asks for, so it is never shared.
+# Plain "me" is left out: "give me the result" is an output instruction, not a question about the user.
+_CLASS_RULES = [
+    ("memory", re.compile(r"\b(?:i|my|mine|myself|remember|about me|for me|to me)\b")),
+    ("sentiment", re.compile(r"\bsentiment\b|\bclassify\b.*\b(?:review|positive|negative)\b")),
+    ("json", re.compile(r"\bjson\b")),
+    ("web", re.compile(r"\b(?:urls?|web|online|internet|latest|news)\b|https?://")),
+    ("rag", re.compile(r"\b(?:section|pdfs?|documents?|docs?|cite|citation|source path|file path)\b")),
+]
+
+
+def _fold(text: str, casefold: bool = True) -> str:
+    t = unicodedata.normalize("NFKC", text or "")
+    t = _WS.sub(" ", t).strip()
+    t = _TRAIL.sub("", t)
+    return t.casefold() if casefold else t
+
+def _math_expr(t: str) -> Optional[str]:
+    """The arithmetic in a folded goal, without spaces ('17 x 24' -> '17*24'); None if there is none."""
+    m = max(_EXPR.findall(t.translate(_OPS)), key=len, default="")
+    expr = re.sub(r"(?<=[\d)])\s*x\s*(?=[\d(])", "*", m)
+    expr = re.sub(r"\s+", "", expr).replace("^", "**")
+    return expr if re.search(r"\d[+\-*/%]|\)[+\-*/%]|\*\*", expr) else None
+
+def answer_class(goal: str) -> str:
+    t = _fold(goal)
+    # first match wins: "summarize section 3.1 ... then compute 250*1.13" is a document question,
+    # "compute my total: 17*24" is about the user
+    for cls, rx in _CLASS_RULES:
+        if rx.search(t):
+            return cls
+    if _math_expr(t) and (_MATH_VERB.search(t) or _fold(_EXPR.sub("", t.translate(_OPS))) in ("", "=")):
+        return "math"
+    return "general"
+
+def canonical(goal: str, cls: Optional[str] = None) -> str:
+    cls = cls or answer_class(goal)
+    if cls == "json":
+        return _fold(goal, casefold=False)          # names and values in the prompt are output verbatim
+    t = _fold(goal)
+    if cls == "math":
+        expr = _math_expr(t)
+        body = _ONLY_NUMBER.sub(" ", _MATH_VERB.sub("", t)).translate(_OPS)
+        # only for a single expression with nothing but filler around it: "compute 2+2 and explain it"
+        # and "what is 2+2 and 3+3" keep their text
+        if expr and len(_EXPR.findall(body)) == 1 and not _FILLER.sub(" ", _EXPR.sub(" ", body)).strip():
+            return f"math:{expr}" + (":number" if _ONLY_NUMBER.search(t) else "")
+    return t
+
+def relevant_profile(profile: Dict[str, str], cls: str) -> Dict[str, str]:
+    deps = PROFILE_DEPS.get(cls, ("*",))
+    if "*" in deps:
+        return dict(profile)
+    return {k: profile[k] for k in deps if k in profile}
+
+def user_scoped(cls: str) -> bool:
+    """Answers of this class see the whole profile and the user's facts, so they are cached per user.
+    The agent gives the other (shared) classes only their PROFILE_DEPS fields and no facts, so their
+    answers can be shared by every user with the same values for those fields."""
+    return "*" in PROFILE_DEPS.get(cls, ("*",))
+
+def key_parts(goal: str, profile: Dict[str, str]) -> Tuple[str, str, Dict[str, str]]:
+    """(answer class, goal for the key, profile for the key)."""
+    if not CACHE_CANONICAL:
+        return "raw", goal, profile
+    cls = answer_class(goal)
+    return cls, canonical(goal, cls), relevant_profile(profile, cls)
@@ -0,0 +1,98 @@
+# infra/cassette.py
+# Record/replay of external calls (chat completions, embeddings, moderation, web search).
+#   CASSETTE_MODE=record  -> call through and append every exchange to CASSETTE_PATH (JSONL)
+#   CASSETTE_MODE=replay  -> serve exchanges from CASSETTE_PATH, no network
+# Exchanges are keyed by sha256(kind + canonical request JSON). Repeated identical requests
+# replay their recorded responses in order (the last one repeats).
+import os, json, time, hashlib, threading
+from typing import Any, Callable, Dict, List, Optional
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")                  # off | record | replay
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassettes/default.jsonl")
+# simulated latency on replay: "0" (none), a number of ms, or "recorded" (what the live call took)
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "0")
+
+if CASSETTE_MODE == "replay":
+    # clients refuse to construct without a key; replay never uses it
+    os.environ.setdefault("OPENAI_API_KEY", "cassette-replay")
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+def active() -> bool:
+    return CASSETTE_MODE in ("record", "replay")
+
+def to_plain(obj: Any) -> Any:
+    """pydantic models / numpy arrays / containers -> JSON-able values."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json", exclude_unset=False)
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if isinstance(obj, dict):
+        return {k: to_plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    return obj
+
+def request_key(kind: str, request: Dict[str, Any]) -> str:
+    payload = json.dumps({"kind": kind, "request": to_plain(request)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_lock = threading.Lock()
+_entries: Optional[Dict[str, List[Dict[str, Any]]]] = None
+_cursor: Dict[str, int] = {}
+
+def _load():
+    global _entries
+    if _entries is not None:
+        return
+    _entries = {}
+    if os.path.exists(CASSETTE_PATH):
+        with open(CASSETTE_PATH, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    e = json.loads(line)
+                    _entries.setdefault(e["key"], []).append(e)
+
+def _append(entry: Dict[str, Any]):
+    os.makedirs(os.path.dirname(CASSETTE_PATH) or ".", exist_ok=True)
+    with open(CASSETTE_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def _replay_delay(entry: Dict[str, Any]):
+    if CASSETTE_LATENCY == "recorded":
+        time.sleep(entry.get("latency_s", 0.0))
+    elif float(CASSETTE_LATENCY or 0) > 0:
+        time.sleep(float(CASSETTE_LATENCY) / 1000)
+
+
+def call(kind: str, request: Dict[str, Any], fn: Callable[[], Any],
+         decode: Callable[[Any], Any] = lambda x: x) -> Any:
+    """Run fn() (live), record it, or replay it, depending on CASSETTE_MODE.
+    `request` must hold everything that determines the response; `decode` rebuilds the
+    response object from its JSON form on replay."""
+    if not active():
+        return fn()
+    key = request_key(kind, request)
+    if CASSETTE_MODE == "replay":
+        with _lock:
+            _load()
+            hits = _entries.get(key)
+            if not hits:
+                raise CassetteMiss(f"no recorded {kind} exchange for key {key[:12]} in {CASSETTE_PATH}")
+            i = _cursor.get(key, 0)
+            _cursor[key] = i + 1
+            entry = hits[min(i, len(hits) - 1)]
+        _replay_delay(entry)
+        return decode(entry["response"])
+
+    t0 = time.perf_counter()
+    resp = fn()
+    dt = time.perf_counter() - t0
+    entry = {"key": key, "kind": kind, "latency_s": round(dt, 4), "response": to_plain(resp)}
+    with _lock:
+        _append(entry)
+    return resp
@@ -0,0 +1,110 @@
+# infra/codec.py
+# Versioned binary encoding for cached values (answers, tool results).
+#   byte 0: format version (1)
+#   byte 1: compression (0 none, 1 zlib, 2 zstd)
+#   rest:   UTF-8 JSON (orjson when installed, else json), compressed when >= CACHE_COMPRESS_MIN bytes
+# decode() also accepts the old format: a JSON str as stored in a TEXT column.
+import os, json, time, zlib, threading
+from typing import Any
+
+from infra import metrics
+
+try:
+    import orjson
+    _has_orjson = True
+except Exception:
+    _has_orjson = False
+
+try:
+    import zstandard
+    _has_zstd = True
+except Exception:
+    _has_zstd = False
+
+CACHE_COMPRESS = os.getenv("CACHE_COMPRESS", "auto")                # auto (zstd, else zlib) | zstd | zlib | none
+CACHE_COMPRESS_MIN = int(os.getenv("CACHE_COMPRESS_MIN", "1024"))   # bytes of JSON before compressing
+CACHE_ZLIB_LEVEL = int(os.getenv("CACHE_ZLIB_LEVEL", "1"))
+CACHE_ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+
+VERSION = 1
+RAW, ZLIB, ZSTD = 0, 1, 2
+_NAMES = {RAW: "none", ZLIB: "zlib", ZSTD: "zstd"}
+
+
+# zstd (de)compressor objects must not be used by two threads at once: one pair per thread
+_tls = threading.local()
+
+def _zc():
+    z = getattr(_tls, "zc", None)
+    if z is None:
+        z = _tls.zc = zstandard.ZstdCompressor(level=CACHE_ZSTD_LEVEL)
+    return z
+
+def _zd():
+    z = getattr(_tls, "zd", None)
+    if z is None:
+        z = _tls.zd = zstandard.ZstdDecompressor()
+    return z
+
+def _method() -> int:
+    if CACHE_COMPRESS == "none":
+        return RAW
+    if CACHE_COMPRESS in ("zstd", "auto") and _has_zstd:
+        return ZSTD
+    return ZLIB
+
+def _dumps(obj: Any) -> bytes:
+    if _has_orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:       # non-str keys, big ints...: plain json handles them
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _loads(b: bytes) -> Any:
+    return orjson.loads(b) if _has_orjson else json.loads(b)
+
+
+def encode(obj: Any) -> bytes:
+    t0 = time.perf_counter_ns()
+    raw = _dumps(obj)
+    method, body = RAW, raw
+    if len(raw) >= CACHE_COMPRESS_MIN and _method() != RAW:
+        m = _method()
+        packed = _zc().compress(raw) if m == ZSTD else zlib.compress(raw, CACHE_ZLIB_LEVEL)
+        if len(packed) < len(raw):
+            method, body = m, packed
+        # byte counts only for values over the threshold: small ones would just dilute the ratio
+        metrics.histogram("cache_compress_ratio", scale=0.01, codec=_NAMES[m]).record(len(raw) * 100 // len(body))
+        metrics.counter("cache_compressible_bytes_total", stage="raw").inc(len(raw))
+        metrics.counter("cache_compressible_bytes_total", stage="stored").inc(len(body))
+    out = bytes((VERSION, method)) + body
+    metrics.observe_ns("cache_encode_seconds", time.perf_counter_ns() - t0, codec=_NAMES[method])
+    return out
+
+def decode(v: Any) -> Any:
+    t0 = time.perf_counter_ns()
+    if isinstance(v, str):                       # pre-codec rows: TEXT json
+        obj, name = json.loads(v), "legacy"
+    else:
+        v = bytes(v)
+        if len(v) < 2 or v[0] != VERSION:
+            raise ValueError(f"unknown cache value format {v[:1]!r}")
+        method, body = v[1], v[2:]
+        if method == ZLIB:
+            body = zlib.decompress(body)
+        elif method == ZSTD:
+            if not _has_zstd:
+                raise ValueError("cache value is zstd-compressed but zstandard is not installed")
+            body = _zd().decompress(body)
+        elif method != RAW:
+            raise ValueError(f"unknown cache compression {method}")
+        obj, name = _loads(body), _NAMES[method]
+    metrics.observe_ns("cache_decode_seconds", time.perf_counter_ns() - t0, codec=name)
+    return obj
+
+def stats() -> dict:
+    """Compression over values >= CACHE_COMPRESS_MIN since start (or metrics.reset())."""
+    raw = metrics.counter("cache_compressible_bytes_total", stage="raw").value
+    stored = metrics.counter("cache_compressible_bytes_total", stage="stored").value
+    return {"raw_bytes": raw, "stored_bytes": stored, "ratio": round(raw / stored, 3) if stored else None}
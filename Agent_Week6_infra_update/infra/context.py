@@ -0,0 +1,58 @@
+# infra/context.py
+# Per-call request context: which user a request is for and its budgets. It lives in a contextvar,
+# so concurrent run_agent calls in one process (threads, asyncio tasks) each see their own, and
+# code below the agent (tools, memory, tracing, usage) reads it instead of a process-wide USER_ID.
+#   with context.use(user_id="alice", max_tokens=20000):
+#       ...                                   # context.current().user_id == "alice" in here
+# Outside any use() block the defaults apply: USER_ID from the environment, the global budgets.
+# New threads start from an empty context: wrap their target in contextvars.copy_context().run.
+import os, contextvars
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+DEFAULT_USER_ID = os.getenv("USER_ID", "default")
+
+
+class RequestContext:
+    __slots__ = ("user_id", "max_tokens", "max_cost", "daily_tokens", "daily_cost", "answer_class", "read_only")
+
+    def __init__(self, user_id: str = DEFAULT_USER_ID, max_tokens: Optional[int] = None,
+                 max_cost: Optional[float] = None, daily_tokens: Optional[int] = None,
+                 daily_cost: Optional[float] = None, answer_class: Optional[str] = None,
+                 read_only: bool = False):
+        self.user_id = user_id
+        self.answer_class = answer_class        # set while the agent works on an answer (infra/canon.py)
+        self.read_only = read_only              # memory-writing tools do nothing (replays: warm.py)
+        # None = the global REQUEST_* / USER_DAILY_* budgets (infra/usage.py); 0 = unlimited
+        self.max_tokens, self.max_cost = max_tokens, max_cost
+        self.daily_tokens, self.daily_cost = daily_tokens, daily_cost
+
+    def replace(self, **fields) -> "RequestContext":
+        return RequestContext(**{**{k: getattr(self, k) for k in self.__slots__}, **fields})
+
+    def __repr__(self):
+        return "RequestContext(" + ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__) + ")"
+
+
+_DEFAULT = RequestContext()
+_ctx: contextvars.ContextVar = contextvars.ContextVar("request_context", default=None)
+
+def current() -> RequestContext:
+    return _ctx.get() or _DEFAULT
+
+def active() -> Optional[RequestContext]:
+    """The context set by use(), or None outside of one."""
+    return _ctx.get()
+
+def user_id() -> str:
+    return current().user_id
+
+@contextmanager
+def use(**fields) -> Iterator[RequestContext]:
+    """Run the block with the current context updated by fields (None values are ignored)."""
+    ctx = current().replace(**{k: v for k, v in fields.items() if v is not None})
+    token = _ctx.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _ctx.reset(token)
@@ -0,0 +1,81 @@
+# infra/memprof.py
+# Per-scope memory instrumentation: RSS delta on every tracked scope (one /proc read each side),
+# plus tracemalloc peak and top allocation sites on a sampled subset (MEMPROF_SAMPLE).
+# tracemalloc is process-wide, so only one scope traces at a time; others fall back to RSS only.
+import os, random, threading, tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from infra import metrics
+from infra.tracing import log
+
+MEMPROF = os.getenv("MEMPROF", "1") == "1"                    # RSS deltas
+MEMPROF_SAMPLE = float(os.getenv("MEMPROF_SAMPLE", "0"))      # share of scopes traced with tracemalloc
+MEMPROF_TOP = int(os.getenv("MEMPROF_TOP", "5"))              # allocation sites reported
+MEMPROF_FRAMES = int(os.getenv("MEMPROF_FRAMES", "1"))
+
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_trace_lock = threading.Lock()
+_SELF = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+         tracemalloc.Filter(False, metrics.__file__)]
+
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except Exception:
+        pass
+    try:                                    # macOS / BSD: peak RSS only, still useful as a trend
+        import resource, sys
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r if sys.platform == "darwin" else r * 1024
+    except Exception:
+        return None
+
+
+@contextmanager
+def track_memory(scope: str, into: Optional[Dict[str, Any]] = None, trace: Optional[bool] = None):
+    """Measure memory over a block. Results go into `into` (e.g. a span's extra dict) or a mem.<scope> event.
+    trace=None samples tracemalloc at MEMPROF_SAMPLE; True/False forces it."""
+    if not MEMPROF:
+        yield {}
+        return
+    if trace is None:
+        trace = MEMPROF_SAMPLE > 0 and random.random() < MEMPROF_SAMPLE
+    # one traced scope at a time, and don't fight with someone else's tracemalloc session
+    tracing = bool(trace) and _trace_lock.acquire(blocking=False)
+    if tracing and tracemalloc.is_tracing():
+        _trace_lock.release()
+        tracing = False
+    out: Dict[str, Any] = {}
+    before = None
+    if tracing:
+        tracemalloc.start(MEMPROF_FRAMES)
+        before = tracemalloc.take_snapshot().filter_traces(_SELF)
+    rss0 = rss_bytes()
+    try:
+        yield out
+    finally:
+        rss1 = rss_bytes()
+        if rss0 is not None and rss1 is not None:
+            out["mem_rss_kb"] = rss1 // 1024
+            out["mem_rss_delta_kb"] = (rss1 - rss0) // 1024
+            metrics.gauge("process_rss_bytes").set(rss1)
+            metrics.histogram("mem_rss_delta_bytes", scope=scope).record(max(0, rss1 - rss0))
+        if tracing:
+            try:
+                _, peak = tracemalloc.get_traced_memory()
+                after = tracemalloc.take_snapshot().filter_traces(_SELF)
+                top = after.compare_to(before, "lineno")[:MEMPROF_TOP]
+                out["mem_peak_kb"] = peak // 1024
+                out["mem_top"] = [f"{s.traceback[0].filename.rsplit(os.sep, 1)[-1]}:{s.traceback[0].lineno} "
+                                  f"+{s.size_diff // 1024}KB/{s.count_diff}" for s in top if s.size_diff >= 1024]
+                metrics.histogram("mem_peak_bytes", scope=scope).record(peak)
+            finally:
+                tracemalloc.stop()
+                _trace_lock.release()
+        if into is not None:
+            into.update(out)
+        elif out:
+            log("mem." + scope, **out)
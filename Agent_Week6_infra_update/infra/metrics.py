@@ -0,0 +1,203 @@
+# infra/metrics.py
+# In-process metrics: counters, gauges and HDR-style latency histograms.
+# Metrics are keyed by name + a few low-cardinality labels. snapshot() is for the eval
+# harness and benchmarks; render_prometheus() is the Prometheus text format.
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Histogram buckets: exact below 2**SUB_BITS, then 2**SUB_BITS linear sub-buckets per power of
+# two (~3% relative error with SUB_BITS=5), like HdrHistogram. Memory is sparse: one dict entry
+# per bucket that has been hit.
+SUB_BITS = 5
+_SUB = 1 << SUB_BITS
+
+
+def _bucket(v: int) -> int:
+    if v < _SUB:
+        return v
+    e = v.bit_length() - SUB_BITS - 1
+    return ((e + 1) << SUB_BITS) | ((v >> e) & (_SUB - 1))
+
+def _bucket_range(idx: int) -> Tuple[int, int]:
+    if idx < _SUB:
+        return idx, idx + 1
+    e = (idx >> SUB_BITS) - 1
+    lo = (_SUB | (idx & (_SUB - 1))) << e
+    return lo, lo + (1 << e)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1):
+        with self._lock:
+            self.value += n
+
+    def export(self) -> Dict[str, Any]:
+        return {"value": self.value}
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, v: float):
+        self.value = v
+
+    def inc(self, n: float = 1):
+        with self._lock:
+            self.value += n
+
+    def export(self) -> Dict[str, Any]:
+        return {"value": self.value}
+
+
+class Histogram:
+    """Integer-valued histogram. `scale` converts recorded units to exported units (ns -> s)."""
+    kind = "histogram"
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = scale
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def record(self, v: int):
+        v = max(0, int(v))
+        b = _bucket(v)
+        with self._lock:
+            self.counts[b] = self.counts.get(b, 0) + 1
+            self.count += 1
+            self.sum += v
+            self.min = v if self.min is None or v < self.min else self.min
+            self.max = v if self.max is None or v > self.max else self.max
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for b in sorted(self.counts):
+                seen += self.counts[b]
+                if seen >= rank:
+                    lo, hi = _bucket_range(b)
+                    v = min(max((lo + hi - 1) / 2, self.min), self.max)
+                    return v * self.scale
+            return self.max * self.scale
+
+    def export(self) -> Dict[str, Any]:
+        s = self.scale
+        return {
+            "count": self.count,
+            "sum": self.sum * s,
+            "min": self.min * s if self.min is not None else None,
+            "max": self.max * s if self.max is not None else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+_metrics: Dict[Tuple[str, Labels], Any] = {}
+_lock = threading.Lock()
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)[:64]) for k, v in labels.items() if v is not None))
+
+def _get(cls, name: str, labels: Dict[str, Any], **kw):
+    key = (name, _labels(labels))
+    m = _metrics.get(key)
+    if m is None:
+        with _lock:
+            m = _metrics.get(key)
+            if m is None:
+                m = _metrics[key] = cls(**kw)
+    return m
+
+def counter(name: str, **labels) -> Counter:
+    return _get(Counter, name, labels)
+
+def gauge(name: str, **labels) -> Gauge:
+    return _get(Gauge, name, labels)
+
+def histogram(name: str, scale: float = 1.0, **labels) -> Histogram:
+    return _get(Histogram, name, labels, scale=scale)
+
+def observe_ns(name: str, ns: int, **labels):
+    """Record a duration measured with perf_counter_ns; exported in seconds."""
+    histogram(name, scale=1e-9, **labels).record(ns)
+
+
+def snapshot(prefix: str = "") -> Dict[str, List[Dict[str, Any]]]:
+    """{name: [{"labels": {...}, "type": ..., <values>}, ...]} for metrics whose name starts with prefix."""
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for (name, labels), m in sorted(_metrics.items(), key=lambda kv: kv[0]):
+        if name.startswith(prefix):
+            out.setdefault(name, []).append({"labels": dict(labels), "type": m.kind, **m.export()})
+    return out
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+
+def _fmt_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+def render_prometheus() -> str:
+    """Prometheus text exposition. Histograms are exported as summaries (quantiles + sum/count)."""
+    lines: List[str] = []
+    typed = set()
+    for (name, labels), m in sorted(_metrics.items(), key=lambda kv: kv[0]):
+        kind = "summary" if m.kind == "histogram" else m.kind
+        if name not in typed:
+            lines.append(f"# TYPE {name} {kind}")
+            typed.add(name)
+        if m.kind == "histogram":
+            e = m.export()
+            for q in ("0.5", "0.95", "0.99"):
+                v = m.quantile(float(q))
+                lines.append(f"{name}{_fmt_labels(labels, (('quantile', q),))} {v if v is not None else 'NaN'}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {e['sum']}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {e['count']}")
+        else:
+            lines.append(f"{name}{_fmt_labels(labels)} {m.value}")
+    return "\n".join(lines) + "\n"
+
+def serve(port: int):
+    """Expose /metrics on a background thread (for a Prometheus scrape)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _H(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer(("0.0.0.0", port), _H)
+    threading.Thread(target=srv.serve_forever, name="metrics-http", daemon=True).start()
+    return srv
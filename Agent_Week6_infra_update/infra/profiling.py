@@ -0,0 +1,89 @@
+# infra/profiling.py
+# On-demand per-request CPU profiling.
+#   run_agent(..., cpu_profile=True) -> profile this request
+#   PROFILE_SAMPLE=0.01             -> profile ~1% of requests
+# Default mode samples the request thread's stack every PROFILE_INTERVAL_S and writes
+# collapsed stacks (flamegraph.pl / speedscope input) to PROFILE_DIR/<request_id>.folded.
+# PROFILE_MODE=cprofile writes PROFILE_DIR/<request_id>.pstats instead.
+# When a request is not profiled this is a nullcontext: nothing runs.
+import os, sys, time, random, threading, cProfile
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+from infra.tracing import log
+
+PROFILE_SAMPLE = float(os.getenv("PROFILE_SAMPLE", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")          # sample | cprofile
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_S", "0.005"))
+
+
+def _frame_name(f) -> str:
+    co = f.f_code
+    return f"{os.path.basename(co.co_filename)}:{co.co_name}"
+
+class StackSampler:
+    """Samples one thread's stack from a background thread."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL_S):
+        self.thread_id, self.interval = thread_id, interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._t = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            f = sys._current_frames().get(self.thread_id)
+            names = []
+            while f is not None:
+                names.append(_frame_name(f))
+                f = f.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._t.start()
+
+    def stop(self):
+        self._stop.set()
+        self._t.join()
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as fh:
+            for stack, n in self.stacks.most_common():
+                fh.write(f"{stack} {n}\n")
+
+
+@contextmanager
+def _profile(request_id: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    t0 = time.perf_counter()
+    if PROFILE_MODE == "cprofile":
+        path = os.path.join(PROFILE_DIR, f"{request_id}.pstats")
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats(path)
+            log("profile.written", path=path, mode="cprofile", duration_s=round(time.perf_counter() - t0, 3))
+        return
+    path = os.path.join(PROFILE_DIR, f"{request_id}.folded")
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        sampler.write(path)
+        log("profile.written", path=path, mode="sample", samples=sum(sampler.stacks.values()),
+            duration_s=round(time.perf_counter() - t0, 3))
+
+
+def maybe_profile(request_id: str, enabled: Optional[bool] = None):
+    """Context manager: profile when enabled=True, or when enabled is None and the sampling rate hits."""
+    if enabled is None:
+        enabled = PROFILE_SAMPLE > 0 and random.random() < PROFILE_SAMPLE
+    return _profile(request_id) if enabled else nullcontext()
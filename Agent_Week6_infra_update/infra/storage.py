@@ -0,0 +1,231 @@
+# infra/storage.py
+# Shared SQLite access for infra.cache and memory.memory.
+# - one persistent connection per (thread, db file), opened lazily, reopened after fork,
+#   closed when the thread exits
+# - WAL journaling so readers don't block the writer, plus tuned pragmas
+# - statement reuse: sqlite3 caches prepared statements per connection by SQL text,
+#   so callers keep their SQL constant and pass values as parameters
+# - group commit (SQLITE_GROUP_COMMIT): writes go to one writer thread per db, which commits whatever
+#   has queued up in a single transaction; each caller returns once its write is committed
+#   (write_async: returns right away with a Future; close_all drains the queue at exit)
+import os, queue, atexit, sqlite3, threading, weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from infra import metrics
+
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")     # NORMAL is durable across app crashes in WAL
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))          # page cache per connection
+SQLITE_BUSY_MS = int(os.getenv("SQLITE_BUSY_MS", "5000"))
+SQLITE_STMT_CACHE = int(os.getenv("SQLITE_STMT_CACHE", "256"))     # prepared statements kept per connection
+# group commit pays off when every commit fsyncs (synchronous=FULL/EXTRA); under WAL+NORMAL commits
+# are cheap and the hand-off to the writer thread costs more than it saves. auto | 1 | 0
+_gc = os.getenv("SQLITE_GROUP_COMMIT", "auto")
+SQLITE_GROUP_COMMIT = _gc == "1" or (_gc == "auto" and SQLITE_SYNCHRONOUS.upper() in ("FULL", "EXTRA"))
+SQLITE_GROUP_MAX = int(os.getenv("SQLITE_GROUP_MAX", "512"))        # writes per transaction
+SQLITE_GROUP_WAIT_MS = float(os.getenv("SQLITE_GROUP_WAIT_MS", "0"))  # linger for more writes (0: none)
+
+_local = threading.local()
+_lock = threading.Lock()
+_all: List[sqlite3.Connection] = []                        # writer and watch connections (live until exit)
+_threads: "weakref.WeakSet[_Conns]" = weakref.WeakSet()    # per-thread connection sets
+_writers: Dict[str, "_Writer"] = {}
+_watch: Dict[Tuple[int, str], sqlite3.Connection] = {}     # data_version() connections
+_watch_lock = threading.Lock()
+
+
+def _open(path: str, keep: bool = False) -> sqlite3.Connection:
+    c = sqlite3.connect(path, timeout=SQLITE_BUSY_MS / 1000, isolation_level=None,
+                        check_same_thread=False, cached_statements=SQLITE_STMT_CACHE)
+    if SQLITE_WAL:
+        c.execute("PRAGMA journal_mode=WAL")
+    c.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    c.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+    c.execute(f"PRAGMA cache_size={-SQLITE_CACHE_MB * 1024}")
+    c.execute("PRAGMA temp_store=MEMORY")
+    if keep:
+        with _lock:
+            _all.append(c)
+    metrics.counter("sqlite_connections_opened_total", db=os.path.basename(path)).inc()
+    return c
+
+def _close(by_path: Dict[str, sqlite3.Connection], pid: int):
+    if os.getpid() != pid:
+        return                  # inherited across fork: the parent still uses them
+    for c in by_path.values():
+        try:
+            c.close()
+        except Exception:
+            pass
+    metrics.counter("sqlite_connections_closed_total").inc(len(by_path))
+    by_path.clear()
+
+class _Conns:
+    """One thread's connections by path. The thread's threading.local is dropped when it exits,
+    and the finalizer closes the connections with it (or at exit: close_all)."""
+
+    def __init__(self):
+        self.by_path: Dict[str, sqlite3.Connection] = {}
+        self.close = weakref.finalize(self, _close, self.by_path, os.getpid())
+        with _lock:
+            _threads.add(self)
+
+def conn(path: str) -> sqlite3.Connection:
+    """This thread's connection to `path` (autocommit; use transaction() for multi-statement writes)."""
+    pid = os.getpid()
+    conns = getattr(_local, "conns", None)
+    if conns is None or getattr(_local, "pid", None) != pid:
+        conns = _local.conns = _Conns()
+        _local.pid = pid
+    c = conns.by_path.get(path)
+    if c is None:
+        c = conns.by_path[path] = _open(path)
+    return c
+
+
+@contextmanager
+def transaction(path: str):
+    """BEGIN IMMEDIATE ... COMMIT on this thread's connection (ROLLBACK on error)."""
+    c = conn(path)
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        yield c
+    except BaseException:
+        c.execute("ROLLBACK")
+        raise
+    c.execute("COMMIT")
+
+def data_version(path: str) -> int:
+    """PRAGMA data_version on a per-process watch connection: changes whenever any other
+    connection (another thread's, the group-commit writer's, another process's) commits to `path`.
+    Answered from the WAL index; no pages are read."""
+    key = (os.getpid(), path)
+    with _lock:
+        c = _watch.get(key)
+    if c is None:
+        c = _open(path, keep=True)
+        with _lock:
+            c = _watch.setdefault(key, c)
+    with _watch_lock:
+        return c.execute("PRAGMA data_version").fetchone()[0]
+
+def script(path: str, sql: str):
+    """Schema setup: run a multi-statement script."""
+    conn(path).executescript(sql)
+
+def query(path: str, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+    return conn(path).execute(sql, params).fetchall()
+
+def query_one(path: str, sql: str, params: Sequence[Any] = ()) -> Optional[Tuple]:
+    return conn(path).execute(sql, params).fetchone()
+
+
+class _Writer:
+    """Single writer thread per db file; batches queued writes into one transaction."""
+
+    def __init__(self, path: str):
+        self.path, self.pid = path, os.getpid()
+        self.q: "queue.Queue[Optional[Tuple[str, Sequence[Any], Future]]]" = queue.Queue()
+        self.t = threading.Thread(target=self._run, name=f"sqlite-writer:{os.path.basename(path)}", daemon=True)
+        self.t.start()
+
+    def submit(self, sql: str, params: Sequence[Any]) -> Future:
+        f: Future = Future()
+        self.q.put((sql, params, f))
+        return f
+
+    def _take(self) -> List[Tuple[str, Sequence[Any], Future]]:
+        item = self.q.get()
+        if item is None:
+            return []
+        batch = [item]
+        timeout = SQLITE_GROUP_WAIT_MS / 1000
+        while len(batch) < SQLITE_GROUP_MAX:
+            try:
+                item = self.q.get(timeout=timeout) if timeout else self.q.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.q.put(None)        # finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        c = _open(self.path, keep=True)
+        db = os.path.basename(self.path)
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            metrics.histogram("sqlite_group_commit_size", db=db).record(len(batch))
+            try:
+                c.execute("BEGIN IMMEDIATE")
+                rows = [c.execute(sql, params).rowcount for sql, params, _ in batch]
+                c.execute("COMMIT")
+            except Exception:
+                if c.in_transaction:
+                    c.execute("ROLLBACK")
+                # one bad statement must not fail its neighbours: replay one by one
+                for sql, params, f in batch:
+                    try:
+                        f.set_result(c.execute(sql, params).rowcount)
+                    except Exception as e:
+                        f.set_exception(e)
+                continue
+            for (_, _, f), n in zip(batch, rows):
+                f.set_result(n)
+
+    def close(self):
+        self.q.put(None)
+        self.t.join(timeout=10)
+
+
+def _writer(path: str) -> _Writer:
+    w = _writers.get(path)
+    if w is None or w.pid != os.getpid():
+        with _lock:
+            w = _writers.get(path)
+            if w is None or w.pid != os.getpid():
+                w = _writers[path] = _Writer(path)
+    return w
+
+def write(path: str, sql: str, params: Sequence[Any] = ()) -> int:
+    """One write statement; returns its rowcount once committed (group-committed when enabled)."""
+    if not SQLITE_GROUP_COMMIT:
+        return conn(path).execute(sql, params).rowcount
+    return _writer(path).submit(sql, params).result()
+
+def write_async(path: str, sql: str, params: Sequence[Any] = ()) -> Future:
+    """Queue a write on the db's writer thread and return at once; the Future resolves to the
+    rowcount once committed. Writes to one db commit in submission order."""
+    return _writer(path).submit(sql, params)
+
+def write_many(path: str, sql: str, seq: Iterable[Sequence[Any]]):
+    """Bulk load in one transaction on the calling thread."""
+    with transaction(path) as c:
+        c.executemany(sql, seq)
+
+
+@atexit.register
+def close_all():
+    """Drain the writers and close every connection (runs at exit)."""
+    for w in list(_writers.values()):
+        w.close()
+    _writers.clear()
+    with _lock:
+        threads = list(_threads)
+    for t in threads:
+        t.close()
+    with _lock:
+        for c in _all:
+            try:
+                c.close()
+            except Exception:
+                pass
+        _all.clear()
+        _watch.clear()
+    _local.__dict__.clear()
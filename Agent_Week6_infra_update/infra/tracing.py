@@ -1,24 +1,215 @@
 # infra/tracing.py
-import time, uuid, json, sys
+# JSONL trace events. log() only appends a record to a bounded ring buffer; a background
+# thread serializes and writes batches to the configured sink (stdout or rotating files).
+# The request id travels in a contextvar, so callers don't pass it around by hand; events logged
+# inside a request context (infra/context.py) also carry its user_id.
+import os, time, uuid, json, sys, random, threading, atexit, contextvars
+from collections import deque
 from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
 
-def new_request_id() -> str:
-    return uuid.uuid4().hex[:12]
+from infra import metrics, context
+
+TRACE_SINK = os.getenv("TRACE_SINK", "stdout")                     # stdout | file | none
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/trace.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "10000"))             # ring buffer size (events)
+TRACE_FLUSH_S = float(os.getenv("TRACE_FLUSH_S", "0.5"))
+TRACE_ASYNC = os.getenv("TRACE_ASYNC", "1") == "1"                 # 0: write inline (scripts, debugging)
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "1.0"))             # head sampling: share of requests kept
+TRACE_SLOW_S = float(os.getenv("TRACE_SLOW_S", "2.0"))             # tail sampling: keep spans slower than this
+TRACE_TAIL_MAX = int(os.getenv("TRACE_TAIL_MAX", "256"))           # events held per unsampled request
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+# None: sampled. list: unsampled request, events held back in case a tail rule keeps them.
+_held: contextvars.ContextVar = contextvars.ContextVar("trace_held", default=None)
+
+
+# --- sinks ---
+class StdoutSink:
+    def write(self, lines: List[str]):
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
+
+class RotatingFileSink:
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        self.path, self.max_bytes, self.backups = path, max_bytes, backups
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._f = open(path, "a", encoding="utf-8")
+
+    def write(self, lines: List[str]):
+        data = "".join(lines)
+        if self._f.tell() + len(data) > self.max_bytes and self._f.tell():
+            self._rotate()
+        self._f.write(data)
+        self._f.flush()
+
+    def _rotate(self):
+        self._f.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i+1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self._f = open(self.path, "w", encoding="utf-8")
+
+class NullSink:
+    def write(self, lines: List[str]):
+        pass
+
+def _default_sink():
+    if TRACE_SINK == "file":
+        return RotatingFileSink()
+    if TRACE_SINK == "none":
+        return NullSink()
+    return StdoutSink()
+
+_sink = _default_sink()
+_buf: deque = deque(maxlen=TRACE_BUFFER)
+_lock = threading.Lock()
+_write_lock = threading.Lock()          # one writer at a time (flusher, atexit, set_sink)
+_wake = threading.Event()
+_stats = {"dropped": 0, "sampled_out": 0, "written": 0}
+_flusher: Optional[threading.Thread] = None
+
+def set_sink(sink):
+    """Swap the sink (anything with write(lines)). Pending events are flushed to the old one first."""
+    global _sink
+    flush()
+    _sink = sink
+
+
+# --- request context ---
+@contextmanager
+def request_scope():
+    """Yields the request id: a new one plus the head-sampling decision, or the enclosing request's
+    when already inside one (run_agent_safe -> run_agent). Both are reset on exit, so events logged
+    between requests aren't tagged with (or held for) the previous one."""
+    rid = _request_id.get()
+    if rid:
+        yield rid
+        return
+    rid = uuid.uuid4().hex[:12]
+    rid_token = _request_id.set(rid)
+    held_token = _held.set(None if random.random() < TRACE_SAMPLE else [])
+    try:
+        yield rid
+    finally:
+        held = _held.get()
+        if held:
+            _stats["sampled_out"] += len(held)
+        _held.reset(held_token)
+        _request_id.reset(rid_token)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+# --- write path ---
+def _serialize(rec: Dict[str, Any]) -> str:
+    # lazy fields: callables are evaluated here, on the flusher thread
+    rec = {k: (v() if callable(v) else v) for k, v in rec.items()}
+    return json.dumps(rec, ensure_ascii=False, default=str) + "\n"
+
+def _enqueue(rec: Dict[str, Any]):
+    if not TRACE_ASYNC:
+        with _write_lock:
+            _sink.write([_serialize(rec)])
+            _stats["written"] += 1
+        return
+    with _lock:
+        if len(_buf) == _buf.maxlen:
+            _stats["dropped"] += 1               # ring buffer: oldest event is overwritten
+        _buf.append(rec)
+    _ensure_flusher()
+    if len(_buf) >= TRACE_BUFFER // 2:
+        _wake.set()
 
 def log(event: str, **fields):
-    rec = {"event": event, **fields}
-    sys.stdout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    rec = {"event": event, "ts": time.time(), **fields}
+    if "request_id" not in rec:
+        rid = _request_id.get()
+        if rid:
+            rec["request_id"] = rid
+    if "user_id" not in rec:
+        ctx = context.active()
+        if ctx:
+            rec["user_id"] = ctx.user_id
+    held = _held.get()
+    if held is not None:
+        if len(held) < TRACE_TAIL_MAX:
+            held.append(rec)
+        else:
+            _stats["sampled_out"] += 1
+        return
+    _enqueue(rec)
+
+def _keep_tail(reason: str):
+    """An unsampled request hit a tail rule: release what was held and keep the rest."""
+    held = _held.get()
+    if held is None:
+        return
+    _held.set(None)
+    for rec in held:
+        rec["tail"] = reason
+        _enqueue(rec)
+
+def flush():
+    with _write_lock:
+        with _lock:
+            recs = list(_buf)
+            _buf.clear()
+        if recs:
+            _sink.write([_serialize(r) for r in recs])
+            _stats["written"] += len(recs)
+
+def _run_flusher():
+    while True:
+        _wake.wait(TRACE_FLUSH_S)
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:            # never let tracing kill the process
+            sys.stderr.write(f"tracing flush failed: {e}\n")
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_run_flusher, name="trace-flusher", daemon=True)
+                _flusher.start()
+
+def stats() -> Dict[str, int]:
+    return {**_stats, "buffered": len(_buf)}
+
+atexit.register(flush)
+
+
+# span fields that become metric labels (keep these low-cardinality)
+SPAN_LABELS = ("tool", "model", "tier")
 
 @contextmanager
 def span(event: str, **fields):
-    t0 = time.time()
-    rid = fields.get("request_id")
+    """Yields a dict; anything put in it (token counts, sizes...) is added to the .end/.error event."""
+    t0 = time.perf_counter_ns()
+    labels = {k: fields[k] for k in SPAN_LABELS if k in fields}
+    extra: Dict[str, Any] = {}
     log(event + ".start", **fields)
     try:
-        yield
-        dt = round(time.time() - t0, 3)
-        log(event + ".end", duration_s=dt, **({k:v for k,v in fields.items() if k!="request_id"}), request_id=rid)
+        yield extra
+        ns = time.perf_counter_ns() - t0
+        metrics.observe_ns("span_duration_seconds", ns, span=event, **labels)
+        dt = round(ns / 1e9, 6)
+        if dt >= TRACE_SLOW_S:
+            _keep_tail("slow")
+        log(event + ".end", duration_s=dt, **fields, **extra)
     except Exception as e:
-        dt = round(time.time() - t0, 3)
-        log(event + ".error", duration_s=dt, error=str(e), **fields)
+        ns = time.perf_counter_ns() - t0
+        metrics.observe_ns("span_duration_seconds", ns, span=event, **labels)
+        metrics.counter("span_errors_total", span=event, **labels).inc()
+        dt = round(ns / 1e9, 6)
+        _keep_tail("error")
+        log(event + ".error", duration_s=dt, error=str(e), **fields, **extra)
         raise
@@ -0,0 +1,88 @@
+# infra/usage.py
+# Token / cost accounting per LLM round and per request, plus budget checks.
+import os, json
+from typing import Any, Dict, Optional
+
+from infra import metrics, context
+
+# USD per 1M tokens: (input, cached input, output). Override/extend with MODEL_PRICES='{"model": [in, cached, out]}'.
+PRICES: Dict[str, tuple] = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+PRICES.update({k: tuple(v) for k, v in json.loads(os.getenv("MODEL_PRICES", "{}")).items()})
+
+# 0 = unlimited
+REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", "120000"))
+REQUEST_COST_BUDGET = float(os.getenv("REQUEST_COST_BUDGET", "0"))
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "0"))
+USER_DAILY_COST_BUDGET = float(os.getenv("USER_DAILY_COST_BUDGET", "0"))
+
+
+def estimate_cost(model: str, prompt: int, cached: int, completion: int) -> float:
+    # dated snapshots ("gpt-4.1-2025-04-14") price like their base model
+    p = PRICES.get(model) or next((v for k, v in sorted(PRICES.items(), key=lambda kv: -len(kv[0]))
+                                   if model.startswith(k)), None)
+    if not p:
+        return 0.0
+    return ((prompt - cached) * p[0] + cached * p[1] + completion * p[2]) / 1e6
+
+
+class RequestUsage:
+    """Accumulates usage over the rounds of one run_agent call."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.rounds = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, usage: Any) -> Dict[str, Any]:
+        """Fold one response's `usage` in; returns this round's numbers (for the llm.call span)."""
+        self.rounds += 1
+        if usage is None:
+            return {"round": self.rounds}
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        cost = estimate_cost(self.model, prompt, cached, completion)
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.cached_tokens += cached
+        self.cost += cost
+        metrics.counter("llm_tokens_total", model=self.model, kind="prompt").inc(prompt)
+        metrics.counter("llm_tokens_total", model=self.model, kind="cached").inc(cached)
+        metrics.counter("llm_tokens_total", model=self.model, kind="completion").inc(completion)
+        metrics.counter("llm_cost_usd_total", model=self.model).inc(cost)
+        return {"round": self.rounds, "prompt_tokens": prompt, "cached_tokens": cached,
+                "completion_tokens": completion, "cost_usd": round(cost, 6)}
+
+    def over(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None) -> bool:
+        ctx = context.current()
+        max_tokens = next(x for x in (max_tokens, ctx.max_tokens, REQUEST_TOKEN_BUDGET) if x is not None)
+        max_cost = next(x for x in (max_cost, ctx.max_cost, REQUEST_COST_BUDGET) if x is not None)
+        return bool((max_tokens and self.total_tokens >= max_tokens) or (max_cost and self.cost >= max_cost))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"rounds": self.rounds, "prompt_tokens": self.prompt_tokens, "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens, "cost_usd": round(self.cost, 6)}
+
+
+def user_over_budget(totals: Dict[str, Any], pending: Optional[RequestUsage] = None) -> bool:
+    """totals: today's {"tokens", "cost_usd"} for the user; pending: the in-flight request, not yet recorded."""
+    tokens = (totals.get("tokens") or 0) + (pending.total_tokens if pending else 0)
+    cost = (totals.get("cost_usd") or 0.0) + (pending.cost if pending else 0.0)
+    ctx = context.current()
+    max_tokens = USER_DAILY_TOKEN_BUDGET if ctx.daily_tokens is None else ctx.daily_tokens
+    max_cost = USER_DAILY_COST_BUDGET if ctx.daily_cost is None else ctx.daily_cost
+    return bool((max_tokens and tokens >= max_tokens) or (max_cost and cost >= max_cost))
@@ -1,32 +1,310 @@
-import os, sqlite3
-from typing import Dict, List, Tuple
+import os, re, time, hashlib, threading, unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from infra import storage, metrics
 
 DB_PATH = os.getenv("MEMORY_DB", "memory.db")
+MEMORY_MAX_FACTS = int(os.getenv("MEMORY_MAX_FACTS", "1000"))          # per user, oldest dropped; 0 = no cap
+MEMORY_FACT_TTL_DAYS = float(os.getenv("MEMORY_FACT_TTL_DAYS", "0"))   # facts older than this are ignored/pruned; 0 = keep
+MEMORY_READ_CACHE = os.getenv("MEMORY_READ_CACHE", "1") == "1"        # in-process profile/facts cache
+MEMORY_CACHE_MAX = int(os.getenv("MEMORY_CACHE_MAX", "50000"))          # cached reads kept (LRU)
+MEMORY_CACHE_MAX_AGE_S = float(os.getenv("MEMORY_CACHE_MAX_AGE_S", "300"))  # reload anyway after this (fact TTLs)
+# how long a PRAGMA data_version result is reused: bounds how late another process's write is seen
+# (this process's own writes invalidate immediately); 0 = check on every read
+MEMORY_VERSION_CHECK_MS = float(os.getenv("MEMORY_VERSION_CHECK_MS", "100"))
+# profile/fact writes are queued to the db's writer thread and acknowledged at once; reads of a
+# user with queued writes wait for them first (read-your-writes); close_all drains at exit
+MEMORY_WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "1") == "1"
+MEMORY_WRITE_QUEUE_MAX = int(os.getenv("MEMORY_WRITE_QUEUE_MAX", "10000"))  # past this, writers wait (backpressure)
+
+# schema changes after the base tables, applied in order; PRAGMA user_version = how many have run
+MIGRATIONS: List[List[str]] = [
+    # 1: content hash for dedupe (existing duplicates keep their newest copy) and a covering
+    #    index so recent-facts reads are an index range scan instead of a full scan + sort
+    ["ALTER TABLE facts ADD COLUMN h TEXT",
+     "UPDATE facts SET h=fact_hash(fact)",
+     "DELETE FROM facts WHERE rowid NOT IN (SELECT max(rowid) FROM facts GROUP BY user_id, h)",
+     "CREATE UNIQUE INDEX IF NOT EXISTS facts_user_h ON facts(user_id, h)",
+     "CREATE INDEX IF NOT EXISTS facts_user_ts ON facts(user_id, ts, fact)"],
+    # 2: fact embeddings for semantic recall (memory/recall.py); NULL until embedded
+    ["ALTER TABLE facts ADD COLUMN emb BLOB"],
+    # 3: per-user version row, bumped by triggers on every profile/fact change from any writer;
+    #    the in-process read cache compares against it (storing an embedding is not a change)
+    ["CREATE TABLE IF NOT EXISTS user_versions(user_id TEXT PRIMARY KEY, v INTEGER NOT NULL) WITHOUT ROWID",
+     *[f"""CREATE TRIGGER IF NOT EXISTS {t}_{op[0]} AFTER {op[1]} ON {t} BEGIN
+           INSERT INTO user_versions(user_id,v) VALUES({op[2]}.user_id,1)
+           ON CONFLICT(user_id) DO UPDATE SET v=v+1; END"""
+       for t in ("profiles", "facts")
+       for op in (("ai", "INSERT", "new"), ("ad", "DELETE", "old"),
+                  ("au", "UPDATE OF user_id,k,v" if t == "profiles" else "UPDATE OF user_id,fact,ts", "new"))]],
+    # 4: rolling summary of each user's older facts (memory/summary.py); facts with ts <= upto_ts
+    #    are folded into it. Changes bump the user's version like profile/fact writes
+    ["""CREATE TABLE IF NOT EXISTS summaries(user_id TEXT PRIMARY KEY, summary TEXT NOT NULL,
+        upto_ts TEXT NOT NULL, n_facts INTEGER NOT NULL, updated_at TEXT NOT NULL)""",
+     *[f"""CREATE TRIGGER IF NOT EXISTS summaries_{op} AFTER {ev} ON summaries BEGIN
+           INSERT INTO user_versions(user_id,v) VALUES(new.user_id,1)
+           ON CONFLICT(user_id) DO UPDATE SET v=v+1; END"""
+       for op, ev in (("ai", "INSERT"), ("au", "UPDATE"))]],
+]
+
+_WS = re.compile(r"\s+")
 
-def _conn():
-    return sqlite3.connect(DB_PATH)
+def fact_hash(fact: str) -> str:
+    """Same fact modulo case, spacing and trailing punctuation -> same hash."""
+    t = _WS.sub(" ", unicodedata.normalize("NFKC", fact or "")).strip().rstrip(".!").casefold()
+    return hashlib.blake2b(t.encode("utf-8"), digest_size=12).hexdigest()
 
 def init_db():
-    with _conn() as c:
-        c.execute("""CREATE TABLE IF NOT EXISTS profiles(
-            user_id TEXT, k TEXT, v TEXT, PRIMARY KEY(user_id,k))""")
-        c.execute("""CREATE TABLE IF NOT EXISTS facts(
-            user_id TEXT, fact TEXT, ts DATETIME DEFAULT CURRENT_TIMESTAMP)""")
+    storage.script(DB_PATH, """
+        CREATE TABLE IF NOT EXISTS profiles(
+            user_id TEXT, k TEXT, v TEXT, PRIMARY KEY(user_id,k));
+        CREATE TABLE IF NOT EXISTS facts(
+            user_id TEXT, fact TEXT, ts DATETIME DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE IF NOT EXISTS usage(
+            user_id TEXT, day TEXT, requests INTEGER, prompt_tokens INTEGER, cached_tokens INTEGER,
+            completion_tokens INTEGER, cost_usd REAL, PRIMARY KEY(user_id,day));""")
+    migrate()
+
+def migrate() -> int:
+    """Run pending MIGRATIONS, each in its own transaction; returns the schema version."""
+    storage.conn(DB_PATH).create_function("fact_hash", 1, fact_hash, deterministic=True)
+    while True:
+        with storage.transaction(DB_PATH) as c:
+            v = c.execute("PRAGMA user_version").fetchone()[0]     # re-read under the write lock
+            if v >= len(MIGRATIONS):
+                return v
+            for sql in MIGRATIONS[v]:
+                c.execute(sql)
+            c.execute(f"PRAGMA user_version={v + 1}")
+
+# --- read-through cache ---
+# Profile and fact reads are served from process memory. An entry is valid while the user's
+# version row is unchanged; the version row is only re-read after PRAGMA data_version says some
+# other connection has committed, and data_version itself at most every MEMORY_VERSION_CHECK_MS,
+# so a hit touches no database at all.
+_cache: "OrderedDict[Tuple, Tuple[int, float, Any]]" = OrderedDict()   # key -> (version, loaded_at, value)
+_versions: Dict[str, Tuple[int, int]] = {}                             # user_id -> (data_version, version)
+_dv = [0, float("-inf")]                                               # last data_version, read at
+_cache_lock = threading.Lock()
+
+def _data_version() -> int:
+    now = time.monotonic()
+    if now - _dv[1] >= MEMORY_VERSION_CHECK_MS / 1000:
+        _dv[:] = [storage.data_version(DB_PATH), now]
+    return _dv[0]
+
+def user_version(user_id: str) -> int:
+    """Bumped on every change to the user's profile or facts, by any process."""
+    if _pending:
+        settle(user_id)
+    dv = _data_version()                    # read first: a commit after this is caught next time
+    e = _versions.get(user_id)
+    if e and e[0] == dv:
+        return e[1]
+    row = storage.query_one(DB_PATH, "SELECT v FROM user_versions WHERE user_id=?", (user_id,))
+    v = row[0] if row else 0
+    if len(_versions) > MEMORY_CACHE_MAX:
+        _versions.clear()
+    _versions[user_id] = (dv, v)
+    return v
+
+def cached(key: Tuple, user_id: str, load: Callable[[], Any]) -> Any:
+    """load() once per user_version; key must start with a kind and include user_id."""
+    if _pending:
+        settle(user_id)
+    if not MEMORY_READ_CACHE:
+        return load()
+    v = user_version(user_id)
+    now = time.monotonic()
+    with _cache_lock:
+        e = _cache.get(key)
+        if e and e[0] == v and now - e[1] < MEMORY_CACHE_MAX_AGE_S:
+            _cache.move_to_end(key)
+            return e[2]
+    val = load()                            # a write racing this load bumps v: reloaded next time
+    with _cache_lock:
+        _cache[key] = (v, now, val)
+        _cache.move_to_end(key)
+        while len(_cache) > MEMORY_CACHE_MAX:
+            _cache.popitem(last=False)
+    return val
+
+def _invalidate(user_id: str):
+    # our own writes: don't wait for the data_version round trip
+    _versions.pop(user_id, None)
+
+
+# --- write-behind ---
+_pending: Dict[str, List[Future]] = {}      # user_id -> queued, not yet committed writes
+_queued = [0]
+_pending_lock = threading.Lock()
+
+def _write(user_id: str, sql: str, params: Tuple):
+    if not MEMORY_WRITE_BEHIND:
+        storage.write(DB_PATH, sql, params)
+        _invalidate(user_id)
+        return
+    f = storage.write_async(DB_PATH, sql, params)
+    with _pending_lock:
+        _pending.setdefault(user_id, []).append(f)
+        _queued[0] += 1
+        full = _queued[0] > MEMORY_WRITE_QUEUE_MAX
+    f.add_done_callback(lambda f: _committed(user_id, f))
+    if full:
+        f.exception()
+
+def _committed(user_id: str, f: Future):
+    _invalidate(user_id)
+    with _pending_lock:
+        _queued[0] -= 1
+        fs = _pending.get(user_id, [])
+        if f in fs:
+            fs.remove(f)
+        if not fs:
+            _pending.pop(user_id, None)
+    if f.exception() is not None:
+        from infra.tracing import log
+        metrics.counter("memory_write_errors_total").inc()
+        log("memory.write_error", user_id=user_id, error=str(f.exception()))
+
+def settle(user_id: Optional[str] = None):
+    """Wait until the queued writes of user_id (default: everyone) are committed."""
+    with _pending_lock:
+        fs = list(_pending.get(user_id, ())) if user_id else [f for v in _pending.values() for f in v]
+    for f in fs:
+        f.exception()                       # waits; failures are logged by _committed
+    if fs and user_id:
+        _invalidate(user_id)                # waiters can wake before the done-callback has run
+
 
 def set_profile_kv(user_id: str, k: str, v: str):
-    with _conn() as c:
-        c.execute("INSERT OR REPLACE INTO profiles(user_id,k,v) VALUES(?,?,?)",(user_id,k,str(v)))
+    _write(user_id, "INSERT OR REPLACE INTO profiles(user_id,k,v) VALUES(?,?,?)", (user_id, k, str(v)))
 
-def get_profile_dict(user_id: str) -> Dict[str,str]:
-    with _conn() as c:
-        rows = c.execute("SELECT k,v FROM profiles WHERE user_id=?",(user_id,)).fetchall()
+def _load_profile(user_id: str) -> Dict[str, str]:
+    rows = storage.query(DB_PATH, "SELECT k,v FROM profiles WHERE user_id=?",(user_id,))
     return {k:v for k,v in rows}
 
-def add_fact(user_id: str, fact: str):
-    with _conn() as c:
-        c.execute("INSERT INTO facts(user_id,fact) VALUES(?,?)",(user_id,fact))
+def get_profile_dict(user_id: str) -> Dict[str,str]:
+    return dict(cached(("profile", user_id), user_id, lambda: _load_profile(user_id)))
 
-def get_recent_facts(user_id: str, n: int=5) -> List[str]:
-    with _conn() as c:
-        rows = c.execute("SELECT fact FROM facts WHERE user_id=? ORDER BY ts DESC LIMIT ?",(user_id,n)).fetchall()
+_last_ts = [""]
+_ts_lock = threading.Lock()
+
+def _fact_ts() -> str:
+    """UTC with µs (sorts after second-resolution rows of the same second), strictly increasing in
+    this process: facts queued together still order by when they were added, not by commit."""
+    t = time.time()
+    with _ts_lock:
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)) + f".{int(t % 1 * 1e6):06d}"
+        if ts <= _last_ts[0]:
+            p = _last_ts[0]
+            ts = p[:-6] + f"{int(p[-6:]) + 1:06d}" if p[-6:] != "999999" else p + "1"
+        _last_ts[0] = ts
+    return ts
+
+def add_fact(user_id: str, fact: str, emb: Optional[bytes] = None):
+    """emb: the fact's embedding (float32 bytes), if the caller has one; see memory/recall.py."""
+    # a repeated fact is not stored twice, it just becomes recent again
+    _write(user_id, """INSERT INTO facts(user_id,fact,h,ts,emb) VALUES(?,?,?,?,?)
+        ON CONFLICT(user_id,h) DO UPDATE SET fact=excluded.fact, ts=excluded.ts, emb=coalesce(excluded.emb, emb)""",
+        (user_id, fact, fact_hash(fact), _fact_ts(), emb))
+    if MEMORY_MAX_FACTS:
+        # walks at most MEMORY_MAX_FACTS index entries; deletes only when the user is over the cap
+        _write(user_id, """DELETE FROM facts WHERE rowid IN (SELECT rowid FROM facts WHERE user_id=?
+            ORDER BY ts DESC LIMIT -1 OFFSET ?)""", (user_id, MEMORY_MAX_FACTS))
+
+def _ttl_clause() -> Tuple[str, Tuple]:
+    if not MEMORY_FACT_TTL_DAYS:
+        return "", ()
+    return " AND ts >= datetime('now', ?)", (f"-{MEMORY_FACT_TTL_DAYS} days",)
+
+def _load_recent_facts(user_id: str, n: int) -> List[str]:
+    ttl_sql, ttl_args = _ttl_clause()
+    rows = storage.query(DB_PATH, f"""SELECT fact FROM facts WHERE user_id=?{ttl_sql}
+        ORDER BY ts DESC LIMIT ?""", (user_id, *ttl_args, n))
     return [r[0] for r in rows]
+
+def get_recent_facts(user_id: str, n: int=5) -> List[str]:
+    return list(cached(("facts", user_id, n), user_id, lambda: _load_recent_facts(user_id, n)))
+
+def get_fact_rows(user_id: str) -> List[Tuple[str, str, Optional[bytes]]]:
+    """All of a user's live facts as (h, fact, emb), newest first."""
+    settle(user_id)
+    ttl_sql, ttl_args = _ttl_clause()
+    return storage.query(DB_PATH, f"""SELECT h, fact, emb FROM facts WHERE user_id=?{ttl_sql}
+        ORDER BY ts DESC""", (user_id, *ttl_args))
+
+def set_fact_embeddings(user_id: str, items: List[Tuple[str, bytes]]):
+    """items: (h, emb) for facts stored without an embedding."""
+    settle(user_id)
+    storage.write_many(DB_PATH, "UPDATE facts SET emb=? WHERE user_id=? AND h=?",
+                       [(emb, user_id, h) for h, emb in items])
+
+def fact_users() -> List[str]:
+    settle()
+    return [u for (u,) in storage.query(DB_PATH, "SELECT DISTINCT user_id FROM facts")]
+
+def get_summary(user_id: str) -> Tuple[str, str, int]:
+    """(summary, upto_ts, n_facts) of the user's rolling summary; ("", "", 0) if there is none."""
+    settle(user_id)
+    row = storage.query_one(DB_PATH, "SELECT summary, upto_ts, n_facts FROM summaries WHERE user_id=?", (user_id,))
+    return row or ("", "", 0)
+
+def set_summary(user_id: str, summary: str, upto_ts: str, n_facts: int):
+    _write(user_id, """INSERT INTO summaries(user_id,summary,upto_ts,n_facts,updated_at) VALUES(?,?,?,?,datetime('now'))
+        ON CONFLICT(user_id) DO UPDATE SET summary=excluded.summary, upto_ts=excluded.upto_ts,
+            n_facts=excluded.n_facts, updated_at=excluded.updated_at""", (user_id, summary, upto_ts, n_facts))
+
+def get_facts_since(user_id: str, ts: str, newest: Optional[int] = None) -> List[Tuple[str, str]]:
+    """(fact, ts) newer than ts: all of them oldest first, or the `newest` most recent, newest first."""
+    settle(user_id)
+    if newest is None:
+        return storage.query(DB_PATH, "SELECT fact, ts FROM facts WHERE user_id=? AND ts > ? ORDER BY ts",
+                             (user_id, ts))
+    return storage.query(DB_PATH, "SELECT fact, ts FROM facts WHERE user_id=? AND ts > ? ORDER BY ts DESC LIMIT ?",
+                         (user_id, ts, newest))
+
+def prune_facts() -> int:
+    """Apply the retention policy to every user: drop facts past MEMORY_FACT_TTL_DAYS and
+    each user's facts beyond the newest MEMORY_MAX_FACTS. Returns rows deleted."""
+    settle()
+    n = 0
+    if MEMORY_FACT_TTL_DAYS:
+        n += storage.write(DB_PATH, "DELETE FROM facts WHERE ts < datetime('now', ?)",
+                           (f"-{MEMORY_FACT_TTL_DAYS} days",))
+    if MEMORY_MAX_FACTS:
+        n += storage.write(DB_PATH, """DELETE FROM facts WHERE rowid IN (SELECT rowid FROM
+            (SELECT rowid, row_number() OVER (PARTITION BY user_id ORDER BY ts DESC) AS r FROM facts)
+            WHERE r > ?)""", (MEMORY_MAX_FACTS,))
+    return n
+
+def record_usage(user_id: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int, cost_usd: float, **_):
+    storage.write(DB_PATH, """INSERT INTO usage(user_id,day,requests,prompt_tokens,cached_tokens,completion_tokens,cost_usd)
+        VALUES(?,date('now'),1,?,?,?,?)
+        ON CONFLICT(user_id,day) DO UPDATE SET requests=requests+1,
+            prompt_tokens=prompt_tokens+excluded.prompt_tokens,
+            cached_tokens=cached_tokens+excluded.cached_tokens,
+            completion_tokens=completion_tokens+excluded.completion_tokens,
+            cost_usd=cost_usd+excluded.cost_usd""",
+        (user_id, prompt_tokens, cached_tokens, completion_tokens, cost_usd))
+
+def get_usage_today(user_id: str) -> Dict[str, float]:
+    row = storage.query_one(DB_PATH, """SELECT requests,prompt_tokens,cached_tokens,completion_tokens,cost_usd
+        FROM usage WHERE user_id=? AND day=date('now')""", (user_id,))
+    r = row or (0, 0, 0, 0, 0.0)
+    return {"requests": r[0], "prompt_tokens": r[1], "cached_tokens": r[2], "completion_tokens": r[3],
+            "tokens": r[1] + r[3], "cost_usd": r[4]}
+
+
+if __name__ == "__main__":
+    # python -m memory.memory migrate | prune
+    import sys
+    init_db()
+    if sys.argv[1:2] == ["migrate"]:
+        print(f"schema version {migrate()}")
+    elif sys.argv[1:2] == ["prune"]:
+        print(f"pruned {prune_facts()} facts")
+    else:
+        print("usage: python -m memory.memory migrate | prune")
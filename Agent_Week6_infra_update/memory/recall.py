@@ -0,0 +1,206 @@
+# memory/recall.py
+# Semantic fact recall: facts are embedded when remembered, and the ones closest to the goal go
+# into the prompt (most similar first) until MEMORY_RECALL_TOKENS is used up.
+#   remember(user_id, fact)        -> memory.add_fact, embedded on a background thread
+#   prefetch(goal)                 -> start embedding the goal; the agent calls it first thing, so the
+#                                     embedding overlaps the profile read and answer-cache lookup
+#   recall_facts(user_id, goal)    -> [fact, ...]
+# Each user's facts live in process as one L2-normalized float32 matrix (LRU over users), rebuilt
+# when memory.user_version() changes. No embedding call blocks a request for long:
+#  - the goal's embedding is waited for at most MEMORY_RECALL_EMBED_MS (then: the 5 newest facts,
+#    while the embedding finishes in the background for the next request with that goal).
+#    auto (default) waits about as long as recent goal embeddings took (p90 + 25%, at least 50ms,
+#    at most MEMORY_RECALL_EMBED_MAX_MS), so a remote embedder still gets recall on new goals
+#  - rows stored without an embedding (older rows, other writers, a different embed model) are left
+#    out of the matrix and embedded on the background thread; the matrix is rebuilt once they are
+# MEMORY_RECALL=recent keeps the old behaviour: the 5 newest facts.
+import os, time, threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from memory.memory import add_fact, fact_hash, get_fact_rows, get_recent_facts, set_fact_embeddings, user_version
+from infra import metrics
+
+MEMORY_RECALL = os.getenv("MEMORY_RECALL", "semantic")                 # semantic | recent
+MEMORY_RECALL_TOKENS = int(os.getenv("MEMORY_RECALL_TOKENS", "200"))   # prompt budget for facts
+MEMORY_RECALL_K = int(os.getenv("MEMORY_RECALL_K", "8"))
+MEMORY_RECALL_MIN_SIM = float(os.getenv("MEMORY_RECALL_MIN_SIM", "0.2"))
+MEMORY_INDEX_USERS = int(os.getenv("MEMORY_INDEX_USERS", "256"))       # per-user matrices kept in RAM
+_wait = os.getenv("MEMORY_RECALL_EMBED_MS", "auto")      # wait for the goal's embedding: auto | ms | 0 = no limit
+MEMORY_RECALL_EMBED_MS = None if _wait == "auto" else float(_wait)
+MEMORY_RECALL_EMBED_MAX_MS = float(os.getenv("MEMORY_RECALL_EMBED_MAX_MS", "400"))    # auto: ceiling
+
+try:
+    import tiktoken
+    _enc = tiktoken.get_encoding("cl100k_base")
+    def count_tokens(text: str) -> int:
+        return len(_enc.encode(text))
+except Exception:
+    def count_tokens(text: str) -> int:
+        return (len(text) + 3) // 4
+
+
+def _embed(texts: List[str]) -> np.ndarray:
+    from rag.embeddings import embed_texts      # chromadb import; only when facts are first used
+    m = np.asarray(embed_texts(texts), dtype=np.float32).reshape(len(texts), -1)
+    n = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(n == 0, 1, n)
+
+# goal -> vector; repeated goals (retries, evals, warmers) don't pay for the embedding call again
+_queries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_inflight: Dict[str, Future] = {}
+_qlock = threading.Lock()
+_query_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-embed")
+_latency: "deque[float]" = deque(maxlen=64)     # seconds per goal embedding, for the auto wait
+
+def _embed_query(goal: str) -> np.ndarray:
+    try:
+        t0 = time.perf_counter()
+        v = _embed([goal])[0]
+        with _qlock:
+            _latency.append(time.perf_counter() - t0)
+            _queries[goal] = v
+            while len(_queries) > 1024:
+                _queries.popitem(last=False)
+        return v
+    finally:
+        with _qlock:
+            _inflight.pop(goal, None)
+
+def _start(goal: str):
+    """The goal's embedding if known, else the Future computing it (started if need be)."""
+    with _qlock:
+        v = _queries.get(goal)
+        if v is not None:
+            _queries.move_to_end(goal)
+            return v
+        fut = _inflight.get(goal)
+        if fut is None:
+            fut = _inflight[goal] = _query_pool.submit(_embed_query, goal)
+        return fut
+
+def prefetch(goal: str):
+    """Start embedding the goal without waiting for it."""
+    if MEMORY_RECALL == "semantic":
+        _start(goal)
+
+def embed_wait_s() -> Optional[float]:
+    """How long recall waits for a goal's embedding (None: no limit)."""
+    if MEMORY_RECALL_EMBED_MS is not None:
+        return MEMORY_RECALL_EMBED_MS / 1000 or None
+    with _qlock:
+        xs = sorted(_latency)
+    if len(xs) < 8:
+        return MEMORY_RECALL_EMBED_MAX_MS / 1000          # not measured yet
+    return min(max(xs[int(len(xs) * 0.9)] * 1.25, 0.05), MEMORY_RECALL_EMBED_MAX_MS / 1000)
+
+def _query_vec(goal: str) -> Optional[np.ndarray]:
+    """The goal's embedding, or None if it isn't ready within embed_wait_s()."""
+    v = _start(goal)
+    if not isinstance(v, Future):
+        return v
+    try:
+        return v.result(timeout=embed_wait_s())
+    except FutureTimeout:
+        return None
+
+
+_embedder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fact-embed")
+
+def remember(user_id: str, fact: str):
+    """Store the fact now (write-behind) and embed it off the tool loop."""
+    add_fact(user_id, fact)
+    _embedder.submit(_embed_fact, user_id, fact)
+
+def _embed_fact(user_id: str, fact: str):
+    try:
+        set_fact_embeddings(user_id, [(fact_hash(fact), _embed([fact])[0].tobytes())])
+    except Exception:
+        pass                    # left NULL: backfilled on the next index load
+
+
+_index: "OrderedDict[str, Tuple[tuple, List[str], np.ndarray]]" = OrderedDict()
+_lock = threading.Lock()
+_backfilling = set()
+_fills = [0]                    # bumped by every backfill: a load that read rows before it doesn't cache them
+
+def _backfill(user_id: str, dim: int):
+    """Embed and store the user's facts that have no (or a wrong-sized) embedding, then drop the
+    user's matrix so the next recall rebuilds it with them. Storing embeddings doesn't bump
+    user_version, so the index wouldn't notice on its own."""
+    try:
+        rows = [(h, f) for h, f, emb in get_fact_rows(user_id) if emb is None or len(emb) != dim * 4]
+        for i in range(0, len(rows), 256):
+            chunk = rows[i:i + 256]
+            m = _embed([f for _, f in chunk])
+            set_fact_embeddings(user_id, [(h, v.tobytes()) for (h, _), v in zip(chunk, m)])
+        metrics.counter("memory_recall_backfilled_total").inc(len(rows))
+        with _lock:
+            _index.pop(user_id, None)
+            _fills[0] += 1
+    except Exception:
+        pass                    # tried again when the user's facts next change
+    finally:
+        with _lock:
+            _backfilling.discard(user_id)
+
+def _load(user_id: str, dim: int) -> Tuple[List[str], np.ndarray]:
+    version = user_version(user_id)
+    with _lock:
+        e = _index.get(user_id)
+        if e and e[0] == version and e[2].shape[1] == dim:
+            _index.move_to_end(user_id)
+            return e[1], e[2]
+        fills = _fills[0]
+    rows = get_fact_rows(user_id)
+    ok = [(f, emb) for _, f, emb in rows if emb is not None and len(emb) == dim * 4]
+    facts = [f for f, _ in ok]
+    m = np.frombuffer(b"".join(emb for _, emb in ok), dtype=np.float32).reshape(len(ok), dim)
+    if len(ok) < len(rows):
+        # recalled without them for now (the newest facts are in the prompt anyway: memory/summary.py)
+        with _lock:
+            start = user_id not in _backfilling
+            _backfilling.add(user_id)
+        if start:
+            _embedder.submit(_backfill, user_id, dim)
+    with _lock:
+        if fills == _fills[0]:
+            _index[user_id] = (version, facts, m)
+            _index.move_to_end(user_id)
+            while len(_index) > MEMORY_INDEX_USERS:
+                _index.popitem(last=False)
+    return facts, m
+
+def recall_facts(user_id: str, goal: str, budget_tokens: Optional[int] = None, k: int = MEMORY_RECALL_K) -> List[str]:
+    """The user's facts most similar to goal, within budget_tokens (default MEMORY_RECALL_TOKENS)."""
+    if MEMORY_RECALL != "semantic":
+        return get_recent_facts(user_id, n=5)
+    t0 = time.perf_counter_ns()
+    budget = MEMORY_RECALL_TOKENS if budget_tokens is None else budget_tokens
+    try:
+        q = _query_vec(goal)
+        if q is None:
+            metrics.counter("memory_recall_total", result="embed_timeout").inc()
+            return get_recent_facts(user_id, n=5)
+        facts, m = _load(user_id, q.shape[0])
+    except Exception:
+        metrics.counter("memory_recall_total", result="fallback").inc()
+        return get_recent_facts(user_id, n=5)
+    out: List[str] = []
+    if facts:
+        sims = m @ q
+        top = np.sort(np.argpartition(-sims, k)[:k]) if len(facts) > k else np.arange(len(facts))
+        # stable: equally similar facts keep their newest-first order
+        for i in top[np.argsort(-sims[top], kind="stable")]:
+            if sims[i] < MEMORY_RECALL_MIN_SIM:
+                break
+            cost = count_tokens(facts[i])
+            if cost <= budget:
+                out.append(facts[i])
+                budget -= cost
+    metrics.counter("memory_recall_total", result="hit" if out else "empty").inc()
+    metrics.observe_ns("memory_recall_seconds", time.perf_counter_ns() - t0)
+    return out
@@ -0,0 +1,154 @@
+# memory/summary.py
+# Rolling fact summarization: a user's older facts are folded into one summary row so the memory
+# part of the prompt stays the same size however long the history grows.
+#   memory_context(user_id, goal) -> (summary, facts): the summary, the newest facts not yet in it
+#                                    (MEMORY_DELTA_TOKENS) and older facts relevant to the goal
+#                                    (memory/recall.py, MEMORY_RECALL_TOKENS)
+#   compact(user_id)              -> fold all but the newest MEMORY_DELTA_FACTS unsummarized facts
+#                                    into the summary (kept under MEMORY_SUMMARY_TOKENS)
+# Compaction runs on a background thread once a user has MEMORY_COMPACT_AT unsummarized facts,
+# or for everyone with `python -m memory.summary compact`.
+# MEMORY_SUMMARIZER=local (default) is extractive and offline; =llm asks MEMORY_SUMMARY_MODEL and
+# falls back to local on any error.
+import os, re, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from memory.memory import cached, fact_users, get_summary, set_summary, get_facts_since
+from memory.recall import recall_facts, count_tokens
+from infra import metrics
+from infra.tracing import log
+
+MEMORY_SUMMARIZER = os.getenv("MEMORY_SUMMARIZER", "local")             # local | llm
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "gpt-4.1-mini")
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "150"))
+MEMORY_DELTA_FACTS = int(os.getenv("MEMORY_DELTA_FACTS", "10"))         # newest facts left out of the summary
+MEMORY_DELTA_TOKENS = int(os.getenv("MEMORY_DELTA_TOKENS", "100"))
+MEMORY_COMPACT_AT = int(os.getenv("MEMORY_COMPACT_AT", "30"))           # unsummarized facts that trigger a run
+
+_WORD = re.compile(r"\w+")
+_STOP = frozenset("i i'm im my me the a an is am are was to of and in on for at with that this it".split())
+
+
+# --- summarizers ---
+def _local_summary(prev: str, facts: List[str], budget: int) -> str:
+    """Extractive: newest statements first, dropping any whose content words are covered by one
+    already kept (restated or superseded facts), then the previous summary, cut at the budget."""
+    kept: List[str] = []
+    seen: List[frozenset] = []
+    used = 0
+    for c in list(reversed(facts)) + [x for x in prev.split("; ") if x]:
+        w = frozenset(_WORD.findall(c.casefold())) - _STOP
+        if not w or any(w <= s for s in seen):
+            continue
+        cost = count_tokens(c) + 1
+        if used + cost > budget:
+            continue
+        kept.append(c.strip().rstrip("."))
+        seen.append(w)
+        used += cost
+    return "; ".join(kept)
+
+_client = None
+
+def _llm_summary(prev: str, facts: List[str], budget: int) -> str:
+    global _client
+    from openai import OpenAI
+    from openai.types.chat import ChatCompletion
+    from infra import cassette
+    if _client is None:
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    prompt = (f"Merge the existing summary and the new facts about a user into one compact summary of at most "
+              f"{budget} tokens. Keep stable preferences and facts; when facts conflict, the newer one wins. "
+              f"Output only the summary as short clauses separated by '; '.\n"
+              f"Existing summary: {prev or '(none)'}\nNew facts, oldest first:\n" + "\n".join(f"- {f}" for f in facts))
+    req = {"model": MEMORY_SUMMARY_MODEL, "messages": [{"role": "user", "content": prompt}],
+           "temperature": 0, "max_tokens": budget * 2}
+    r = cassette.call("chat", req, lambda: _client.chat.completions.create(**req, timeout=30),
+                      decode=ChatCompletion.model_validate)
+    out = (r.choices[0].message.content or "").strip()
+    # the model doesn't always respect the budget: hold it to it
+    return _local_summary("", list(reversed(out.split("; "))), budget) if count_tokens(out) > budget else out
+
+def summarize(prev: str, facts: List[str], budget: int = MEMORY_SUMMARY_TOKENS) -> str:
+    if MEMORY_SUMMARIZER == "llm":
+        try:
+            return _llm_summary(prev, facts, budget)
+        except Exception as e:
+            log("memory.summary_error", error=str(e))
+    return _local_summary(prev, facts, budget)
+
+
+# --- compaction ---
+def compact(user_id: str) -> bool:
+    """Fold the user's older unsummarized facts into the summary; False if there weren't enough."""
+    summary, upto, n = get_summary(user_id)
+    rows = get_facts_since(user_id, upto)
+    old = rows[:-MEMORY_DELTA_FACTS] if MEMORY_DELTA_FACTS else rows
+    if not old or len(rows) < MEMORY_COMPACT_AT:
+        return False
+    t0 = time.perf_counter()
+    new = summarize(summary, [f for f, _ in old])
+    set_summary(user_id, new, old[-1][1], n + len(old))
+    metrics.counter("memory_compactions_total", summarizer=MEMORY_SUMMARIZER).inc()
+    log("memory.compacted", user_id=user_id, facts=len(old), summary_tokens=count_tokens(new),
+        duration_s=round(time.perf_counter() - t0, 3))
+    return True
+
+def compact_all() -> int:
+    return sum(compact(u) for u in fact_users())
+
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-compact")
+_scheduled = set()
+_sched_lock = threading.Lock()
+
+def _schedule(user_id: str):
+    with _sched_lock:
+        if user_id in _scheduled:
+            return
+        _scheduled.add(user_id)
+    def run():
+        try:
+            compact(user_id)
+        except Exception as e:
+            log("memory.compact_error", user_id=user_id, error=str(e))
+        finally:
+            with _sched_lock:
+                _scheduled.discard(user_id)
+    _compactor.submit(run)
+
+
+# --- prompt ---
+def _load_context(user_id: str) -> Tuple[str, List[str]]:
+    summary, upto, _ = get_summary(user_id)
+    return summary, [f for f, _ in get_facts_since(user_id, upto, newest=MEMORY_COMPACT_AT)]
+
+def memory_context(user_id: str, goal: str) -> Tuple[str, List[str]]:
+    """(summary, facts) for the system prompt; both bounded in tokens regardless of history length."""
+    summary, deltas = cached(("context", user_id), user_id, lambda: _load_context(user_id))
+    if len(deltas) >= MEMORY_COMPACT_AT:
+        _schedule(user_id)
+    facts: List[str] = []
+    budget = MEMORY_DELTA_TOKENS
+    for f in deltas:
+        cost = count_tokens(f)
+        if cost > budget:
+            break
+        facts.append(f)
+        budget -= cost
+    facts += [f for f in recall_facts(user_id, goal) if f not in facts]
+    return summary, facts
+
+
+if __name__ == "__main__":
+    # python -m memory.summary compact [user_id]   /   python -m memory.summary show <user_id>
+    import sys
+    from memory.memory import init_db
+    init_db()
+    if sys.argv[1:2] == ["compact"]:
+        n = compact(sys.argv[2]) if len(sys.argv) > 2 else compact_all()
+        print(f"compacted {int(n)} user(s)")
+    elif sys.argv[1:2] == ["show"] and len(sys.argv) == 3:
+        print(get_summary(sys.argv[2]))
+    else:
+        print("usage: python -m memory.summary compact [user_id] | show <user_id>")
@@ -0,0 +1,89 @@
+# rag/embeddings.py
+# Embedding functions for Chroma and direct use.
+#   EMBED_BACKEND=openai (default)  -> OpenAI EMBED_MODEL
+#   EMBED_BACKEND=fake              -> deterministic feature-hashing vectors, no network (benchmarks, CI)
+# Under CASSETTE_MODE=record|replay the chosen function is wrapped so calls are recorded/replayed.
+import os, re, zlib, math
+from typing import List
+
+from chromadb.utils import embedding_functions
+
+from rag.config import EMBED_MODEL
+from infra import cassette
+
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "openai")
+FAKE_EMBED_DIM = int(os.getenv("FAKE_EMBED_DIM", "256"))
+
+_WORD = re.compile(r"\w+")
+
+
+class HashEmbeddingFunction(embedding_functions.EmbeddingFunction):
+    """Bag-of-words feature hashing (crc32 buckets, L2-normalized). Same text -> same vector, always."""
+
+    def __init__(self, dim: int = FAKE_EMBED_DIM):
+        self.dim = dim
+
+    def __call__(self, input):
+        out = []
+        for text in input:
+            v = [0.0] * self.dim
+            for w in _WORD.findall((text or "").lower()):
+                h = zlib.crc32(w.encode("utf-8"))
+                v[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+            n = math.sqrt(sum(x * x for x in v)) or 1.0
+            out.append([x / n for x in v])
+        return out
+
+    def name(self):
+        return "agent_hash"
+
+    def get_config(self):
+        return {"dim": self.dim}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbeddingFunction(config.get("dim", FAKE_EMBED_DIM))
+
+    def is_legacy(self):
+        return False
+
+
+class CassetteEmbeddingFunction(embedding_functions.EmbeddingFunction):
+    """Records/replays embedding calls so retrieval runs offline."""
+
+    def __init__(self, inner):
+        self._inner = inner
+
+    def __call__(self, input):
+        return cassette.call("embedding", {"model": EMBED_MODEL, "input": list(input)},
+                             lambda: self._inner(input))
+
+    # same identity as the wrapped function, so Chroma sees no config conflict
+    def name(self):
+        return self._inner.name()
+
+    def get_config(self):
+        return self._inner.get_config()
+
+    def is_legacy(self):
+        return self._inner.is_legacy()
+
+
+def get_embedding_function():
+    if EMBED_BACKEND == "fake":
+        return HashEmbeddingFunction()
+    ef = embedding_functions.OpenAIEmbeddingFunction(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model_name=EMBED_MODEL,
+    )
+    return CassetteEmbeddingFunction(ef) if cassette.active() else ef
+
+
+_default = None
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embed outside Chroma (same backend and model as the retriever)."""
+    global _default
+    if _default is None:
+        _default = get_embedding_function()
+    return [list(map(float, v)) for v in _default(list(texts))]
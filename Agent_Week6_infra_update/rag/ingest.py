@@ -2,12 +2,16 @@ import os, uuid
 from typing import List, Dict
 from rag.chunking import load_pdf_text, chunk_text
 from tools.retriever import add_documents
+from infra.tracing import span
+from infra.memprof import track_memory
 
 def ingest_pdfs(paths: List[str], max_chars=1200, overlap=200):
     docs: List[Dict[str,str]] = []
-    for p in paths:
-        txt = load_pdf_text(p)
-        for i, chunk in enumerate(chunk_text(txt, max_chars=max_chars, overlap=overlap)):
-            docs.append({"id": f"{os.path.basename(p)}-{i}-{uuid.uuid4().hex[:6]}", "text": chunk, "source": p})
-    if docs:
-        add_documents(docs)
+    with span("rag.ingest", files=len(paths)) as sp, track_memory("rag.ingest", into=sp):
+        for p in paths:
+            txt = load_pdf_text(p)
+            for i, chunk in enumerate(chunk_text(txt, max_chars=max_chars, overlap=overlap)):
+                docs.append({"id": f"{os.path.basename(p)}-{i}-{uuid.uuid4().hex[:6]}", "text": chunk, "source": p})
+        sp["chunks"] = len(docs)
+        if docs:
+            add_documents(docs)
@@ -1,44 +1,194 @@
-import os, re
-from typing import Dict, Any
+import os, time, hashlib, threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
 from openai import OpenAI
 
-# --- simple injection heuristics ---
-_INJECTION_PATTERNS = [
-    r"\bignore (all|previous|earlier) (instructions|prompts)\b",
-    r"\boverride\b.*\bsystem\b",
-    r"\bdisregard\b.*\brules\b",
-    r"\bprint\b.*\bsystem prompt\b",
-    r"\bshow\b.*\bconfidential\b",
-    r"\breturn\b.*\btool schema\b",
-]
-_INJ = re.compile("|".join(_INJECTION_PATTERNS), re.IGNORECASE)
+from infra.tracing import log
+from infra import cassette
+
+# --- injection heuristics: linear-time keyword automaton (see safety/scanner.py) ---
+from safety.scanner import scan as scan_injection
 
 _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def moderate(text: str) -> Dict[str, Any]:
-    """Wrap OpenAI moderation. Fail-open on errors."""
+# --- moderation batching + verdict cache ---
+MOD_MODEL = os.getenv("MOD_MODEL", "omni-moderation-latest")
+MOD_BATCH_MAX_ITEMS = int(os.getenv("MOD_BATCH_MAX_ITEMS", "32"))        # inputs per create()
+MOD_BATCH_MAX_CHARS = int(os.getenv("MOD_BATCH_MAX_CHARS", "100000"))    # total chars per create()
+MOD_CACHE_TTL_S = float(os.getenv("MOD_CACHE_TTL_S", "3600"))
+MOD_CACHE_MAX = int(os.getenv("MOD_CACHE_MAX", "10000"))
+
+# local first-pass classifier (safety/local_mod.py), used once its adapter has been trained;
+# only the uncertain band goes remote
+LOCAL_MOD = os.getenv("LOCAL_MOD", "1") == "1"
+LOCAL_MOD_LOW = float(os.getenv("LOCAL_MOD_LOW", "0.1"))     # p_flagged below -> allow locally
+LOCAL_MOD_HIGH = float(os.getenv("LOCAL_MOD_HIGH", "0.9"))   # p_flagged above -> flag locally
+try:
+    if not LOCAL_MOD:
+        raise ImportError("LOCAL_MOD=0")
+    from safety.local_mod import classify_many as _local_classify
+    _has_local = True
+except Exception:
+    _has_local = False
+
+_verdicts: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_lock = threading.Lock()
+_stats = {"calls": 0, "inputs": 0, "chars": 0, "cache_hits": 0, "errors": 0, "latency_s": 0.0,
+          "local_inputs": 0, "local_decided": 0, "local_latency_s": 0.0}
+
+def _vkey(text: str) -> str:
+    return hashlib.sha256(f"{MOD_MODEL}\x00{text}".encode("utf-8")).hexdigest()
+
+def _cache_get(k: str):
+    with _lock:
+        hit = _verdicts.get(k)
+        if not hit:
+            return None
+        ts, verdict = hit
+        if time.time() - ts > MOD_CACHE_TTL_S:
+            del _verdicts[k]
+            return None
+        _verdicts.move_to_end(k)
+        _stats["cache_hits"] += 1
+        return verdict
+
+def _cache_put(k: str, verdict: Dict[str, Any]):
+    with _lock:
+        _verdicts[k] = (time.time(), verdict)
+        _verdicts.move_to_end(k)
+        while len(_verdicts) > MOD_CACHE_MAX:
+            _verdicts.popitem(last=False)
+
+def _moderate_batch(texts: List[str]) -> List[Dict[str, Any]]:
+    """One moderations.create call for a list of inputs. Fail-open on errors."""
+    chars = sum(len(t) for t in texts)
+    t0 = time.perf_counter()
     try:
-        m = _client.moderations.create(
-            model="omni-moderation-latest",
-            input=text or ""
-        )
-        r = m.results[0]
-        flagged = bool(getattr(r, "flagged", False))
-        cats = getattr(r, "categories", {}) or {}
-        # ensure plain dict
-        cats = dict(cats) if not isinstance(cats, dict) else cats
-        return {"flagged": flagged, "categories": cats}
+        from openai.types import ModerationCreateResponse
+        m = cassette.call("moderation", {"model": MOD_MODEL, "input": texts},
+                          lambda: _client.moderations.create(model=MOD_MODEL, input=texts),
+                          decode=ModerationCreateResponse.model_validate)
+        out = []
+        for r in m.results:
+            cats = getattr(r, "categories", {}) or {}
+            # ensure plain dict
+            cats = dict(cats) if not isinstance(cats, dict) else cats
+            out.append({"flagged": bool(getattr(r, "flagged", False)), "categories": cats, "source": "remote"})
+        err = None
     except Exception as e:
-        return {"flagged": False, "error": str(e)}
+        err = str(e)
+        out = [{"flagged": False, "error": err} for _ in texts]
+    dt = time.perf_counter() - t0
+    with _lock:
+        _stats["calls"] += 1
+        _stats["inputs"] += len(texts)
+        _stats["chars"] += chars
+        _stats["latency_s"] += dt
+        _stats["errors"] += 1 if err else 0
+    log("moderation.call", inputs=len(texts), chars=chars, latency_s=round(dt, 3), error=err)
+    return out
+
+def _local_pass(texts: List[str], pending, results: List[Any], local_p: Dict[str, float]):
+    """Decide confident cases locally and drop them from `pending`; keep p for the rest."""
+    keys = list(pending)
+    t0 = time.perf_counter()
+    try:
+        probs = _local_classify([texts[pending[k][0]] for k in keys])
+    except Exception:
+        return
+    dt = time.perf_counter() - t0
+    decided = 0
+    for k, p in zip(keys, probs):
+        if LOCAL_MOD_LOW <= p <= LOCAL_MOD_HIGH:
+            local_p[k] = round(p, 4)
+            continue
+        verdict = {"flagged": p > LOCAL_MOD_HIGH, "categories": {}, "source": "local", "p_flagged": round(p, 4)}
+        _cache_put(k, verdict)
+        for i in pending.pop(k):
+            results[i] = verdict
+        decided += 1
+    with _lock:
+        _stats["local_inputs"] += len(keys)
+        _stats["local_decided"] += decided
+        _stats["local_latency_s"] += dt
+
+def moderate_many(texts: List[str]) -> List[Dict[str, Any]]:
+    """Moderate many texts: verdict cache, then the local classifier (if trained), then
+    batched remote calls for whatever is still undecided (deduped)."""
+    texts = [t or "" for t in texts]
+    results: List[Any] = [None] * len(texts)
+    pending: "OrderedDict[str, List[int]]" = OrderedDict()   # key -> positions waiting on it
+    for i, t in enumerate(texts):
+        k = _vkey(t)
+        cached = _cache_get(k)
+        if cached is not None:
+            results[i] = {**cached, "cached": True}
+        else:
+            pending.setdefault(k, []).append(i)
+
+    local_p: Dict[str, float] = {}
+    if _has_local and pending:
+        _local_pass(texts, pending, results, local_p)
+
+    keys: List[str] = []
+    batch: List[str] = []
+    budget = 0
+
+    def flush():
+        nonlocal keys, batch, budget
+        if batch:
+            for k, verdict in zip(keys, _moderate_batch(batch)):
+                if "error" not in verdict:
+                    _cache_put(k, verdict)
+                elif k in local_p:
+                    # remote down: fall back to the local model instead of failing open
+                    verdict = {**verdict, "flagged": local_p[k] >= 0.5, "source": "local", "p_flagged": local_p[k]}
+                for i in pending[k]:
+                    results[i] = verdict
+            keys, batch, budget = [], [], 0
+
+    for k, idxs in pending.items():
+        t = texts[idxs[0]]
+        # Start a new batch if adding this would exceed either limit.
+        if batch and (len(batch) >= MOD_BATCH_MAX_ITEMS or budget + len(t) > MOD_BATCH_MAX_CHARS):
+            flush()
+        keys.append(k)
+        batch.append(t)
+        budget += len(t)
+
+    flush()
+    return results
+
+def moderate(text: str) -> Dict[str, Any]:
+    """Wrap OpenAI moderation. Fail-open on errors."""
+    return moderate_many([text])[0]
+
+def moderation_stats() -> Dict[str, Any]:
+    """Cumulative moderation calls/inputs/chars/latency and cache hit counts for this process."""
+    with _lock:
+        s = dict(_stats)
+    s["avg_latency_s"] = round(s["latency_s"] / s["calls"], 4) if s["calls"] else None
+    s["inputs_per_call"] = round(s["inputs"] / s["calls"], 2) if s["calls"] else None
+    s["latency_s"] = round(s["latency_s"], 3)
+    s["local_latency_s"] = round(s["local_latency_s"], 3)
+    s["escalation_rate"] = (round(1 - s["local_decided"] / s["local_inputs"], 3)
+                            if s["local_inputs"] else None)
+    return s
 
 def detect_injection(text: str) -> bool:
-    return bool(_INJ.search(text or ""))
+    return scan_injection(text)["hit"]
 
-def guard_query(text: str) -> Dict[str, Any]:
-    inj = detect_injection(text)
-    mod = moderate(text)
+def _verdict(inj: bool, mod: Dict[str, Any]) -> Dict[str, Any]:
     blocked = inj or mod.get("flagged", False)
     reason = "prompt_injection" if inj else ""
     if mod.get("flagged", False):
         reason = (reason + " moderation").strip()
     return {"blocked": blocked, "reason": reason, "moderation": mod}
+
+def guard_many(texts: List[str]) -> List[Dict[str, Any]]:
+    """guard_query for a list of inputs, sharing batched moderation calls."""
+    mods = moderate_many(texts)
+    return [_verdict(detect_injection(t), m) for t, m in zip(texts, mods)]
+
+def guard_query(text: str) -> Dict[str, Any]:
+    return guard_many([text])[0]
@@ -0,0 +1,36 @@
+# safety/local_mod.py
+# Local CPU moderation classifier (LoRA adapter from finetune/train_moderation.py).
+# Loaded the same way as tools/sentiment.py; import fails if torch/peft or the adapter are missing.
+import os
+from typing import Dict, List
+
+BASE = os.getenv("BASE_MODEL", "distilbert-base-uncased")
+ADAPTER = os.getenv("MOD_ADAPTER_DIR", "finetune/adapters-distilbert-moderation")
+
+# before anything is loaded: from_pretrained() would take a missing path for a hub repo id and go
+# to the network (at import of safety.filter)
+if not os.path.isdir(ADAPTER):
+    raise ImportError(f"no moderation adapter in {ADAPTER} (train one: python -m finetune.train_moderation)")
+
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from peft import PeftModel
+
+_tok = AutoTokenizer.from_pretrained(ADAPTER)
+_base = AutoModelForSequenceClassification.from_pretrained(BASE, num_labels=2)
+_model = PeftModel.from_pretrained(_base, ADAPTER).eval()
+
+def classify_many(texts: List[str], batch_size: int = 16) -> List[float]:
+    """Probability that each text should be flagged."""
+    out: List[float] = []
+    for i in range(0, len(texts), batch_size):
+        chunk = [t or "" for t in texts[i:i+batch_size]]
+        with torch.no_grad():
+            x = _tok(chunk, truncation=True, padding=True, max_length=256, return_tensors="pt")
+            logits = _model(**{k:v for k,v in x.items() if k in ("input_ids","attention_mask")}).logits
+        out.extend(float(p) for p in logits.softmax(dim=1)[:, 1])
+    return out
+
+def classify(text: str) -> Dict[str, float]:
+    p = classify_many([text])[0]
+    return {"flagged": p >= 0.5, "p_flagged": round(p, 4)}
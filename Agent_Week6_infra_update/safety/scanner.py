@@ -0,0 +1,147 @@
+# safety/scanner.py
+# Linear-time prompt-injection scanner: keyword automaton + proximity rules.
+#
+# The old detector was one regex of `a.*b` alternations, which backtracks badly on long
+# inputs full of trigger words. Here every step is linear in the input:
+#   1) one pass of a fixed literal-alternation regex finds keyword tokens (and newlines),
+#   2) a token-level Aho-Corasick automaton matches multi-word phrases over those tokens,
+#   3) proximity rules fire when keyword A is followed by keyword B on the same line
+#      within INJ_MAX_GAP_CHARS characters.
+
+import os, re
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+INJ_MAX_SCAN_CHARS = int(os.getenv("INJ_MAX_SCAN_CHARS", "2000000"))   # longer inputs: scan head + tail
+INJ_MAX_GAP_CHARS = int(os.getenv("INJ_MAX_GAP_CHARS", "300"))         # max distance between rule keywords
+
+# phrases that trip on their own
+PHRASES: Dict[str, Tuple[str, ...]] = {
+    f"ignore_{a}_{b}": ("ignore", a, b)
+    for a in ("all", "previous", "earlier")
+    for b in ("instructions", "prompts")
+}
+# (first, second): first must precede second on the same line
+KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "override": ("override",), "system": ("system",),
+    "disregard": ("disregard",), "rules": ("rules",),
+    "print": ("print",), "system_prompt": ("system", "prompt"),
+    "show": ("show",), "confidential": ("confidential",),
+    "return": ("return",), "tool_schema": ("tool", "schema"),
+}
+RULES: List[Tuple[str, str]] = [
+    ("override", "system"),
+    ("disregard", "rules"),
+    ("print", "system_prompt"),
+    ("show", "confidential"),
+    ("return", "tool_schema"),
+]
+
+class TokenAutomaton:
+    """Aho-Corasick over token sequences. feed() is amortized O(1) per token."""
+
+    def __init__(self, patterns: Dict[str, Tuple[str, ...]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, int]]] = [[]]   # (name, length in tokens)
+        for name, toks in patterns.items():
+            s = 0
+            for t in toks:
+                if t not in self._goto[s]:
+                    self._goto.append({}); self._fail.append(0); self._out.append([])
+                    self._goto[s][t] = len(self._goto) - 1
+                s = self._goto[s][t]
+            self._out[s].append((name, len(toks)))
+        q = deque(self._goto[0].values())
+        while q:
+            s = q.popleft()
+            for t, nxt in self._goto[s].items():
+                q.append(nxt)
+                if s:
+                    f = self._fail[s]
+                    while f and t not in self._goto[f]:
+                        f = self._fail[f]
+                    self._fail[nxt] = self._goto[f].get(t, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self.vocab = {t for toks in patterns.values() for t in toks}
+
+    def feed(self, state: int, tok: str) -> Tuple[int, List[Tuple[str, int]]]:
+        while state and tok not in self._goto[state]:
+            state = self._fail[state]
+        state = self._goto[state].get(tok, 0)
+        return state, self._out[state]
+
+
+_AUTO = TokenAutomaton({**PHRASES, **KEYWORDS})
+# literal alternation only (no nested quantifiers) -> one linear pass in C
+_TOKENS = re.compile(r"\b(?:" + "|".join(sorted(map(re.escape, _AUTO.vocab), key=len, reverse=True)) + r")\b")
+_WORD = re.compile(r"\w")
+_FIRSTS = {a for a, _ in RULES}
+_SECONDS = {b: [a for (a, b2) in RULES if b2 == b] for _, b in RULES}
+
+
+def _scan(low: str) -> Optional[str]:
+    state = 0
+    prev_end = None
+    line = 0
+    starts = deque(maxlen=max(len(t) for t in (*PHRASES.values(), *KEYWORDS.values())))
+    last_first: Dict[str, Tuple[int, int]] = {}     # first keyword -> (line, end offset)
+    for m in _TOKENS.finditer(low):
+        start, end = m.span()
+        # keywords separated by other words or a newline cannot continue a phrase
+        if prev_end is not None and not (start - prev_end == 1 and low[prev_end] == " "):
+            nl = low.count("\n", prev_end, start)
+            if nl or _WORD.search(low, prev_end, start):
+                state = 0
+                starts.clear()
+                line += nl
+        state, outs = _AUTO.feed(state, m.group())
+        starts.append(start)
+        prev_end = end
+        for name, n in outs:
+            if name in PHRASES:
+                return name
+            p_start = starts[-n]
+            for a in _SECONDS.get(name, ()):
+                seen = last_first.get(a)
+                if seen and seen[0] == line and seen[1] <= p_start and p_start - seen[1] <= INJ_MAX_GAP_CHARS:
+                    return f"{a}_{name}"
+            if name in _FIRSTS:
+                last_first[name] = (line, end)
+    return None
+
+
+def scan(text: str) -> Dict[str, Any]:
+    """Return {"hit": bool, "rule": name|None, "truncated": bool}."""
+    text = text or ""
+    truncated = len(text) > INJ_MAX_SCAN_CHARS
+    if truncated:
+        half = INJ_MAX_SCAN_CHARS // 2
+        parts = [text[:half], text[-half:]]
+    else:
+        parts = [text]
+    for p in parts:
+        rule = _scan(p.lower())
+        if rule:
+            return {"hit": True, "rule": rule, "truncated": truncated}
+    return {"hit": False, "rule": None, "truncated": truncated}
+
+
+def _strings(obj: Any) -> Iterator[str]:
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from _strings(v)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            yield from _strings(v)
+
+
+def scan_obj(obj: Any) -> Optional[str]:
+    """Scan every string inside a tool result (dict/list/str). Returns the rule name or None."""
+    for s in _strings(obj):
+        r = scan(s)
+        if r["hit"]:
+            return r["rule"]
+    return None
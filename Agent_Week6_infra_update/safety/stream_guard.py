@@ -0,0 +1,106 @@
+# safety/stream_guard.py
+# Incremental output guard for streamed answer tokens.
+#
+# feed() is called once per streamed token. Text is scanned in small slices (every
+# OUT_SCAN_EVERY chars or at a sentence end) over a sliding window, so the per-token cost
+# stays constant no matter how long the answer gets. Finished sentences can also be sent
+# to batched moderation on a background thread; a flagged verdict trips the guard on the
+# next feed() so the caller can stop generation early.
+
+import os, re
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from safety.scanner import scan, INJ_MAX_GAP_CHARS
+
+OUT_WINDOW_CHARS = int(os.getenv("OUT_WINDOW_CHARS", "4000"))     # text kept for rescans
+OUT_SCAN_EVERY = int(os.getenv("OUT_SCAN_EVERY", "64"))           # chars between scans
+OUT_MOD_SENTENCES = int(os.getenv("OUT_MOD_SENTENCES", "4"))      # sentences per moderation batch
+
+# things an answer should never contain, independent of the input side
+_OUTPUT_PATTERNS = [
+    r"\bsk-[A-Za-z0-9_-]{20,}",                      # OpenAI-style API keys
+    r"\btvly-[A-Za-z0-9]{16,}",                      # Tavily keys
+    r"-----BEGIN [A-Z ]*PRIVATE KEY-----",
+]
+_OUT = re.compile("|".join(_OUTPUT_PATTERNS))
+_SENT_END = re.compile(r"[.!?\n]")
+_OVERLAP = INJ_MAX_GAP_CHARS + 64       # rescanned tail so matches spanning two slices are seen
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="out-guard")
+
+
+class OutputGuard:
+    def __init__(self, moderate_many: Optional[Callable[[List[str]], List[Dict[str, Any]]]] = None):
+        self.window = ""
+        self.tripped: Optional[Dict[str, Any]] = None
+        self._unscanned = 0
+        self._sentence_start = 0          # offset in window where the current sentence begins
+        self._sentences: List[str] = []
+        self._moderate_many = moderate_many
+        self._futures: List[Future] = []
+
+    def feed(self, token: str) -> Optional[Dict[str, Any]]:
+        """Add one streamed token. Returns the trip verdict once something fires, else None."""
+        if self.tripped:
+            return self.tripped
+        self._check_futures()
+        if self.tripped:
+            return self.tripped
+        self.window += token
+        self._unscanned += len(token)
+        end = _SENT_END.search(token) is not None
+        if self._unscanned >= OUT_SCAN_EVERY or end:
+            self._scan_tail()
+        if end and self._moderate_many:
+            self._sentences.append(self.window[self._sentence_start:])
+            self._sentence_start = len(self.window)
+            if len(self._sentences) >= OUT_MOD_SENTENCES:
+                self._submit()
+        if len(self.window) > 2 * OUT_WINDOW_CHARS:          # trim in steps, not per token
+            cut = len(self.window) - OUT_WINDOW_CHARS
+            self.window = self.window[cut:]
+            self._sentence_start = max(0, self._sentence_start - cut)
+        return self.tripped
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        """End of stream: scan what is left and wait for outstanding moderation."""
+        if not self.tripped and self._unscanned:
+            self._scan_tail()
+        if not self.tripped and self._moderate_many:
+            rest = self.window[self._sentence_start:]
+            if rest.strip():
+                self._sentences.append(rest)
+            self._submit()
+            wait(self._futures)
+            self._check_futures()
+        return self.tripped
+
+    def _scan_tail(self):
+        tail = self.window[-(self._unscanned + _OVERLAP):]
+        self._unscanned = 0
+        m = _OUT.search(tail)
+        if m:
+            self.tripped = {"blocked": True, "reason": "secret_leak"}
+            return
+        r = scan(tail)
+        if r["hit"]:
+            self.tripped = {"blocked": True, "reason": "prompt_injection", "rule": r["rule"]}
+
+    def _submit(self):
+        batch = [s for s in self._sentences if s.strip()]
+        self._sentences = []
+        if batch:
+            self._futures.append(_pool.submit(self._moderate_many, batch))
+
+    def _check_futures(self):
+        done = [f for f in self._futures if f.done()]
+        for f in done:
+            self._futures.remove(f)
+            try:
+                verdicts = f.result()
+            except Exception:
+                continue          # fail-open, same as input moderation
+            if any(v.get("flagged") for v in verdicts):
+                self.tripped = {"blocked": True, "reason": "moderation"}
+                return
@@ -1,14 +1,16 @@
 # tools/retriever.py
-# Chroma-based retriever with OpenAI embeddings, input sanitization, and safe batching.
+# Chroma-based retriever with OpenAI (or fake) embeddings, input sanitization, and safe batching.
 
-import os
 import re
 from typing import List, Dict, Any
 
 import chromadb
-from chromadb.utils import embedding_functions
 
-from rag.config import CHROMA_DIR, EMBED_MODEL
+from rag.config import CHROMA_DIR
+from rag.embeddings import get_embedding_function
+from infra.tracing import span
+from infra.memprof import track_memory
+from infra import cache
 
 # --- Sanitize text to avoid tiktoken special-token errors ---
 _SPECIAL = re.compile(r"<\|.*?\|>")                  # matches <|...|>
@@ -24,10 +26,7 @@ def _clean(s: str) -> str:
 # --- Chroma setup ---
 _db = chromadb.PersistentClient(path=CHROMA_DIR)
 
-_embed = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model_name=EMBED_MODEL,
-)
+_embed = get_embedding_function()      # EMBED_BACKEND=fake for offline runs
 
 COLLECTION_NAME = "docs"
 _collection = _db.get_or_create_collection(
@@ -53,7 +52,8 @@ def add_documents(docs: List[Dict[str, str]]) -> None:
     def flush():
         nonlocal ids, docs_texts, metas, budget
         if ids:
-            _collection.add(ids=ids, documents=docs_texts, metadatas=metas)
+            with span("rag.add_batch", items=len(ids), chars=budget) as sp, track_memory("rag.add_batch", into=sp):
+                _collection.add(ids=ids, documents=docs_texts, metadatas=metas)
             ids, docs_texts, metas, budget = [], [], [], 0
 
     for d in docs:
@@ -70,6 +70,7 @@ def add_documents(docs: List[Dict[str, str]]) -> None:
         budget += length
 
     flush()
+    cache.bump("corpus")        # cached answers built on the old corpus are now misses
 
 
 def query_topk(query: str, k: int = 3) -> List[Dict[str, Any]]:
@@ -100,6 +101,7 @@ def reset_collection() -> None:
         name=COLLECTION_NAME,
         embedding_function=_embed
     )
+    cache.bump("corpus")
 
 # tools/retriever.py
 def confident(results, max_distance=0.25) -> bool:
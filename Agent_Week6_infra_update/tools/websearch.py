@@ -2,14 +2,19 @@
 import os
 from typing import Dict, Any, List
 
+from infra import cassette
+
 def web_search(query: str, k: int = 5) -> Dict[str, Any]:
     """Return top-k web results {title, url, snippet}. Requires TAVILY_API_KEY."""
     key = os.getenv("TAVILY_API_KEY")
-    if not key:
+    if not key and cassette.CASSETTE_MODE != "replay":
         return {"error": "No web backend. Set TAVILY_API_KEY or replace web_search implementation."}
-    from tavily import TavilyClient
-    client = TavilyClient(api_key=key)
-    res = client.search(query=query, max_results=k, include_answer=False, include_raw_content=False)
+
+    def _search():
+        from tavily import TavilyClient
+        client = TavilyClient(api_key=key)
+        return client.search(query=query, max_results=k, include_answer=False, include_raw_content=False)
+    res = cassette.call("web_search", {"query": query, "k": k}, _search)
     items: List[Dict[str, str]] = []
     for r in res.get("results", []):
         items.append({"title": r.get("title",""), "url": r.get("url",""), "snippet": r.get("content","")})
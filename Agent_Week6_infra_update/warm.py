@@ -0,0 +1,174 @@
+# warm.py — pre-fill the answer cache after a deploy or cache wipe.
+# Goals come from the trace logs (agent.run.start / cache.hit events) plus eval/cases.py, are
+# grouped by cache key, ranked by frequency with exponential recency decay, and the top N are run
+# through run_agent_safe with bounded concurrency and a request rate limit.
+# Only answers shared across users are warmed: per-user classes (infra/canon.py user_scoped) are
+# skipped. Each goal is replayed as the user who asked it (their profile fields are part of the key),
+# read-only, so tools that would save preferences or facts write nothing.
+#   python warm.py                          # WARM_TOP_N goals from TRACE_FILE (+ rotations) and eval cases
+#   python warm.py --top 500 --rps 5 --concurrency 8 --dry-run
+#   CACHE_WARM=1 python app.py              # same job on a background thread at startup
+import os, sys, glob, json, time, argparse, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", "200"))
+WARM_CONCURRENCY = int(os.getenv("WARM_CONCURRENCY", "4"))
+WARM_RPS = float(os.getenv("WARM_RPS", "2"))                     # new LLM-backed requests per second
+WARM_HALF_LIFE_H = float(os.getenv("WARM_HALF_LIFE_H", "24"))    # a day-old request counts half
+WARM_MAX_AGE_H = float(os.getenv("WARM_MAX_AGE_H", "168"))
+WARM_CASE_WEIGHT = float(os.getenv("WARM_CASE_WEIGHT", "1.0"))   # score of each eval case
+
+
+class RateLimiter:
+    """Token bucket: at most `rps` acquisitions per second across threads (bursts up to 1s worth)."""
+
+    def __init__(self, rps: float):
+        self.rps = rps
+        self.tokens = max(1.0, rps)
+        self.t = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rps <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rps), self.tokens + (now - self.t) * self.rps)
+                self.t = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rps
+            time.sleep(wait)
+
+
+def trace_goals(paths: List[str], now: Optional[float] = None) -> List[Dict[str, Any]]:
+    now = now or time.time()
+    out = []
+    for p in paths:
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue
+                if e.get("event") not in ("agent.run.start", "cache.hit") or not e.get("user_goal"):
+                    continue
+                age_h = max(0.0, (now - e.get("ts", now)) / 3600)
+                if age_h <= WARM_MAX_AGE_H:
+                    out.append({"goal": e["user_goal"], "age_h": age_h, "user_id": e.get("user_id")})
+    return out
+
+def _key(goal: str, user_id: Optional[str]):
+    """(answer class, key) as the agent computes them for this user (None: the default user)."""
+    from agent import answer_cache_key
+    from infra import context
+    with context.use(user_id=user_id):
+        return answer_cache_key(goal)
+
+def rank(logged: List[Dict[str, Any]], include_cases: bool = True, skipped: Optional[Dict[str, int]] = None
+         ) -> List[Dict[str, Any]]:
+    """One entry per shared cache key: {key, goal (latest phrasing), user_id, count, score}, best first.
+    Goals of per-user classes are counted in skipped (by class) instead."""
+    from infra.canon import user_scoped
+    by_key: Dict[str, Dict[str, Any]] = {}
+    skipped = {} if skipped is None else skipped
+    for e in logged:
+        cls, key = _key(e["goal"], e.get("user_id"))
+        if user_scoped(cls):
+            skipped[cls] = skipped.get(cls, 0) + 1
+            continue
+        d = by_key.setdefault(key, {"key": key, "goal": e["goal"], "user_id": e.get("user_id"),
+                                    "count": 0, "score": 0.0, "age_h": e["age_h"]})
+        d["count"] += 1
+        d["score"] += 0.5 ** (e["age_h"] / WARM_HALF_LIFE_H)
+        if e["age_h"] < d["age_h"]:
+            d["goal"], d["user_id"], d["age_h"] = e["goal"], e.get("user_id"), e["age_h"]
+    if include_cases:
+        from eval.cases import CASES
+        for c in CASES:
+            cls, key = _key(c["q"], None)
+            if user_scoped(cls):
+                continue
+            d = by_key.setdefault(key, {"key": key, "goal": c["q"], "user_id": None, "count": 0, "score": 0.0,
+                                        "age_h": None})
+            d["score"] += WARM_CASE_WEIGHT
+    return sorted(by_key.values(), key=lambda d: -d["score"])
+
+
+def warm(paths: Optional[List[str]] = None, top: int = WARM_TOP_N, concurrency: int = WARM_CONCURRENCY,
+         rps: float = WARM_RPS, include_cases: bool = True, dry_run: bool = False) -> Dict[str, Any]:
+    from agent import run_agent_safe
+    from infra import context
+    from infra.cache import get as cache_get
+    from infra.tracing import log
+    if paths is None:
+        paths = sorted(glob.glob(os.getenv("TRACE_FILE", "traces/trace.jsonl") + "*"))
+    t0 = time.perf_counter()
+    logged = trace_goals(paths)
+    skipped: Dict[str, int] = {}
+    ranked = rank(logged, include_cases, skipped)
+    todo = ranked[:top]
+    status = {"cached": 0, "warmed": 0, "failed": 0, "pending": 0}
+    lock = threading.Lock()
+    limiter = RateLimiter(rps)
+
+    def one(d):
+        if cache_get(d["key"]) is not None:
+            s = "cached"
+        elif dry_run:
+            s = "pending"
+        else:
+            limiter.acquire()
+            try:
+                with context.use(user_id=d["user_id"], read_only=True):
+                    ans = run_agent_safe(d["goal"])
+                s = "failed" if ans.startswith(("Refused", "Stopped")) else "warmed"
+            except Exception as e:
+                log("warm.error", user_goal=d["goal"], error=str(e))
+                s = "failed"
+        with lock:
+            status[s] += 1
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="warm") as ex:
+        list(ex.map(one, todo))
+
+    # coverage: share of logged requests (and of distinct keys) whose answer is now in the cache
+    # (dry run: what would be covered once the selected keys are warmed)
+    selected = {d["key"] for d in todo} if dry_run else set()
+    logged_keys = [d for d in ranked if d["count"]]
+    covered = [d for d in logged_keys if d["key"] in selected or cache_get(d["key"]) is not None]
+    total = sum(d["count"] for d in logged_keys)
+    report = {
+        "trace_files": len(paths), "logged_requests": total, "distinct_keys": len(ranked),
+        "selected": len(todo), **status, "skipped_user_scoped": skipped,
+        "request_coverage": round(sum(d["count"] for d in covered) / total, 4) if total else None,
+        "key_coverage": round(len(covered) / len(logged_keys), 4) if logged_keys else None,
+        "duration_s": round(time.perf_counter() - t0, 2), "dry_run": dry_run,
+    }
+    log("warm.done", **report)
+    return report
+
+def warm_in_background(**kw) -> threading.Thread:
+    t = threading.Thread(target=warm, kwargs=kw, name="cache-warm", daemon=True)
+    t.start()
+    return t
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--traces", nargs="*", default=None, help="trace JSONL files (default: TRACE_FILE and rotations)")
+    ap.add_argument("--top", type=int, default=WARM_TOP_N)
+    ap.add_argument("--concurrency", type=int, default=WARM_CONCURRENCY)
+    ap.add_argument("--rps", type=float, default=WARM_RPS)
+    ap.add_argument("--no-cases", action="store_true", help="logged goals only")
+    ap.add_argument("--dry-run", action="store_true", help="rank and report, call nothing")
+    a = ap.parse_args(argv)
+    r = warm(a.traces, a.top, a.concurrency, a.rps, not a.no_cases, a.dry_run)
+    print(json.dumps(r, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))